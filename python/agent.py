@@ -8,20 +8,33 @@ import os
 from stable_baselines3.common.env_util import make_vec_env
 from stable_baselines3.common.torch_layers import BaseFeaturesExtractor
 from stable_baselines3.common.vec_env import DummyVecEnv
+import torch
 from torch import nn
 from stable_baselines3.common.vec_env import VecFrameStack
 
 from gymnasium_env.envs import GridWorldEnv
+import benchmark
 import callbacks
+import evaluate
+import expert_dataset
+import policy_export
+import vec_envs
 
 class CustomCNNFeatureExtractor(BaseFeaturesExtractor):
-    def __init__(self, observation_space, features_dim=512):
+    """
+    The size of the flattened conv output is measured with a dummy forward pass, so any grid size works; at 10x10
+    it is the 256 the extractor was first written for. Past `max_pooled_size` cells per side the conv output is
+    max-pooled down to max_pooled_size x max_pooled_size first, which keeps the linear layer the same size from
+    32x32 up to 256x256 grids. Pooling and flattening hold no weights, so the layer indices of the state dict are
+    the same either way and the saved 10x10 models keep loading.
+    """
+    def __init__(self, observation_space, features_dim=512, max_pooled_size=8):
         super(CustomCNNFeatureExtractor, self).__init__(observation_space, features_dim)
 
         n_input_channels = observation_space.shape[0]  # Get the number of image channels
         print(n_input_channels)
 
-        self.image_conv = nn.Sequential(
+        conv = nn.Sequential(
             nn.Conv2d(n_input_channels, 16, (2, 2)),
             nn.ReLU(),
             nn.MaxPool2d((2, 2)),
@@ -29,8 +42,22 @@ class CustomCNNFeatureExtractor(BaseFeaturesExtractor):
             nn.ReLU(),
             nn.Conv2d(32, 64, (2, 2)),
             nn.ReLU(),
-            nn.Flatten(),
-            nn.Linear(256, 512),
+        )
+
+        with torch.no_grad():
+            conv_shape = conv(torch.zeros(1, *observation_space.shape)).shape
+
+        if max_pooled_size is not None and max(conv_shape[2:]) > max_pooled_size:
+            flatten = nn.Sequential(nn.AdaptiveMaxPool2d(max_pooled_size), nn.Flatten())
+            n_flatten = conv_shape[1] * max_pooled_size * max_pooled_size
+        else:
+            flatten = nn.Flatten()
+            n_flatten = conv_shape[1] * conv_shape[2] * conv_shape[3]
+
+        self.image_conv = nn.Sequential(
+            *conv,
+            flatten,
+            nn.Linear(n_flatten, features_dim),
             nn.ReLU(),
         )
 
@@ -41,7 +68,7 @@ class CustomCNNFeatureExtractor(BaseFeaturesExtractor):
 
 
 
-def train_sb3(folder):
+def train_sb3(folder, vec_env_overrides=None, keep_checkpoints=3, weights_only=False, pretrain_path=None, pretrain_epochs=5):
 
     utils.seed(42)
 
@@ -59,6 +86,14 @@ def train_sb3(folder):
 
     policy_name = "MlpPolicy"
 
+    if pretrain_path:
+        # Behavior cloning is a warm start: run on a trained checkpoint it would overwrite the trained policy
+        if latest_model_path:
+            raise ValueError(f"--pretrain only pretrains a new model, but {model_dir} already holds {latest_model_path}. "
+                             f"Move the checkpoints of {model_dir} away to start over from the expert dataset.")
+        if not os.path.isfile(os.path.join(pretrain_path, "dataset.json")):
+            raise FileNotFoundError(f"No expert dataset in {pretrain_path}, "
+                                    f"run python python/agent.py --folder {folder} --expertDataset first")
 
 
     if env_config_path:
@@ -66,6 +101,7 @@ def train_sb3(folder):
         config = utils.load_config_from_py(env_config_path)
         env_kwargs = config.env_kwargs
         use_frame_stacking = config.use_frame_stacking
+        vec_env = utils.get_vec_env_config(config, vec_env_overrides)
     else:
         env_kwargs = {
             "size": 10,
@@ -77,12 +113,14 @@ def train_sb3(folder):
         }
 
         use_frame_stacking = False
+        vec_env = utils.get_vec_env_config(overrides=vec_env_overrides)
 
-        utils.save_env_config(env_kwargs, use_frame_stacking, config_dir)
+        utils.save_env_config(env_kwargs, use_frame_stacking, config_dir, vec_env)
 
-    env = make_vec_env(utils.make_env(**env_kwargs), n_envs=8, seed=42, vec_env_cls=DummyVecEnv)
+    print(f"Vec env: {vec_env}")
+    env = vec_envs.make_training_vec_env(env_kwargs, seed=42, **vec_env)
     if use_frame_stacking:
-        env = VecFrameStack(env, n_stack=4, channels_order='last')
+        env = VecFrameStack(env, n_stack=4, channels_order=utils.get_channels_order(env_kwargs))
 
     TIMESTEPS = 10000
 
@@ -133,23 +171,35 @@ def train_sb3(folder):
         model_name = model.__class__.__name__
         model_name = f"{model_name}_{args.folder}"
 
+    # One writer for the whole run, so a checkpoint is still being written while the next learn() call trains
+    checkpoint_writer = callbacks.CheckpointWriter(model_dir, model_name, keep_last=keep_checkpoints, weights_only=weights_only)
+
+    if pretrain_path:
+        # Behavior cloning on the shortest-path expert first, RL then fine-tunes an agent that already reaches the target
+        print(f"Pretraining on the expert dataset {pretrain_path}")
+        expert_dataset.pretrain(model, expert_dataset.ExpertDataset(pretrain_path), epochs=pretrain_epochs,
+                                frame_stack=evaluate.FRAME_STACK if use_frame_stacking else None,
+                                channels_order=utils.get_channels_order(env_kwargs))
+        checkpoint_writer.snapshot(model, model.num_timesteps)
+
     while True:
-        save_cb = callbacks.SaveOnTimestepCallback(model, model_dir, save_interval=TIMESTEPS, model_name=model_name)
-        mean_goal_cb = callbacks.MeanGoalAchievedCallback()
-        max_length_cb = callbacks.MaxEpisodeLengthCallback()
-        max_wrong_steps_cb = callbacks.MaxWrongStepsCallback()
+        save_cb = callbacks.SaveOnTimestepCallback(model, model_dir, save_interval=TIMESTEPS, model_name=model_name, writer=checkpoint_writer)
+        episode_stats_cb = callbacks.EpisodeStatsCallback()
+        training_callbacks = [save_cb, episode_stats_cb]
+        if env_kwargs.get("instrument"):
+            training_callbacks.append(callbacks.EnvStatsCallback())
 
 
 
         model.learn(
             total_timesteps=TIMESTEPS,
             reset_num_timesteps=False,
-            callback=[save_cb, mean_goal_cb, max_length_cb, max_wrong_steps_cb],
+            callback=training_callbacks,
             tb_log_name=model_name
         )
 
 
-def try_sb3(folder):
+def try_sb3(folder, viewer_process=False, use_export=False):
 
     utils.seed(42)
 
@@ -169,10 +219,10 @@ def try_sb3(folder):
     render_fps = 4
 
     if not use_frame_stacking:
-        env = gym.make("gymnasium_env/GridWorld-v0", render_mode="human", render_fps=render_fps, **env_kwargs)
+        env = gym.make("gymnasium_env/GridWorld-v0", render_mode="human", render_fps=render_fps, viewer_process=viewer_process, **env_kwargs)
 
         # Load model
-        model = PPO.load(f'{latest_model_path}', env=env)
+        model = policy_export.load_policy(model_dir, env=env, use_export=use_export)
 
         # Run a test
         for _ in range(episodes_desired_num):
@@ -196,12 +246,12 @@ def try_sb3(folder):
 
         env.close()
     else:
-        env = make_vec_env(utils.make_env(render_mode="human", **env_kwargs), n_envs=1, seed=42, vec_env_cls=DummyVecEnv)
-        env = VecFrameStack(env, n_stack=4, channels_order='last')
+        env = make_vec_env(utils.make_env(render_mode="human", viewer_process=viewer_process, **env_kwargs), n_envs=1, seed=42, vec_env_cls=DummyVecEnv)
+        env = VecFrameStack(env, n_stack=4, channels_order=utils.get_channels_order(env_kwargs))
 
-        model = PPO.load(f'{latest_model_path}', env=env)
+        model = policy_export.load_policy(model_dir, env=env, use_export=use_export)
 
-        print(model.policy)
+        print(getattr(model, "policy", model))
         # Run a test
         for _ in range(episodes_desired_num):
             obs = env.reset()
@@ -221,7 +271,7 @@ def try_sb3(folder):
 
         env.close()
 
-def eval_sb3():
+def eval_sb3(viewer_process=False, use_export=False):
     utils.seed(42)
 
     folder = "experiment2"
@@ -241,10 +291,10 @@ def eval_sb3():
     visited_cells = []
     grid_size = env_kwargs["size"]
 
-    env = gym.make("gymnasium_env/GridWorld-v0", render_mode="human", render_fps=render_fps, **env_kwargs)
+    env = gym.make("gymnasium_env/GridWorld-v0", render_mode="human", render_fps=render_fps, viewer_process=viewer_process, **env_kwargs)
 
     # Load model
-    model = PPO.load(f'{latest_model_path}', env=env)
+    model = policy_export.load_policy(model_dir, env=env, use_export=use_export)
 
     # Run a test
     for i in range(episodes_desired_num):
@@ -274,6 +324,16 @@ def eval_sb3():
     utils.save_agent_positions(visited_cells, args.folder, grid_size)
     env.close()
 
+def export_sb3(folder, export_format="torchscript", precision="float32"):
+    model_dir = os.path.join("models", folder)
+    latest_model_path = utils.get_latest_model_path(model_dir)
+    print(latest_model_path)
+
+    model = PPO.load(latest_model_path, device="cpu")
+    path = policy_export.export_path(model_dir, export_format, precision)
+    policy_export.export_policy(model, path, export_format, precision, source=latest_model_path)
+    print(f"Exported policy: {path}")
+
 
 
 # ------------- sb3 -------------
@@ -287,15 +347,66 @@ if __name__ == '__main__':
                        help="Test the model")
     group.add_argument("--testEval", action="store_true",
                        help="Test the model with evaluation (record visited cells)")
+    group.add_argument("--benchmark", action="store_true",
+                       help="Benchmark env throughput and write the results to benchmarks/")
+    group.add_argument("--evaluate", action="store_true",
+                       help="Evaluate the latest checkpoint headless on a process pool and write metrics to evaluations/")
+    group.add_argument("--expertDataset", action="store_true",
+                       help="Record shortest-path expert episodes of the env of --folder into datasets/<folder>")
+    group.add_argument("--pretrain", action="store_true",
+                       help="Pretrain the policy of --folder on its expert dataset (behavior cloning), then train")
+    group.add_argument("--export", action="store_true",
+                       help="Export the policy of the latest model of --folder for inference")
 
     parser.add_argument("--folder", default=None,
                         help="name of the folder")
+    parser.add_argument("--vecEnv", choices=vec_envs.VEC_ENV_BACKENDS, default=None,
+                        help="vec env backend for training (overrides vec_env in env_config.py)")
+    parser.add_argument("--nEnvs", type=int, default=None,
+                        help="number of training environments")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes/threads of the shm and thread backends, processes of --evaluate")
+    parser.add_argument("--pinCpus", action="store_true", default=None,
+                        help="keep torch threads and env workers on separate cores")
+    parser.add_argument("--torchThreads", type=int, default=None,
+                        help="cores left to torch when pinning")
+    parser.add_argument("--format", choices=policy_export.EXPORT_FORMATS, default="torchscript",
+                        help="file format of --export")
+    parser.add_argument("--precision", choices=policy_export.EXPORT_PRECISIONS, default="float32",
+                        help="precision of --export")
+    parser.add_argument("--episodes", type=int, default=None,
+                        help="episodes of --evaluate (default 100) and --expertDataset (default 10000)")
+    parser.add_argument("--bcEpochs", type=int, default=5,
+                        help="behavior cloning epochs of --pretrain")
+    parser.add_argument("--keepCheckpoints", type=int, default=3,
+                        help="checkpoints of --train kept in models/<folder>, oldest deleted first; 0 keeps all of them")
+    parser.add_argument("--weightsOnly", action="store_true",
+                        help="with --train, also write the policy state dict alone next to every checkpoint")
+    parser.add_argument("--viewerProcess", action="store_true",
+                        help="with --test / --testEval, draw the window in a separate process and run the episodes at full speed")
+    parser.add_argument("--useExport", action="store_true",
+                        help="with --test / --testEval, run the newest export of --export instead of the latest checkpoint")
 
     args = parser.parse_args()
 
-    if args.train:
-        train_sb3(args.folder)
+    if args.train or args.pretrain:
+        train_sb3(args.folder, vec_env_overrides={
+            "backend": args.vecEnv,
+            "n_envs": args.nEnvs,
+            "n_workers": args.workers,
+            "pin_cpus": args.pinCpus,
+            "torch_threads": args.torchThreads,
+        }, keep_checkpoints=args.keepCheckpoints, weights_only=args.weightsOnly,
+            pretrain_path=expert_dataset.default_path(args.folder) if args.pretrain else None, pretrain_epochs=args.bcEpochs)
     elif args.test:
-        try_sb3(args.folder)
+        try_sb3(args.folder, viewer_process=args.viewerProcess, use_export=args.useExport)
     elif args.testEval:
-        eval_sb3()
\ No newline at end of file
+        eval_sb3(viewer_process=args.viewerProcess, use_export=args.useExport)
+    elif args.benchmark:
+        benchmark.run_suite(n_envs=args.nEnvs or 8, n_workers=args.workers)
+    elif args.evaluate:
+        evaluate.evaluate(args.folder, n_episodes=args.episodes or 100, n_workers=args.workers)
+    elif args.expertDataset:
+        expert_dataset.generate(args.folder, n_episodes=args.episodes or 10000, n_workers=args.workers)
+    elif args.export:
+        export_sb3(args.folder, args.format, args.precision)
\ No newline at end of file
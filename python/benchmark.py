@@ -0,0 +1,400 @@
+import argparse
+import datetime
+import itertools
+import json
+import multiprocessing as mp
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import bridge_protocol
+import vec_envs
+from gymnasium_env.envs import GridWorldEnv, RealWorldEnv
+
+
+# "env" is a bare GridWorldEnv without any VecEnv around it
+BACKENDS = ("env",) + vec_envs.VEC_ENV_BACKENDS
+
+BASELINE = {
+    "env": "GridWorld",
+    "policy": "CnnPolicy",
+    "size": 10,
+    "num_obstacles": 15,
+    "num_patterns": 0,
+    "target_moving_pattern": 0,
+    "backend": "env",
+}
+
+# Values tried for each axis; the default sweep changes one axis of BASELINE at a time, --full runs every combination
+AXES = {
+    "policy": ["CnnPolicy", "MlpPolicy", "LocalPolicy"],
+    "size": [10, 20, 40],
+    "num_obstacles": [0, 15],
+    "num_patterns": [0, 10],
+    "target_moving_pattern": [0, 1, 2],
+    "backend": list(BACKENDS),
+}
+
+REAL_WORLD_SIZES = [10, 20, 40]
+
+# Fields that identify a case when two result files are compared
+CASE_KEYS = ("env",) + tuple(AXES) + ("n_envs",)
+
+
+def sweep_cases(full=False):
+    """The GridWorld cases of the suite, then one RealWorld case per size."""
+    if full:
+        cases = [dict(BASELINE, **dict(zip(AXES, values))) for values in itertools.product(*AXES.values())]
+    else:
+        cases = [dict(BASELINE)]
+        for axis, values in AXES.items():
+            cases += [dict(BASELINE, **{axis: value}) for value in values if value != BASELINE[axis]]
+
+    cases += [dict(BASELINE, env="RealWorld", policy="MlpPolicy", size=size) for size in REAL_WORLD_SIZES]
+    return cases
+
+
+def _env_kwargs(case):
+    return {
+        "size": case["size"],
+        "num_obstacles": case["num_obstacles"],
+        "num_patterns": case["num_patterns"],
+        "target_moving_pattern": case["target_moving_pattern"],
+        "policy": case["policy"],
+    }
+
+
+class _SingleEnvDriver:
+    """Steps one gym.Env the way GridWorldEnv is used by try_sb3: reset by hand when an episode ends."""
+
+    def __init__(self, case, seed):
+        if case["env"] == "RealWorld":
+            self.env = RealWorldEnv(size=case["size"])
+        else:
+            self.env = GridWorldEnv(**_env_kwargs(case))
+        self.real_world = case["env"] == "RealWorld"
+        self.n_envs = 1
+        self.rng = np.random.default_rng(seed)
+        self.seed = seed
+
+    def reset(self):
+        if self.real_world:
+            self._move_drawables()
+        self.env.reset(seed=self.seed)
+        self.seed = None
+
+    def step(self, actions):
+        if self.real_world:
+            # RealWorldEnv does not move anything itself, the Node server sends the new positions every tick
+            self._move_drawables()
+        _, _, terminated, truncated, _ = self.env.step(int(actions[0]))
+        if terminated or truncated:
+            self.env.reset()
+
+    def _move_drawables(self):
+        agent, target = self.rng.integers(1, self.env.size - 1, size=(2, 2))
+        self.env.updateDrawables(
+            agent={"cellX": int(agent[0]), "cellY": int(agent[1])},
+            target={"cellX": int(target[0]), "cellY": int(target[1])},
+        )
+
+    def close(self):
+        self.env.close()
+
+
+class _VecEnvDriver:
+    def __init__(self, case, seed, n_envs, n_workers):
+        self.env = vec_envs.make_training_vec_env(_env_kwargs(case), backend=case["backend"], n_envs=n_envs, n_workers=n_workers, seed=seed)
+        self.n_envs = n_envs
+
+    def reset(self):
+        self.env.reset()
+
+    def step(self, actions):
+        self.env.step(actions)
+
+    def close(self):
+        self.env.close()
+
+
+def _is_single_env(case):
+    return case["backend"] == "env" or case["env"] == "RealWorld"
+
+
+def _make_driver(case, seed, n_envs, n_workers):
+    if _is_single_env(case):
+        return _SingleEnvDriver(case, seed)
+    return _VecEnvDriver(case, seed, n_envs, n_workers)
+
+
+def _children_rss():
+    """Resident memory of this process's multiprocessing children (Linux only, 0 elsewhere)."""
+    total = 0
+    for child in mp.active_children():
+        try:
+            with open(f"/proc/{child.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total
+
+
+def _measure_memory(case, seed, n_envs, n_workers, steps):
+    """
+    Python heap allocated by building the envs and running them for a few steps, plus the resident memory of any
+    worker processes, divided by the number of envs. Kept apart from the timed run since tracemalloc slows it down.
+    """
+    tracemalloc.start()
+    driver = _make_driver(case, seed, n_envs, n_workers)
+    driver.reset()
+    actions = np.zeros(driver.n_envs, dtype=np.int64)
+    for _ in range(steps):
+        driver.step(actions)
+    _, heap_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    worker_rss = _children_rss()
+    driver.close()
+    return {
+        "heap_bytes_per_env": heap_peak / driver.n_envs,
+        "worker_rss_bytes_per_env": worker_rss / driver.n_envs if worker_rss else None,
+    }
+
+
+def run_case(case, steps=2000, resets=200, n_envs=8, n_workers=None, warmup=100, seed=42):
+    """
+    Times `steps` step() calls and `resets` reset() calls of one case. A step call advances every env of the
+    driver, so steps_per_sec counts env steps; latencies are per call.
+    """
+    driver = _make_driver(case, seed, n_envs, n_workers)
+    rng = np.random.default_rng(seed)
+    actions = rng.integers(0, 4, size=(steps + warmup, driver.n_envs))
+
+    driver.reset()
+    for i in range(warmup):
+        driver.step(actions[i])
+
+    latencies = np.empty(steps)
+    start = time.perf_counter()
+    for i in range(steps):
+        call_start = time.perf_counter()
+        driver.step(actions[warmup + i])
+        latencies[i] = time.perf_counter() - call_start
+    step_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(resets):
+        driver.reset()
+    reset_seconds = time.perf_counter() - start
+    driver.close()
+
+    result = dict(case, n_envs=driver.n_envs)
+    result.update({
+        "steps_per_sec": steps * driver.n_envs / step_seconds,
+        "resets_per_sec": resets * driver.n_envs / reset_seconds,
+        "step_latency_us": {
+            f"p{q}": float(np.percentile(latencies, q) * 1e6) for q in (50, 90, 99)
+        } | {"max": float(latencies.max() * 1e6)},
+    })
+    result.update(_measure_memory(case, seed, n_envs, n_workers, steps=min(steps, 200)))
+    return result
+
+
+def _metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run_suite(output_path=None, full=False, steps=2000, resets=200, n_envs=8, n_workers=None, cases=None):
+    """Runs every case, prints one line per case and writes {"meta": ..., "results": [...]} to `output_path`."""
+    if output_path is None:
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_path = os.path.join("benchmarks", f"benchmark_{stamp}.json")
+
+    results = []
+    for case in cases or sweep_cases(full):
+        try:
+            result = run_case(case, steps=steps, resets=resets, n_envs=n_envs, n_workers=n_workers)
+        except Exception as e:  # one broken configuration should not lose the rest of the suite
+            results.append(dict(case, n_envs=1 if _is_single_env(case) else n_envs, error=repr(e)))
+            print(f"{_case_name(results[-1]):<90} failed: {e!r}")
+            continue
+        results.append(result)
+        print(f"{_case_name(result):<90} {result['steps_per_sec']:>12.0f} steps/s {result['resets_per_sec']:>10.0f} resets/s "
+              f"p99 {result['step_latency_us']['p99']:>8.1f} us")
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump({"meta": _metadata(), "results": results}, f, indent=2)
+    print(f"Results written to {output_path}")
+    return results
+
+
+def compare(baseline_path, candidate_path):
+    """Prints the steps/sec and resets/sec ratio candidate / baseline of every case present in both files."""
+    with open(baseline_path) as f:
+        baseline = {_case_key(result): result for result in json.load(f)["results"]}
+    with open(candidate_path) as f:
+        candidate = json.load(f)["results"]
+
+    for result in candidate:
+        old = baseline.get(_case_key(result))
+        if old is None or "error" in old or "error" in result:
+            continue
+        print(f"{_case_name(result):<90} steps x{result['steps_per_sec'] / old['steps_per_sec']:>6.2f} "
+              f"resets x{result['resets_per_sec'] / old['resets_per_sec']:>6.2f}")
+
+
+_PYTHON_DIR = os.path.dirname(os.path.abspath(__file__))
+_REPO_DIR = os.path.dirname(_PYTHON_DIR)
+
+# Run in a fresh interpreter per repeat, so that no import or forkserver of an earlier repeat is reused
+_WORKER_STARTUP_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import vec_envs
+imported = time.perf_counter()
+env = vec_envs.make_training_vec_env({env_kwargs!r}, backend={backend!r}, n_envs={n_envs}, n_workers={n_workers}, seed=0)
+env.reset()
+env.step([0] * env.num_envs)
+stepped = time.perf_counter()
+env.close()
+print(json.dumps({{"import_s": imported - start, "first_step_s": stepped - imported}}))
+"""
+
+
+def _child_env():
+    env = dict(os.environ, SDL_VIDEODRIVER=os.environ.get("SDL_VIDEODRIVER", "dummy"))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [_PYTHON_DIR, os.path.join(_PYTHON_DIR, "gym_world"), env.get("PYTHONPATH")]))
+    return env
+
+
+def _framed(payload):
+    return bridge_protocol.LENGTH.pack(len(payload)) + payload
+
+
+def measure_interface_startup(size=10, cell_pixels=250):
+    """
+    Seconds from spawning interface.py the way server.js does to the first reply that moves the agent, for one
+    agent chasing one player, plus the part of it spent before the process read its first message.
+    """
+    one_time_data = json.dumps({
+        "gameBoundsDimensions": {"width": size * cell_pixels, "height": size * cell_pixels},
+        "pathGridDimensions": {"rows": size, "cols": size},
+        "unwalkableCellsExpanded": [],
+        "evalMode": False,
+    }).encode()
+    records = np.zeros(2, dtype=bridge_protocol.DRAWABLE_RECORD)
+    records["id"] = [0, 1]
+    records["speed"] = 5
+    records["x"] = records["y"] = [1.5 * cell_pixels, (size - 1.5) * cell_pixels]
+
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(_PYTHON_DIR, "interface.py")], cwd=_REPO_DIR, env=_child_env(),
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        process.stdin.write(_framed(bytes([bridge_protocol.MESSAGE_ONE_TIME_DATA]) + one_time_data))
+        tick = 0
+        while True:
+            header = bridge_protocol.DRAWABLES_HEADER.pack(bridge_protocol.MESSAGE_DRAWABLES, tick, 1, 1)
+            process.stdin.write(_framed(header + records.tobytes()))
+            process.stdin.flush()
+            message = bridge_protocol.read_message(process.stdout)
+            if message is None:
+                raise RuntimeError(f"interface.py exited with {process.wait()} before answering")
+            _, _, count = bridge_protocol.DELTAS_HEADER.unpack_from(message[1])
+            if count:
+                return {"time_to_first_action_s": time.perf_counter() - start, "ticks": tick + 1}
+            tick += 1
+    finally:
+        process.stdin.close()
+        process.kill()
+        process.wait()
+
+
+def measure_worker_startup(backend="shm", n_envs=8, n_workers=None, env_kwargs=None):
+    """
+    Seconds a fresh training process spends importing vec_envs, then building a `backend` VecEnv of `n_envs`
+    GridWorld envs and getting its first step back, which is dominated by the worker processes starting up.
+    """
+    env_kwargs = env_kwargs or {"size": 10, "num_obstacles": 15, "policy": "CnnPolicy"}
+    script = _WORKER_STARTUP_SCRIPT.format(env_kwargs=env_kwargs, backend=backend, n_envs=n_envs, n_workers=n_workers)
+    output = subprocess.run([sys.executable, "-c", script], cwd=_REPO_DIR, env=_child_env(),
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def run_startup(output_path=None, repeats=3, n_envs=8, n_workers=None, backends=("subproc", "shm")):
+    """Median over `repeats` fresh processes of the interface.py and vec-env worker startup times."""
+    if output_path is None:
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_path = os.path.join("benchmarks", f"startup_{stamp}.json")
+
+    interface = [measure_interface_startup()["time_to_first_action_s"] for _ in range(repeats)]
+    results = {"interface": {"time_to_first_action_s": float(np.median(interface))}}
+    print(f"{'interface.py':<30} first action {results['interface']['time_to_first_action_s'] * 1000:>8.0f} ms")
+    for backend in backends:
+        runs = [measure_worker_startup(backend, n_envs=n_envs, n_workers=n_workers) for _ in range(repeats)]
+        results[backend] = {key: float(np.median([run[key] for run in runs])) for key in runs[0]}
+        results[backend]["n_envs"] = n_envs
+        print(f"{backend + ' workers':<30} import {results[backend]['import_s'] * 1000:>8.0f} ms "
+              f"first step {results[backend]['first_step_s'] * 1000:>8.0f} ms")
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump({"meta": _metadata(), "startup": results}, f, indent=2)
+    print(f"Results written to {output_path}")
+    return results
+
+
+def _case_key(result):
+    return tuple(result.get(key) for key in CASE_KEYS)
+
+
+def _case_name(result):
+    return " ".join(f"{key}={result[key]}" for key in CASE_KEYS)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark GridWorldEnv and RealWorldEnv throughput")
+    parser.add_argument("--output", default=None,
+                        help="JSON file to write (default benchmarks/benchmark_<timestamp>.json)")
+    parser.add_argument("--full", action="store_true",
+                        help="run every combination of the axes instead of one axis at a time")
+    parser.add_argument("--steps", type=int, default=2000,
+                        help="timed step calls per case")
+    parser.add_argument("--resets", type=int, default=200,
+                        help="timed reset calls per case")
+    parser.add_argument("--nEnvs", type=int, default=8,
+                        help="environments of the vec-env backends")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="workers of the shm and thread backends")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"), default=None,
+                        help="compare two result files instead of running the suite")
+    parser.add_argument("--startup", action="store_true",
+                        help="measure interface.py time-to-first-action and vec-env worker time-to-first-step instead")
+
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    elif args.startup:
+        run_startup(args.output, n_envs=args.nEnvs, n_workers=args.workers)
+    else:
+        run_suite(args.output, full=args.full, steps=args.steps, resets=args.resets, n_envs=args.nEnvs, n_workers=args.workers)
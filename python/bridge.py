@@ -0,0 +1,120 @@
+import collections
+import queue
+import threading
+import time
+
+import numpy as np
+
+import bridge_protocol
+
+
+class BridgeStats:
+    """
+    Counters of the interface.py pipeline: drawables snapshots received, dropped because a newer one arrived before
+    inference got to them, and answered; the depth of the reply queue; and the latency from the moment a snapshot
+    was read to the moment its reply was written, over the last `window` replies.
+    """
+
+    def __init__(self, window=1000):
+        self.received = 0
+        self.dropped = 0
+        self.answered = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.latencies = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def summary(self):
+        with self._lock:
+            latencies = np.array(self.latencies) * 1000
+            line = (f"bridge: received {self.received} dropped {self.dropped} answered {self.answered} "
+                    f"queue depth {self.queue_depth} (max {self.max_queue_depth})")
+        if len(latencies):
+            line += f" latency p50 {np.percentile(latencies, 50):.1f} ms p99 {np.percentile(latencies, 99):.1f} ms max {latencies.max():.1f} ms"
+        return line
+
+
+class SnapshotReader(threading.Thread):
+    """
+    Reads the messages of the server as they come. One-time data is kept in order, but of the drawables only the
+    newest snapshot is kept: when inference falls behind, the snapshots it did not get to are dropped instead of
+    queuing up in the pipe, so it always acts on the latest positions.
+    """
+
+    def __init__(self, stream, stats):
+        super().__init__(name="bridge-reader", daemon=True)
+        self.stream = stream
+        self.stats = stats
+        self._condition = threading.Condition()
+        self._control = collections.deque()
+        self._latest = None
+        self._closed = False
+
+    def run(self):
+        try:
+            while (message := bridge_protocol.read_message(self.stream)) is not None:
+                message_type, payload = message
+                with self._condition:
+                    if message_type == bridge_protocol.MESSAGE_DRAWABLES:
+                        with self.stats._lock:
+                            self.stats.received += 1
+                            if self._latest is not None:
+                                self.stats.dropped += 1
+                        self._latest = (message_type, payload, time.perf_counter())
+                    else:
+                        self._control.append((message_type, payload, time.perf_counter()))
+                    self._condition.notify()
+        finally:
+            with self._condition:
+                self._closed = True
+                self._condition.notify()
+
+    def next(self, timeout=None):
+        """
+        The next one-time message if there is one, else the newest drawables, as (type, payload, received_at).
+        Blocks until there is one; returns None once the server closed the stream and everything was consumed,
+        or after `timeout` seconds without a message.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._control or self._latest is not None or self._closed, timeout):
+                return None
+            if self._control:
+                return self._control.popleft()
+            message, self._latest = self._latest, None
+            return message
+
+    @property
+    def closed(self):
+        with self._condition:
+            return self._closed and not self._control and self._latest is None
+
+
+class ReplyWriter(threading.Thread):
+    """Writes the replies of the inference stage to the server in the order they were produced."""
+
+    def __init__(self, stream, stats):
+        super().__init__(name="bridge-writer", daemon=True)
+        self.stream = stream
+        self.stats = stats
+        self._queue = queue.Queue()
+
+    def put(self, message, received_at):
+        self._queue.put((message, received_at))
+        with self.stats._lock:
+            self.stats.queue_depth = self._queue.qsize()
+            self.stats.max_queue_depth = max(self.stats.max_queue_depth, self.stats.queue_depth)
+
+    def run(self):
+        while (item := self._queue.get()) is not None:
+            message, received_at = item
+            self.stream.write(message)
+            self.stream.flush()
+            with self.stats._lock:
+                self.stats.answered += 1
+                self.stats.queue_depth = self._queue.qsize()
+                self.stats.latencies.append(time.perf_counter() - received_at)
+
+    def close(self):
+        """Writes what is still queued and stops."""
+        self._queue.put(None)
+        self.join()
@@ -0,0 +1,56 @@
+"""
+Binary messages between the Node server (server/functions.js) and interface.py, in both directions a little-endian
+uint32 payload length followed by the payload, whose first byte is the message type.
+
+  MESSAGE_ONE_TIME_DATA  Node -> Python  type, then the UTF-8 JSON that sendOneTimeDataToPython used to send
+  MESSAGE_DRAWABLES      Node -> Python  type, uint32 tick, uint16 agents, uint16 players, then one DRAWABLE_RECORD
+                                         per agent followed by one per player; nothing else of the world is sent
+  MESSAGE_DELTAS         Python -> Node  type, uint32 tick of the drawables it answers, uint16 count, then one
+                                         DELTA_RECORD per drawable to move, to be added to its topLeftX / topLeftY
+"""
+
+import struct
+
+import numpy as np
+
+
+MESSAGE_ONE_TIME_DATA = 0
+MESSAGE_DRAWABLES = 1
+MESSAGE_DELTAS = 2
+
+LENGTH = struct.Struct("<I")
+DRAWABLES_HEADER = struct.Struct("<BIHH")
+DELTAS_HEADER = struct.Struct("<BIH")
+
+# x and y are the center of the drawable in pixels, the cell is derived from them on the Python side
+DRAWABLE_RECORD = np.dtype([("id", "<i4"), ("speed", "<f4"), ("x", "<f8"), ("y", "<f8")])
+DELTA_RECORD = np.dtype([("id", "<i4"), ("dx", "<f8"), ("dy", "<f8")])
+
+
+def read_message(stream):
+    """Reads one message from a binary stream; returns (type, payload) or None at the end of the stream."""
+    header = stream.read(LENGTH.size)
+    if len(header) < LENGTH.size:
+        return None
+    (length,) = LENGTH.unpack(header)
+    payload = stream.read(length)
+    if len(payload) < length:
+        return None
+    return payload[0], payload
+
+
+def decode_drawables(payload):
+    """The tick and the agent and player records of a MESSAGE_DRAWABLES payload, as read-only views into it (no copy)."""
+    _, tick, n_agents, n_players = DRAWABLES_HEADER.unpack_from(payload)
+    records = np.frombuffer(payload, dtype=DRAWABLE_RECORD, count=n_agents + n_players, offset=DRAWABLES_HEADER.size)
+    return tick, records[:n_agents], records[n_agents:]
+
+
+def encode_deltas(tick, ids, deltas):
+    """A MESSAGE_DELTAS message answering `tick`, length prefix included, moving drawable ids[k] by deltas[k] = (dx, dy)."""
+    records = np.empty(len(ids), dtype=DELTA_RECORD)
+    records["id"] = ids
+    records["dx"] = deltas[:, 0]
+    records["dy"] = deltas[:, 1]
+    payload_length = DELTAS_HEADER.size + records.nbytes
+    return LENGTH.pack(payload_length) + DELTAS_HEADER.pack(MESSAGE_DELTAS, tick, len(ids)) + records.tobytes()
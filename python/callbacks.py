@@ -1,98 +1,279 @@
+import atexit
+import copy
 import os
-import shutil
+import queue
+import re
+import threading
+import zipfile
 
 import numpy as np
+import stable_baselines3 as sb3
+import torch as th
 from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.save_util import data_to_json, recursive_getattr
+from stable_baselines3.common.utils import get_system_info
+
+class CheckpointWriter:
+    """
+    Writes checkpoint snapshots on a background thread. A snapshot is taken on the training thread (the JSON of the
+    model attributes and copies of its state dicts, which is quick) and written as the zip PPO.save() writes, under a
+    temporary name renamed into place once complete: a crash mid-write never leaves a truncated checkpoint behind, and
+    the previous ones are only removed after the new one exists. The `keep_last` newest checkpoints of `model_name`
+    are kept, all of them with keep_last=0. With `weights_only`, the policy state dict is also written alone next to each zip as
+    <name>_<timesteps>_policy.pth, a small file torch.load() reads straight into model.policy.load_state_dict().
+    """
+
+    def __init__(self, save_path, model_name, keep_last=3, weights_only=False):
+        if keep_last < 0:
+            raise ValueError(f"keep_last must be 0 (keep every checkpoint) or more, got {keep_last}")
+        self.save_path = save_path
+        self.model_name = model_name
+        self.keep_last = keep_last
+        self.weights_only = weights_only
+        self._pending = queue.Queue(maxsize=1)  # at most one snapshot waits while another one is written
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="checkpoint-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)  # Ctrl-C ends training: let the snapshot being written reach the disk
+
+    def snapshot(self, model, num_timesteps):
+        """Queues a checkpoint of `model`; only blocks if the previous snapshot is still waiting to be written."""
+        self._raise_error()
+        # What BaseAlgorithm.save() puts in the zip, with the attributes serialized and the tensors copied now, so
+        # that training can go on changing the model while the snapshot is written
+        data = model.__dict__.copy()
+        exclude = set(model._excluded_save_params())
+        state_dicts_names, torch_variable_names = model._get_torch_save_params()
+        for torch_var in state_dicts_names + torch_variable_names:
+            exclude.add(torch_var.split(".")[0])
+        for param_name in exclude:
+            data.pop(param_name, None)
+        pytorch_variables = {name: copy.deepcopy(recursive_getattr(model, name)) for name in torch_variable_names}
+        params = copy.deepcopy(model.get_parameters())
+        self._pending.put((num_timesteps, data_to_json(data), params, pytorch_variables))
+
+    def _checkpoint_path(self, num_timesteps, suffix=".zip"):
+        return os.path.join(self.save_path, f"{self.model_name}_{num_timesteps}{suffix}")
+
+    def _run(self):
+        while True:
+            snapshot = self._pending.get()
+            try:
+                if snapshot is None:
+                    return
+                self._write(*snapshot)
+                if self.keep_last:
+                    self._prune()
+            except Exception as e:  # raised on the training thread by the next snapshot() or close()
+                self._error = e
+            finally:
+                self._pending.task_done()
+
+    def _write(self, num_timesteps, serialized_data, params, pytorch_variables):
+        os.makedirs(self.save_path, exist_ok=True)
+        checkpoint_path = self._checkpoint_path(num_timesteps)
+        temporary_path = checkpoint_path + ".tmp"
+        # The layout of stable_baselines3.common.save_util.save_to_zip_file(), so PPO.load() and numpy_policy read it
+        with zipfile.ZipFile(temporary_path, mode="w") as archive:
+            archive.writestr("data", serialized_data)
+            if pytorch_variables:
+                with archive.open("pytorch_variables.pth", mode="w", force_zip64=True) as f:
+                    th.save(pytorch_variables, f)
+            for file_name, state_dict in params.items():
+                with archive.open(file_name + ".pth", mode="w", force_zip64=True) as f:
+                    th.save(state_dict, f)
+            archive.writestr("_stable_baselines3_version", sb3.__version__)
+            archive.writestr("system_info.txt", get_system_info(print_info=False)[1])
+        os.replace(temporary_path, checkpoint_path)
+
+        if self.weights_only:
+            weights_path = self._checkpoint_path(num_timesteps, "_policy.pth")
+            th.save(params["policy"], weights_path + ".tmp")
+            os.replace(weights_path + ".tmp", weights_path)
+
+    def _prune(self):
+        pattern = re.compile(re.escape(self.model_name) + r"_(\d+)(\.zip|_policy\.pth)$")
+        checkpoints = {}
+        for file_name in os.listdir(self.save_path):
+            match = pattern.match(file_name)
+            if match:
+                checkpoints.setdefault(int(match.group(1)), []).append(file_name)
+        for num_timesteps in sorted(checkpoints)[:-self.keep_last]:
+            for file_name in checkpoints[num_timesteps]:
+                os.remove(os.path.join(self.save_path, file_name))
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(f"writing a checkpoint to {self.save_path} failed") from error
+
+    def flush(self):
+        """Waits until every queued snapshot is on disk."""
+        self._pending.join()
+        self._raise_error()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._pending.put(None)
+            self._thread.join()
+        atexit.unregister(self.close)
+        self._raise_error()
+
 
 class SaveOnTimestepCallback(BaseCallback):
-    def __init__(self, model, save_path, save_interval, model_name):
+    """
+    Checkpoints the model every `save_interval` timesteps through `writer` (a CheckpointWriter), or through one of
+    its own created with `keep_last` and `weights_only`. Reuse a writer across learn() calls: it keeps writing while
+    the next call trains.
+    """
+    def __init__(self, model, save_path, save_interval, model_name, keep_last=3, weights_only=False, writer=None):
         super(SaveOnTimestepCallback, self).__init__()
         self.model = model
         self.save_path = save_path
         self.save_interval = save_interval
         self.last_save = 0
         self.model_name = model_name
+        self.writer = writer or CheckpointWriter(save_path, model_name, keep_last, weights_only)
 
     def _on_step(self) -> bool:
         # Check if we reached the save interval
         if self.num_timesteps - self.last_save >= self.save_interval:
             self.last_save = self.num_timesteps
-            checkpoint_path = os.path.join(self.save_path, f"{self.model_name}_{self.num_timesteps}.zip")
-            # Delete previous checkpoint
-            shutil.rmtree(self.save_path)
-            os.makedirs(self.save_path)
-
-            self.model.save(checkpoint_path)
+            self.writer.snapshot(self.model, self.num_timesteps)
 
         return True
 
 
 
-class MeanGoalAchievedCallback(BaseCallback):
-    def __init__(self, verbose=0):
-        super().__init__(verbose)
-        self.final_rewards = []
+class IntegerSketch:
+    """
+    Fixed-size histogram of non-negative integer values (episode lengths, wrong steps): quantiles are exact for values
+    below `capacity`, larger ones are counted in a last overflow bin, and the maximum is always exact.
+    """
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.counts = np.zeros(capacity + 1, dtype=np.int64)
+        self.max = None
 
-    def _on_step(self) -> bool:
-        done = self.locals.get("dones")  # vector of done flags or bool
-        rewards = self.locals.get("rewards")
+    def add(self, values):
+        values = np.asarray(values, dtype=np.int64)
+        if values.size:
+            self.counts += np.bincount(np.minimum(values, self.capacity), minlength=self.capacity + 1)
+            self.max = int(values.max()) if self.max is None else max(self.max, int(values.max()))
 
-        if done is not None and rewards is not None:
-            for d, r in zip(done, rewards):
-                if d:  # episode done
-                    clipped_reward = 1 if r > 0 else 0
-                    self.final_rewards.append(clipped_reward)
+    def quantile(self, q):
+        cumulative = np.cumsum(self.counts)
+        return int(np.searchsorted(cumulative, q * cumulative[-1]))
 
-        return True
+    def __len__(self):
+        return int(self.counts.sum())
 
-    def _on_rollout_end(self) -> None:
-        # Log mean final reward to TensorBoard at rollout end
-        if self.final_rewards:
-            mean_final_reward = np.mean(self.final_rewards)
-            # self.logger is the Stable Baselines3 logger for TensorBoard
-            self.logger.record("ep_goal_mean", mean_final_reward)
-            self.final_rewards.clear()  # reset for next rollout
+    def clear(self):
+        self.counts[:] = 0
+        self.max = None
 
 
-class MaxEpisodeLengthCallback(BaseCallback):
-    def __init__(self, verbose=0):
+class EpisodeStatsCallback(BaseCallback):
+    """
+    Statistics of the episodes finished during a rollout, logged once at its end: the goal rate (ep_goal_mean) overall
+    and per obstacle pattern (ep_goal_pattern/<index>), and the p50 / p95 / max of the episode length and of the
+    wrong steps. Only the finished environments of a step are looked at, and their statistics go into counters and
+    fixed-size sketches, so memory does not grow with the rollout and the cost does not grow with the number of envs.
+    """
+    def __init__(self, verbose=0, sketch_capacity=1024):
         super().__init__(verbose)
-        self.max_length = 0
+        self.episodes = 0
+        self.goals = 0
+        self.pattern_episodes = np.zeros(0, dtype=np.int64)
+        self.pattern_goals = np.zeros(0, dtype=np.int64)
+        self.lengths = IntegerSketch(sketch_capacity)
+        self.wrong_steps = IntegerSketch(sketch_capacity)
 
     def _on_step(self) -> bool:
-        infos = self.locals.get("infos")
+        ended = np.flatnonzero(self.locals["dones"])
+        if not ended.size:
+            return True
+
+        goals = np.asarray(self.locals["rewards"])[ended] > 0
+        self.episodes += ended.size
+        self.goals += int(goals.sum())
 
-        for info in infos:
-            length = info.get("episode", {}).get("l")
-            if length is not None and length > self.max_length:
-                self.max_length = length
+        infos = [self.locals["infos"][i] for i in ended]
+        self.lengths.add([info["episode"]["l"] for info in infos if "episode" in info])
+        self.wrong_steps.add([info["wrong_steps"] for info in infos if "wrong_steps" in info])
+
+        patterns = np.array([info.get("pattern", -1) for info in infos], dtype=np.int64)
+        from_bank = patterns >= 0  # -1: a random layout
+        if from_bank.any():
+            n_patterns = max(len(self.pattern_episodes), patterns.max() + 1)
+            self.pattern_episodes = self._grown(self.pattern_episodes, n_patterns) + np.bincount(patterns[from_bank], minlength=n_patterns)
+            self.pattern_goals = self._grown(self.pattern_goals, n_patterns) + np.bincount(patterns[from_bank & goals], minlength=n_patterns)
 
         return True
 
+    @staticmethod
+    def _grown(counts, size):
+        return np.pad(counts, (0, size - len(counts))) if len(counts) < size else counts
+
     def _on_rollout_end(self) -> None:
-        if self.max_length > 0:
-            self.logger.record("ep_len_max", self.max_length)
-            self.max_length = 0  # reset for the next rollout
+        if self.episodes:
+            self.logger.record("ep_goal_mean", self.goals / self.episodes)
+        for pattern in np.flatnonzero(self.pattern_episodes):
+            self.logger.record(f"ep_goal_pattern/{pattern}", self.pattern_goals[pattern] / self.pattern_episodes[pattern])
+        for name, sketch in (("ep_len", self.lengths), ("ep_wrongSteps", self.wrong_steps)):
+            if len(sketch):
+                self.logger.record(f"{name}_p50", sketch.quantile(0.5))
+                self.logger.record(f"{name}_p95", sketch.quantile(0.95))
+                self.logger.record(f"{name}_max", sketch.max)
 
+        # reset for the next rollout
+        self.episodes = 0
+        self.goals = 0
+        self.pattern_episodes[:] = 0
+        self.pattern_goals[:] = 0
+        self.lengths.clear()
+        self.wrong_steps.clear()
 
-class MaxWrongStepsCallback(BaseCallback):
+
+class EnvStatsCallback(BaseCallback):
+    """
+    Logs the counters and phase timers of environments created with `instrument=True` (see GridWorldEnv.get_stats),
+    summed over all envs of the rollout: counters as totals, phase times in microseconds per env step.
+    """
     def __init__(self, verbose=0):
         super().__init__(verbose)
-        self.current_wrong_steps = 0
-        self.max_wrong_steps = 0
+        self.enabled = True
 
     def _on_step(self) -> bool:
-        dones = self.locals.get("dones")
-        infos = self.locals.get("infos")
-
-        for done, info in zip(dones, infos):
-            if done and "wrong_steps" in info:
-                if info["wrong_steps"] > self.max_wrong_steps:
-                    self.max_wrong_steps = info["wrong_steps"]
-
         return True
 
     def _on_rollout_end(self) -> None:
-        if self.max_wrong_steps > 0:
-            self.logger.record("ep_wrongSteps_max", self.max_wrong_steps)
-            self.max_wrong_steps = 0
+        if not self.enabled:
+            return
+
+        try:
+            env_stats = self.training_env.env_method("get_stats", True)
+        except AttributeError:  # e.g. the batched backend, which has no per-env GridWorldEnv
+            env_stats = []
+        env_stats = [stats for stats in env_stats if stats is not None]
+        if not env_stats:
+            self.enabled = False
+            return
+
+        counters = {}
+        times = {}
+        for stats in env_stats:
+            for name, value in stats["counters"].items():
+                counters[name] = counters.get(name, 0) + value
+            for phase, seconds in stats["times"].items():
+                times[phase] = times.get(phase, 0.0) + seconds
+
+        for name, value in counters.items():
+            self.logger.record(f"env_stats/{name}", value)
+        if counters.get("searches"):
+            self.logger.record("env_stats/nodes_per_search", counters.get("nodes_expanded", 0) / counters["searches"])
+
+        steps = counters.get("steps", 0)
+        if steps:
+            for phase, seconds in times.items():
+                self.logger.record(f"env_stats/{phase}_us_per_step", 1e6 * seconds / steps)
@@ -1,10 +1,27 @@
+import argparse
+import math
 import os
 
-from python.utils import get_eval_path
+import numpy as np
 
-# Compares the visited cells of experiment2 and live_experiment line by line, prints any differences, and confirms if they are identical.
+import trajectory_store
+from utils import get_eval_path
+
+# Compares the visited cells of experiment2 and live_experiment episode by episode, prints where episodes diverge, and confirms if they are identical.
 # If they are identical, then the interface between the js game and gymnasium works correctly
 
+MAX_REPORTED = 10  # diverging episodes printed in full
+
+
+def resolve_eval_path(eval_dir):
+    """visited_cells.npz of eval_dir, or the visited_cells.txt older runs wrote if only that one exists."""
+    eval_path = get_eval_path(eval_dir)
+    legacy_path = os.path.join(eval_dir, "visited_cells.txt")
+    if not os.path.exists(eval_path) and os.path.exists(legacy_path):
+        return legacy_path
+    return eval_path
+
+
 def compare_files(file1, file2):
     # Check existence
     if not os.path.exists(file1):
@@ -16,32 +33,39 @@ def compare_files(file1, file2):
         print(f"Run server.js with --eval flag")
         return
 
-    # Read lines
-    with open(file1, "r") as f1, open(file2, "r") as f2:
-        lines1 = [line.strip() for line in f1.readlines()]
-        lines2 = [line.strip() for line in f2.readlines()]
-
-    # Pad missing lines so lengths match
-    max_len = max(len(lines1), len(lines2))
-    lines1 += ["<MISSING>"] * (max_len - len(lines1))
-    lines2 += ["<MISSING>"] * (max_len - len(lines2))
-
-    # Compare
-    differences_found = False
-    for i, (l1, l2) in enumerate(zip(lines1, lines2), start=1):
-        if l1 != l2:
-            differences_found = True
-            print(f"Line {i} differs:")
-            print(f"  {file1}: {l1}")
-            print(f"  {file2}: {l2}")
-
-    if not differences_found:
-        print("✅ Files are identical!")
-
-# Example usage
-eval_dir_1 = os.path.join("evaluations", "experiment2")
-eval_dir_2 = os.path.join("evaluations", "live_experiment")
-eval_path_1 = get_eval_path(eval_dir_1)
-eval_path_2 = get_eval_path(eval_dir_2)
-
-compare_files(eval_path_1, eval_path_2)
\ No newline at end of file
+    trajectories1 = trajectory_store.load(file1)
+    trajectories2 = trajectory_store.load(file2)
+
+    # First step at which each episode diverges, -1 where the episodes are identical
+    divergences = trajectory_store.first_divergences(trajectories1, trajectories2)
+    diverging = np.flatnonzero(divergences >= 0)
+    for episode in diverging[:MAX_REPORTED]:
+        step = divergences[episode]
+        print(f"Episode {episode + 1} diverges at step {step}:")
+        print(f"  {file1}: {','.join(map(str, trajectories1.episode(episode)[step:step + 5]))}")
+        print(f"  {file2}: {','.join(map(str, trajectories2.episode(episode)[step:step + 5]))}")
+    if len(diverging) > MAX_REPORTED:
+        print(f"... and {len(diverging) - MAX_REPORTED} more diverging episodes")
+    if len(trajectories1) != len(trajectories2):
+        print(f"Episode counts differ: {len(trajectories1)} in {file1}, {len(trajectories2)} in {file2}")
+
+    # Visitation heatmaps; the legacy text files do not record the grid width, the smallest grid holding every cell is used then
+    grid_size = trajectories1.grid_width or trajectories2.grid_width or math.isqrt(
+        int(max(trajectories1.cells.max(initial=0), trajectories2.cells.max(initial=0)))) + 1
+    heatmap1, heatmap2 = trajectories1.heatmap(grid_size), trajectories2.heatmap(grid_size)
+    differing_cells = np.argwhere(heatmap1 != heatmap2)
+    print(f"Visits: {heatmap1.sum()} in {file1}, {heatmap2.sum()} in {file2}; "
+          f"{len(differing_cells)} of {grid_size * grid_size} cells visited a different number of times")
+
+    if not len(diverging) and len(trajectories1) == len(trajectories2):
+        print(f"✅ Files are identical! ({len(trajectories1)} episodes)")
+    return divergences, heatmap1, heatmap2
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the visited cells of two evaluations")
+    parser.add_argument("folders", nargs="*", default=["experiment2", "live_experiment"], help="Two folders in evaluations/")
+    args = parser.parse_args()
+
+    eval_path_1, eval_path_2 = (resolve_eval_path(os.path.join("evaluations", folder)) for folder in args.folders[:2])
+    compare_files(eval_path_1, eval_path_2)
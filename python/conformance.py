@@ -0,0 +1,349 @@
+"""
+Lockstep conformance of a candidate GridWorld implementation against the reference GridWorldEnv: both are reset
+with the same seeds and given the same actions (random, or chosen by a trained model on the reference observations),
+and every reset and step is compared field by field, observation, reward, terminated, truncated and info, as well
+as the global NumPy RNG the moving target draws from. The time each side spends in reset() and step() gives the
+speedup of the candidate.
+
+For LocalPolicy cases the candidate's observations are also checked against the egocentric window built cell by
+cell from the full occupancy grid, which the env itself slices from a padded copy of it.
+
+A candidate is one of CANDIDATES (GridWorldEnv with other constructor arguments) or "module:attribute" /
+"path/to/file.py:attribute" naming a class or factory called with the env kwargs.
+"""
+
+import argparse
+import datetime
+import importlib
+import importlib.util
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+
+import benchmark
+from gymnasium_env.envs import GridWorldEnv
+
+
+# GridWorldEnv options that must not change what the env does
+CANDIDATES = {
+    "fast_step": {"fast_step": True},
+    "instrument": {"instrument": True},
+    "fast_step+instrument": {"fast_step": True, "instrument": True},
+}
+
+BASELINE = {
+    "policy": "CnnPolicy",
+    "size": 10,
+    "num_obstacles": 15,
+    "num_patterns": 0,
+    "target_moving_pattern": 0,
+}
+
+# Values tried for each axis; the default sweep changes one axis of BASELINE at a time, --full runs every combination
+AXES = {
+    "policy": ["CnnPolicy", "MlpPolicy", "LocalPolicy"],
+    "size": [10, 20, 40],
+    "num_obstacles": [0, 15],
+    "num_patterns": [0, 10],
+    "target_moving_pattern": [0, 1, 2],
+}
+
+MAX_REPORTED = 10  # mismatches kept per case
+
+
+def sweep_cases(full=False):
+    if full:
+        return [dict(zip(AXES, values)) for values in itertools.product(*AXES.values())]
+    cases = [dict(BASELINE)]
+    for axis, values in AXES.items():
+        cases += [dict(BASELINE, **{axis: value}) for value in values if value != BASELINE[axis]]
+    return cases
+
+
+def load_factory(spec):
+    """The env class or factory named by `spec`: a key of CANDIDATES, "module:attribute" or "file.py:attribute"."""
+    if spec in CANDIDATES:
+        options = CANDIDATES[spec]
+        return lambda **env_kwargs: GridWorldEnv(**env_kwargs, **options)
+    module_name, _, attribute = spec.rpartition(":")
+    if not module_name or not attribute:
+        raise ValueError(f"unknown candidate {spec!r}: expected one of {list(CANDIDATES)}, module:attribute or file.py:attribute")
+    if module_name.endswith(".py"):
+        module_spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(module_name))[0], module_name)
+        module = importlib.util.module_from_spec(module_spec)
+        module_spec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(module_name)
+    return getattr(module, attribute)
+
+
+def _same(a, b):
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return isinstance(a, np.ndarray) and isinstance(b, np.ndarray) and a.dtype == b.dtype and a.shape == b.shape and np.array_equal(a, b)
+    if isinstance(a, dict) or isinstance(b, dict):
+        return isinstance(a, dict) and isinstance(b, dict) and a.keys() == b.keys() and all(_same(a[key], b[key]) for key in a)
+    # Numbers compare by value (np.float64 and float are interchangeable for SB3), but a bool must stay a bool
+    return isinstance(a, (bool, np.bool_)) == isinstance(b, (bool, np.bool_)) and a == b
+
+
+def _rng_state_equal(a, b):
+    return a[0] == b[0] and np.array_equal(a[1], b[1]) and a[2:] == b[2:]
+
+
+class _Side:
+    """One env of the lockstep run and the time spent in its reset() and step() calls."""
+
+    def __init__(self, env):
+        self.env = env
+        self.seconds = 0.0
+
+    def call(self, method, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return getattr(self.env, method)(*args, **kwargs)
+        except Exception as e:  # compared like a result: both sides have to fail the same way
+            return e
+        finally:
+            self.seconds += time.perf_counter() - start
+
+
+def _compare(fields, reference, candidate, reference_rng, candidate_rng):
+    """Names of the fields in which two reset() / step() results differ."""
+    if isinstance(reference, Exception) or isinstance(candidate, Exception):
+        same = type(reference) is type(candidate) and str(reference) == str(candidate)
+        return [] if same else ["exception"]
+    differing = [field for field, a, b in zip(fields, reference, candidate) if not _same(a, b)]
+    if not _rng_state_equal(reference_rng, candidate_rng):
+        differing.append("global_rng")
+    return differing
+
+
+def _lockstep(reference, candidate, method, fields, *args, **kwargs):
+    """Calls `method` on both sides from the same global RNG state. Returns (reference result, differing fields)."""
+    state = np.random.get_state()
+    reference_result = reference.call(method, *args, **kwargs)
+    reference_rng = np.random.get_state()
+    np.random.set_state(state)
+    candidate_result = candidate.call(method, *args, **kwargs)
+    return reference_result, candidate_result, _compare(fields, reference_result, candidate_result, reference_rng, np.random.get_state())
+
+
+def _describe(value):
+    if isinstance(value, Exception):
+        return repr(value)
+    return repr(value)[:300]
+
+
+def _prepare_patterns(env_kwargs):
+    """
+    Creates obstacle_patterns.json and its pattern bank for `env_kwargs` if they do not exist yet. Otherwise the
+    first env to reset writes them, drawing the patterns from its own RNG, and the two sides start out of step.
+    """
+    if env_kwargs.get("num_patterns", 10) != 0:
+        env = GridWorldEnv(**env_kwargs)
+        env.reset(seed=0)
+        env.close()
+
+
+def run_case(env_kwargs, candidate, episodes=100, seed=0, reference=None, policy=None):
+    """
+    Plays `episodes` episodes of `env_kwargs` on the reference (GridWorldEnv, or the factory `reference`) and on
+    the factory `candidate` in lockstep. Actions are random, or from `policy(observation, episode_start)` when given.
+    An episode stops at its first mismatch, since the two envs no longer share a state after it. Episodes ended by an
+    exception both sides raised identically are counted in "errors".
+    """
+    _prepare_patterns(env_kwargs)
+    np.random.seed(seed)
+    reference_side = _Side((reference or GridWorldEnv)(**env_kwargs))
+    candidate_side = _Side(candidate(**env_kwargs))
+    rng = np.random.default_rng(seed)
+    result = {"episodes": episodes, "steps": 0, "errors": 0, "mismatches": []}
+    mismatched_episodes = 0
+
+    for episode in range(episodes):
+        episode_seed = seed + episode
+        np.random.seed(episode_seed)
+        for side in (reference_side, candidate_side):
+            side.env.action_space.seed(episode_seed)
+
+        reference_result, candidate_result, differing = _lockstep(reference_side, candidate_side, "reset", ("observation", "info"), seed=episode_seed)
+        step = 0
+        while True:
+            if differing:
+                mismatched_episodes += 1
+                if len(result["mismatches"]) < MAX_REPORTED:
+                    result["mismatches"].append({"episode": episode, "step": step, "fields": differing,
+                                                 "reference": _describe(reference_result), "candidate": _describe(candidate_result)})
+                break
+            if isinstance(reference_result, Exception):
+                result["errors"] += 1
+                break
+            if step and (reference_result[2] or reference_result[3]):
+                break
+
+            observation = reference_result[0]
+            action = int(rng.integers(4)) if policy is None else policy(observation, step == 0)
+            reference_result, candidate_result, differing = _lockstep(
+                reference_side, candidate_side, "step", ("observation", "reward", "terminated", "truncated", "info"), action)
+            step += 1
+            result["steps"] += 1
+
+    for side in (reference_side, candidate_side):
+        side.env.close()
+    result.update({
+        "mismatched_episodes": mismatched_episodes,
+        "conformant": mismatched_episodes == 0,
+        "reference_seconds": reference_side.seconds,
+        "candidate_seconds": candidate_side.seconds,
+        "speedup": reference_side.seconds / candidate_side.seconds if candidate_side.seconds else None,
+    })
+    return result
+
+
+def _full_grid_window(env):
+    """
+    The LocalPolicy observation of `env` built cell by cell from the full occupancy grid and the two positions,
+    without the padded grid the env slices it from.
+    """
+    env = env.unwrapped
+    view, radius = env.local_view_size, env.local_view_size // 2
+    agent_x, agent_y = (int(v) for v in env._agent_location)
+    target_x, target_y = (int(v) for v in env._target_location)
+    observation = np.empty(view * view + 2, dtype=np.int16)
+    for row in range(view):
+        for column in range(view):
+            x, y = agent_x - radius + column, agent_y - radius + row
+            inside = 0 <= x < env.size and 0 <= y < env.size
+            value = int(env.occupancy[y, x]) if inside else 1
+            observation[row * view + column] = 4 if (x, y) == (target_x, target_y) else value
+    observation[-2] = target_x - agent_x
+    observation[-1] = target_y - agent_y
+    return observation
+
+
+def run_local_window_case(env_kwargs, candidate, episodes=100, seed=0):
+    """
+    Plays `episodes` random episodes of `env_kwargs` (a LocalPolicy case) on the factory `candidate` and compares
+    every observation with _full_grid_window(), which checks the slice of the padded grid against the full grid.
+    """
+    env = candidate(**env_kwargs)
+    rng = np.random.default_rng(seed)
+    result = {"episodes": episodes, "steps": 0, "errors": 0, "mismatches": []}
+    mismatched_episodes = 0
+
+    for episode in range(episodes):
+        episode_seed = seed + episode
+        np.random.seed(episode_seed)
+        env.action_space.seed(episode_seed)
+        observation, _ = env.reset(seed=episode_seed)
+        terminated = truncated = False
+        step = 0
+        while True:
+            expected = _full_grid_window(env)
+            if not _same(observation, expected):
+                mismatched_episodes += 1
+                if len(result["mismatches"]) < MAX_REPORTED:
+                    result["mismatches"].append({"episode": episode, "step": step, "fields": ["observation"],
+                                                 "reference": _describe(expected), "candidate": _describe(observation)})
+                break
+            if terminated or truncated:
+                break
+            observation, _, terminated, truncated, _ = env.step(int(rng.integers(4)))
+            step += 1
+            result["steps"] += 1
+
+    env.close()
+    result.update({
+        "mismatched_episodes": mismatched_episodes,
+        "conformant": mismatched_episodes == 0,
+        "reference_seconds": None,
+        "candidate_seconds": None,
+        "speedup": None,
+    })
+    return result
+
+
+def _print_result(env_kwargs, result):
+    name = " ".join(f"{key}={value}" for key, value in env_kwargs.items())
+    if result["reference"] == "full grid window":
+        name += " (window)"
+    speedup = "n/a" if result["speedup"] is None else f"x{result['speedup']:.2f}"
+    status = "ok" if result["conformant"] else f"{result['mismatched_episodes']} episodes differ"
+    print(f"{name:<90} {status:<20} {result['steps']:>7} steps {result['errors']:>4} errors  speedup {speedup}")
+    for mismatch in result["mismatches"][:1]:
+        print(f"    episode {mismatch['episode']} step {mismatch['step']}: {', '.join(mismatch['fields'])}")
+
+
+def _policy_actions(folder):
+    """Actions of the latest checkpoint of `folder`, frame stacking included, through evaluate.py's episode runner."""
+    import evaluate
+
+    runner = evaluate._EpisodeRunner(folder)
+
+    def policy(observation, episode_start):
+        action, _ = runner.model.predict(observation=runner._observe(observation, reset=episode_start), deterministic=True)
+        return int(np.asarray(action).item())
+
+    return runner.env_kwargs, policy
+
+
+def run_suite(candidate="fast_step", reference=None, output_path=None, full=False, episodes=100, seed=0, folder=None):
+    """
+    Runs the lockstep comparison for every case (or for the env of configs/<folder> with its model choosing the
+    actions), prints one line per case and writes {"meta": ..., "results": [...]} to `output_path`.
+    Returns True when every case conformed.
+    """
+    if output_path is None:
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_path = os.path.join("benchmarks", f"conformance_{stamp}.json")
+    candidate_factory = load_factory(candidate)
+    reference_factory = load_factory(reference) if reference else None
+
+    if folder:
+        env_kwargs, policy = _policy_actions(folder)
+        cases = [(env_kwargs, policy)]
+    else:
+        cases = [(case, None) for case in sweep_cases(full)]
+
+    results = []
+    for env_kwargs, policy in cases:
+        result = dict(env_kwargs, candidate=candidate, reference=reference or "GridWorldEnv", actions=folder or "random")
+        result.update(run_case(env_kwargs, candidate_factory, episodes=episodes, seed=seed, reference=reference_factory, policy=policy))
+        results.append(result)
+        _print_result(env_kwargs, result)
+        if env_kwargs["policy"] == "LocalPolicy":
+            result = dict(env_kwargs, candidate=candidate, reference="full grid window", actions="random")
+            result.update(run_local_window_case(env_kwargs, candidate_factory, episodes=episodes, seed=seed))
+            results.append(result)
+            _print_result(env_kwargs, result)
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump({"meta": benchmark._metadata(), "results": results}, f, indent=2)
+    print(f"Results written to {output_path}")
+    return all(result["conformant"] for result in results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check that a GridWorld implementation behaves exactly like GridWorldEnv, and time both")
+    parser.add_argument("--candidate", default="fast_step",
+                        help=f"one of {', '.join(CANDIDATES)}, or module:attribute / file.py:attribute called with the env kwargs")
+    parser.add_argument("--reference", default=None,
+                        help="reference implementation in the same form (default GridWorldEnv)")
+    parser.add_argument("--output", default=None,
+                        help="JSON file to write (default benchmarks/conformance_<timestamp>.json)")
+    parser.add_argument("--full", action="store_true",
+                        help="run every combination of the axes instead of one axis at a time")
+    parser.add_argument("--episodes", type=int, default=100,
+                        help="episodes per case")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the first episode, the next ones use the following seeds")
+    parser.add_argument("--folder", default=None,
+                        help="compare on the env of configs/<folder>, with the actions of its latest model")
+
+    args = parser.parse_args()
+    conformant = run_suite(args.candidate, args.reference, args.output, full=args.full, episodes=args.episodes, seed=args.seed, folder=args.folder)
+    raise SystemExit(0 if conformant else 1)
@@ -0,0 +1,176 @@
+"""
+Headless evaluation of the latest checkpoint of an experiment: episodes are spread over a process pool, each one
+seeded on its own from (seed, episode index), so the results do not depend on the number of workers or the order
+episodes run in.
+"""
+
+import concurrent.futures
+import json
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+
+import numpy_policy
+import utils
+
+
+FRAME_STACK = 4  # n_stack of the VecFrameStack agent.py trains frame-stacking experiments with
+
+_worker = None  # the _EpisodeRunner of a pool process
+
+
+def _load_env_config(folder):
+    return utils.load_config_from_py(utils.get_config_path(os.path.join("configs", folder), "env_config.py"))
+
+
+def reset_episode(env, episode, seed):
+    """
+    Resets `env` for episode `episode` of a run seeded with `seed`. Everything the episode draws from is set from
+    seed + episode instead of inherited from the episodes before it, so it plays the same in any process and order.
+    """
+    unwrapped = env.unwrapped
+    episode_seed = seed + episode
+    if unwrapped.num_patterns:
+        unwrapped.obstacle_index = episode % unwrapped.num_patterns
+    np.random.seed(episode_seed)  # the moving target draws from the global RNG
+    unwrapped.action_space.seed(episode_seed)
+    return env.reset(seed=episode_seed)
+
+
+class _EpisodeRunner:
+    """One env and one policy, reused for every episode a process runs."""
+
+    def __init__(self, folder):
+        config = _load_env_config(folder)
+        self.env_kwargs = config.env_kwargs
+        self.env = utils.make_env(**self.env_kwargs)()
+        self.stacked = None
+        if config.use_frame_stacking:
+            # What VecFrameStack(n_stack=4) in training fed the model: the last 4 observations concatenated along the
+            # channel axis, oldest first, zeros before the first one of an episode
+            self.stack_axis = 0 if utils.get_channels_order(self.env_kwargs) == "first" else -1
+            shape = list(self.env.observation_space.shape)
+            shape[self.stack_axis] *= FRAME_STACK
+            self.stacked = np.zeros(shape, dtype=self.env.observation_space.dtype)
+
+        model_dir = os.path.join("models", folder)
+        try:
+            # Same actions as the SB3 policy, without every worker importing torch
+            self.model = numpy_policy.load(model_dir)
+        except (ValueError, KeyError):
+            import policy_export
+            import torch
+            torch.set_num_threads(1)  # one core per process, the pool provides the parallelism
+            self.model = policy_export.load_policy(model_dir)  # the checkpoint itself, never a quantized export
+
+    def _observe(self, obs, reset=False):
+        if self.stacked is None:
+            return obs
+        channels = obs.shape[self.stack_axis]
+        if reset:
+            self.stacked[...] = 0
+        else:
+            self.stacked = np.roll(self.stacked, -channels, axis=self.stack_axis)
+        np.moveaxis(self.stacked, self.stack_axis, 0)[-channels:] = np.moveaxis(obs, self.stack_axis, 0)
+        return self.stacked
+
+    def run(self, episode, seed):
+        """Plays episode `episode` and returns its metrics and the cells the agent visited."""
+        env = self.env.unwrapped
+        episode_seed = seed + episode
+        obs, info = reset_episode(self.env, episode, seed)
+
+        start = tuple(int(v) for v in env._agent_location)
+        target = tuple(int(v) for v in env._target_location)
+        # Without inner obstacles the env itself measures progress in manhattan distance, which is the path length then
+        shortest_path = env.manhattan(start, target) if env.num_obstacles == 0 else env.path_distance(start)
+        visited_cells = [start]
+        obs = self._observe(obs, reset=True)
+        steps = 0
+        while True:
+            action, _ = self.model.predict(observation=obs, deterministic=True)
+            obs, reward, terminated, truncated, info = self.env.step(int(np.asarray(action).item()))
+            steps += 1
+            cell = tuple(int(v) for v in env._agent_location)
+            if cell != visited_cells[-1]:
+                visited_cells.append(cell)
+            obs = self._observe(obs)
+            if terminated or truncated:
+                break
+
+        success = bool(terminated and reward > 0)  # stepping onto an obstacle also terminates, with reward 0
+        return {
+            "episode": episode,
+            "seed": episode_seed,
+            "success": success,
+            "steps": steps,
+            "wrong_steps": int(info["wrong_steps"]),
+            "shortest_path": shortest_path,
+            "optimality": shortest_path / steps if success and shortest_path else None,
+        }, visited_cells
+
+
+def _init_worker(folder):
+    global _worker
+    _worker = _EpisodeRunner(folder)
+
+
+def _run_episode(args):
+    return _worker.run(*args)
+
+
+def summarize(episodes):
+    """Success rate, steps, wrong steps and path optimality (shortest path / steps, successes only) of `episodes`."""
+    steps = np.array([e["steps"] for e in episodes])
+    wrong_steps = np.array([e["wrong_steps"] for e in episodes])
+    success = np.array([e["success"] for e in episodes])
+    optimality = np.array([e["optimality"] for e in episodes if e["optimality"] is not None])
+    return {
+        "episodes": len(episodes),
+        "success_rate": float(success.mean()),
+        "steps_mean": float(steps.mean()),
+        "steps_median": float(np.median(steps)),
+        "success_steps_mean": float(steps[success].mean()) if success.any() else None,
+        "wrong_steps_mean": float(wrong_steps.mean()),
+        "optimality_mean": float(optimality.mean()) if len(optimality) else None,
+        "optimal_fraction": float((optimality >= 1).sum() / len(episodes)),
+    }
+
+
+def evaluate(folder, n_episodes=100, n_workers=None, seed=42, output_path=None):
+    """
+    Runs `n_episodes` episodes of the latest checkpoint of `folder` headless on `n_workers` processes (all cores by
+    default, 1 runs them here) and writes the summary and per-episode metrics to `output_path`
+    (evaluations/<folder>/metrics.json by default). Returns (summary, episodes, visited cells per episode).
+    """
+    n_workers = min(n_workers or os.cpu_count(), n_episodes)
+    tasks = [(episode, seed) for episode in range(n_episodes)]
+
+    start = time.perf_counter()
+    if n_workers == 1:
+        _init_worker(folder)
+        results = [_run_episode(task) for task in tasks]
+    else:
+        ctx = mp.get_context("forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn")
+        with concurrent.futures.ProcessPoolExecutor(n_workers, mp_context=ctx, initializer=_init_worker, initargs=(folder,)) as pool:
+            results = list(pool.map(_run_episode, tasks, chunksize=max(1, n_episodes // (4 * n_workers))))
+    seconds = time.perf_counter() - start
+
+    episodes = [metrics for metrics, _ in results]
+    visited_cells = [cells for _, cells in results]
+    summary = summarize(episodes)
+    summary.update({"folder": folder, "seed": seed, "workers": n_workers, "seconds": seconds})
+
+    if output_path is None:
+        output_path = os.path.join("evaluations", folder, "metrics.json")
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump({"summary": summary, "episodes": episodes}, f, indent=2)
+
+    optimality = "n/a" if summary["optimality_mean"] is None else f"{summary['optimality_mean']:.3f}"
+    print(f"{folder}: {n_episodes} episodes on {n_workers} workers in {seconds:.1f} s | success {summary['success_rate']:.1%} "
+          f"| steps {summary['steps_mean']:.1f} | wrong steps {summary['wrong_steps_mean']:.2f} | optimality {optimality}")
+    print(f"Metrics written to {output_path}")
+    return summary, episodes, visited_cells
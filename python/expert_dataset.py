@@ -0,0 +1,224 @@
+"""
+Expert demonstrations for warm-starting PPO: episodes of an experiment's env played by a shortest-path expert on a
+process pool, stored as flat memory-mapped files of (observation, action, reward) in the env's own observation
+format, and behavior cloning of a PPO policy on them (see agent.py --pretrain).
+
+A dataset is a directory holding observations.bin, actions.bin and rewards.bin (one row per step, raw arrays to open
+with np.memmap), episode_offsets.npy (episode i is rows offsets[i]:offsets[i + 1]) and dataset.json describing them.
+"""
+
+import concurrent.futures
+import json
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+
+import evaluate
+import utils
+
+
+EPISODES_PER_TASK = 64
+_FILES = ("observations", "actions", "rewards")
+
+_worker = None  # the _ExpertRunner of a pool process
+
+
+def default_path(folder):
+    return os.path.join("datasets", folder)
+
+
+class _ExpertRunner:
+    """One env, reused for every episode a process plays."""
+
+    def __init__(self, folder):
+        self.env_kwargs = evaluate._load_env_config(folder).env_kwargs
+        self.env = utils.make_env(**self.env_kwargs)()
+        self._directions = [np.asarray(self.env.unwrapped._action_to_direction[action]) for action in range(self.env.action_space.n)]
+
+    def expert_action(self):
+        """The action stepping to the free neighbor closest to the target by path length, the first one on ties."""
+        env = self.env.unwrapped
+        best_action, best_distance = 0, None
+        for action, direction in enumerate(self._directions):
+            cell = np.clip(env._agent_location + direction, 0, env.size - 1)
+            if env.occupancy[cell[1], cell[0]]:
+                continue
+            # Without inner obstacles the path length is the manhattan distance, as in the env's own reward
+            distance = env.manhattan(cell, env._target_location) if env.num_obstacles == 0 else env.path_distance(cell)
+            if distance is not None and (best_distance is None or distance < best_distance):
+                best_action, best_distance = action, distance
+        return best_action
+
+    def run(self, episodes, seed):
+        """Plays `episodes` and returns their observations, actions, rewards and lengths, episode after episode."""
+        observations, actions, rewards, lengths = [], [], [], []
+        for episode in episodes:
+            obs, _ = evaluate.reset_episode(self.env, episode, seed)
+            steps = 0
+            while True:
+                action = self.expert_action()
+                observations.append(obs)
+                actions.append(action)
+                obs, reward, terminated, truncated, _ = self.env.step(action)
+                rewards.append(reward)
+                steps += 1
+                if terminated or truncated:
+                    break
+            lengths.append(steps)
+        return np.stack(observations), np.array(actions, dtype=np.uint8), np.array(rewards, dtype=np.float32), lengths
+
+
+def _init_worker(folder):
+    global _worker
+    _worker = _ExpertRunner(folder)
+
+
+def _run_task(args):
+    return _worker.run(*args)
+
+
+def generate(folder, n_episodes=10000, n_workers=None, seed=0, output_path=None):
+    """
+    Plays `n_episodes` expert episodes of the env of configs/<folder> on `n_workers` processes (all cores by default)
+    and writes them to `output_path` (datasets/<folder> by default). Episodes are seeded like evaluate.py's, from
+    (seed, episode index), and written in episode order, so the dataset does not depend on the number of workers.
+    Results are appended to the files as they arrive; memory holds a few tasks of EPISODES_PER_TASK episodes at most.
+    """
+    output_path = output_path or default_path(folder)
+    os.makedirs(output_path, exist_ok=True)
+    tasks = [(range(start, min(start + EPISODES_PER_TASK, n_episodes)), seed) for start in range(0, n_episodes, EPISODES_PER_TASK)]
+    n_workers = min(n_workers or os.cpu_count(), len(tasks))
+
+    start = time.perf_counter()
+    files = {name: open(os.path.join(output_path, f"{name}.bin"), "wb") for name in _FILES}
+    lengths = []
+    observation_shape = observation_dtype = None
+    try:
+        if n_workers == 1:
+            _init_worker(folder)
+            results = map(_run_task, tasks)
+            pool = None
+        else:
+            ctx = mp.get_context("forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn")
+            pool = concurrent.futures.ProcessPoolExecutor(n_workers, mp_context=ctx, initializer=_init_worker, initargs=(folder,))
+            results = pool.map(_run_task, tasks)
+        for observations, actions, rewards, task_lengths in results:
+            observation_shape, observation_dtype = observations.shape[1:], observations.dtype
+            for name, array in zip(_FILES, (observations, actions, rewards)):
+                files[name].write(np.ascontiguousarray(array).tobytes())
+            lengths.extend(task_lengths)
+        if pool is not None:
+            pool.shutdown()
+    finally:
+        for f in files.values():
+            f.close()
+    seconds = time.perf_counter() - start
+
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    np.save(os.path.join(output_path, "episode_offsets.npy"), offsets)
+    with open(os.path.join(output_path, "dataset.json"), "w") as f:
+        json.dump({
+            "folder": folder,
+            "seed": seed,
+            "episodes": n_episodes,
+            "transitions": int(offsets[-1]),
+            "observation_shape": list(observation_shape),
+            "observation_dtype": str(observation_dtype),
+        }, f, indent=2)
+
+    print(f"{folder}: {n_episodes} expert episodes, {offsets[-1]} transitions on {n_workers} workers in {seconds:.1f} s")
+    print(f"Dataset written to {output_path}")
+    return output_path
+
+
+class ExpertDataset:
+    """A dataset written by generate(), memory-mapped read-only."""
+
+    def __init__(self, path):
+        with open(os.path.join(path, "dataset.json")) as f:
+            self.meta = json.load(f)
+        n = self.meta["transitions"]
+        self.offsets = np.load(os.path.join(path, "episode_offsets.npy"))
+        self.observations = np.memmap(os.path.join(path, "observations.bin"), dtype=self.meta["observation_dtype"],
+                                      mode="r", shape=(n, *self.meta["observation_shape"]))
+        self.actions = np.memmap(os.path.join(path, "actions.bin"), dtype=np.uint8, mode="r", shape=(n,))
+        self.rewards = np.memmap(os.path.join(path, "rewards.bin"), dtype=np.float32, mode="r", shape=(n,))
+        # Row -> first row of its episode, what frame stacking needs to know where the zeros start
+        self.episode_starts = np.repeat(self.offsets[:-1], np.diff(self.offsets))
+
+    def __len__(self):
+        return len(self.actions)
+
+    def returns(self, gamma):
+        """Discounted return from every step to the end of its episode."""
+        rewards = np.asarray(self.rewards)
+        returns = np.empty(len(self), dtype=np.float32)
+        for start, stop in zip(self.offsets[:-1], self.offsets[1:]):
+            running = 0.0
+            for row in range(stop - 1, start - 1, -1):
+                running = rewards[row] + gamma * running
+                returns[row] = running
+        return returns
+
+    def stacked_observations(self, rows, n_stack, axis):
+        """
+        The observations of `rows` as VecFrameStack(n_stack) gave them in training: the last n_stack observations of
+        the episode concatenated along `axis` (0 or -1, of a single observation), oldest first, zeros before the start.
+        """
+        frames = []
+        for lag in range(n_stack - 1, -1, -1):
+            previous = rows - lag
+            frame = np.asarray(self.observations[np.maximum(previous, self.episode_starts[rows])])
+            frame[previous < self.episode_starts[rows]] = 0
+            frames.append(frame)
+        return np.concatenate(frames, axis=axis if axis < 0 else axis + 1)
+
+
+def pretrain(model, dataset, epochs=5, batch_size=256, learning_rate=1e-3, frame_stack=None, channels_order="last", value_coef=0.5):
+    """
+    Behavior cloning of `model` (a PPO) on `dataset`: the policy is trained to maximize the log-likelihood of the
+    expert actions and, with `value_coef`, the value head to predict the discounted returns of the expert, so that
+    RL fine-tuning starts from an agent that already reaches the target. `frame_stack` is the n_stack of the
+    VecFrameStack the model was trained behind, if any. Returns the mean loss of every epoch.
+    """
+    import torch as th
+    from stable_baselines3.common.vec_env import VecTransposeImage
+
+    policy = model.policy
+    optimizer = th.optim.Adam(policy.parameters(), lr=learning_rate)
+    returns = dataset.returns(model.gamma)
+    rng = np.random.default_rng(0)
+    losses = []
+    policy.set_training_mode(True)
+    for epoch in range(epochs):
+        epoch_loss = 0.0
+        order = rng.permutation(len(dataset))
+        for start in range(0, len(order), batch_size):
+            rows = np.sort(order[start:start + batch_size])  # sorted rows read the memory map sequentially
+            if frame_stack:
+                observations = dataset.stacked_observations(rows, frame_stack, 0 if channels_order == "first" else -1)
+            else:
+                observations = np.asarray(dataset.observations[rows])
+            if observations.shape[1:] != policy.observation_space.shape:
+                observations = VecTransposeImage.transpose_image(observations)  # the channel-first view SB3 trains on
+            observations = th.as_tensor(observations, device=policy.device)
+            actions = th.as_tensor(dataset.actions[rows].astype(np.int64), device=policy.device)
+
+            distribution = policy.get_distribution(observations)
+            loss = -distribution.log_prob(actions).mean()
+            if value_coef:
+                values = policy.predict_values(observations).flatten()
+                loss = loss + value_coef * th.nn.functional.mse_loss(values, th.as_tensor(returns[rows], device=policy.device))
+
+            optimizer.zero_grad()
+            loss.backward()
+            th.nn.utils.clip_grad_norm_(policy.parameters(), model.max_grad_norm)
+            optimizer.step()
+            epoch_loss += loss.item() * len(rows)
+        losses.append(epoch_loss / len(dataset))
+        print(f"Behavior cloning epoch {epoch + 1}/{epochs}: loss {losses[-1]:.4f}")
+    policy.set_training_mode(False)
+    return losses
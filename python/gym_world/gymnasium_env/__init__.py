@@ -8,6 +8,7 @@ if env_id not in gymnasium.envs.registry:
     register(
         id="gymnasium_env/GridWorld-v0",
         entry_point="gymnasium_env.envs:GridWorldEnv",
+        vector_entry_point="gymnasium_env.envs:GridWorldVectorEnv",
     )
 
 if env_id_2 not in gymnasium.envs.registry:
@@ -1,2 +1,3 @@
 from gymnasium_env.envs.grid_world import GridWorldEnv
+from gymnasium_env.envs.grid_world_vector import GridWorldVectorEnv
 from gymnasium_env.envs.real_world import RealWorldEnv
@@ -0,0 +1,130 @@
+import numpy as np
+
+
+def distance_fields(blocked, goals):
+    """
+    Batched version of GridWorldEnv._compute_distance_field: a BFS wavefront from every goal at once.
+    `blocked` is (n, size, size) and `goals` is (n, 2) as (x, y). Entry [i, y, x] is the length of the path
+    GridWorldEnv.astar() returns from (x, y) to goals[i], or size * size where there is none.
+    """
+    count, size = blocked.shape[0], blocked.shape[1]
+    unreachable = size * size
+    rows = np.arange(count)
+    free = ~blocked
+
+    fields = np.full((count, size, size), unreachable, dtype=np.int32)
+    fields[rows, goals[:, 1], goals[:, 0]] = 0
+    frontier = np.zeros((count, size, size), dtype=bool)
+    frontier[rows, goals[:, 1], goals[:, 0]] = True
+    frontier &= free
+
+    distance = 0
+    while frontier.any():
+        distance += 1
+        expanded = np.zeros_like(frontier)
+        expanded[:, 1:, :] |= frontier[:, :-1, :]
+        expanded[:, :-1, :] |= frontier[:, 1:, :]
+        expanded[:, :, 1:] |= frontier[:, :, :-1]
+        expanded[:, :, :-1] |= frontier[:, :, 1:]
+        frontier = expanded & free & (fields == unreachable)
+        fields[frontier] = distance
+
+    # astar() does not check its start cell, so from an obstacle the path continues through the best neighbor
+    padded = np.pad(fields, ((0, 0), (1, 1), (1, 1)), constant_values=unreachable)
+    neighbor_min = np.minimum.reduce([
+        padded[:, 1:-1, :-2], padded[:, 1:-1, 2:], padded[:, :-2, 1:-1], padded[:, 2:, 1:-1]
+    ])
+    goal_free = free[rows, goals[:, 1], goals[:, 0]]
+    from_obstacle = blocked & (neighbor_min < unreachable) & goal_free[:, None, None]
+    fields[from_obstacle] = neighbor_min[from_obstacle] + 1
+    fields[rows, goals[:, 1], goals[:, 0]] = 0
+    return fields
+
+
+def connected_components(blocked):
+    """
+    Labels the 4-connected regions of free cells of a (size, size) grid with 0, 1, 2, ... in row-major order of
+    their first cell. Obstacles get -1.
+    """
+    size = blocked.shape[0]
+    width = size + 2
+    # A one-cell blocked frame lets the flood fill step to neighbors without bounds checks
+    framed = np.zeros((width, width), dtype=bool)
+    framed[1:-1, 1:-1] = ~blocked
+    free = framed.ravel().tolist()
+    labels = [-1] * (width * width)
+
+    next_label = 0
+    for cell in range(width, width * (width - 1)):
+        if not free[cell] or labels[cell] != -1:
+            continue
+        labels[cell] = next_label
+        stack = [cell]
+        while stack:
+            current = stack.pop()
+            for neighbor in (current - 1, current + 1, current - width, current + width):
+                if free[neighbor] and labels[neighbor] == -1:
+                    labels[neighbor] = next_label
+                    stack.append(neighbor)
+        next_label += 1
+
+    return np.array(labels, dtype=np.int32).reshape(width, width)[1:-1, 1:-1].copy()
+
+
+class StartGoalSampler:
+    """
+    Draws (agent, goal) cells for one layout with the distribution of GridWorldEnv's rejection loop, without the
+    rejections: uniform over ordered pairs of distinct free cells inside the spawn window that a path connects.
+
+    Without length limits a pair is drawn in O(1): a component is picked with weight n * (n - 1), n being its number
+    of window cells, then two distinct cells of it. With `distances` (the pattern bank's all-pairs table,
+    distances[goal, start]) the pairs whose path length lies in [min_length, max_length] are enumerated once and
+    drawn directly. Without a table the limits cannot be applied here and `exact` is False: the caller has to check
+    the path length of each drawn pair and draw again, which is still uniform over the allowed pairs.
+    """
+
+    def __init__(self, labels, low, high, distances=None, min_length=None, max_length=None):
+        size = labels.shape[0]
+        window = np.zeros((size, size), dtype=bool)
+        window[low:high + 1, low:high + 1] = True
+        cells = np.flatnonzero(window & (labels >= 0))
+        self.size = size
+        self.limited = min_length is not None or max_length is not None
+        self.exact = not self.limited or distances is not None
+
+        if self.limited and distances is not None:
+            lengths = np.asarray(distances)[np.ix_(cells, cells)].T  # [agent, goal]
+            allowed = (lengths >= 0) & (lengths >= (min_length or 0))
+            if max_length is not None:
+                allowed &= lengths <= max_length
+            np.fill_diagonal(allowed, False)
+            agent_index, goal_index = np.nonzero(allowed)
+            self._pairs = np.stack([cells[agent_index], cells[goal_index]], axis=1)
+            if not len(self._pairs):
+                raise ValueError(f"no start/goal pair with a path length in [{min_length}, {max_length}]")
+            return
+
+        self._pairs = None
+        cell_labels = labels.ravel()[cells]
+        order = np.argsort(cell_labels, kind="stable")
+        self._cells = cells[order]
+        _, self._starts, counts = np.unique(cell_labels[order], return_index=True, return_counts=True)
+        self._counts = counts
+        self._cumulative_weights = np.cumsum(counts * (counts - 1))
+        if not len(counts) or self._cumulative_weights[-1] == 0:
+            raise ValueError("no two connected free cells to place the agent and the goal")
+
+    def sample(self, np_random):
+        """Returns ((agent_x, agent_y), (goal_x, goal_y))."""
+        if self._pairs is not None:
+            agent_cell, goal_cell = self._pairs[np_random.integers(len(self._pairs))]
+        else:
+            component = np.searchsorted(self._cumulative_weights, np_random.integers(self._cumulative_weights[-1]), side="right")
+            count, start = self._counts[component], self._starts[component]
+            agent_index = np_random.integers(count)
+            goal_index = np_random.integers(count - 1)
+            if goal_index >= agent_index:
+                goal_index += 1
+            agent_cell, goal_cell = self._cells[start + agent_index], self._cells[start + goal_index]
+
+        return (int(agent_cell % self.size), int(agent_cell // self.size)), (int(goal_cell % self.size), int(goal_cell // self.size))
@@ -1,14 +1,26 @@
 import sys
-import os
 from enum import Enum
 
 import gymnasium as gym
 from gymnasium import spaces
-import pygame
 import numpy as np
-import json
 
 import heapq
+from collections import OrderedDict, deque
+
+from gymnasium_env.envs.grid_paths import StartGoalSampler, connected_components
+from gymnasium_env.envs.instrumentation import EnvStats, instrument_env
+from gymnasium_env.envs.pattern_bank import PatternBank, write_patterns
+from gymnasium_env.envs.rendering import GridRenderer
+from gymnasium_env.envs.viewer import ViewerProcess
+
+
+# Memory the distance-field cache of one env may use, see GridWorldEnv._compute_distance_field
+DISTANCE_CACHE_BYTES = 4 * 1024 * 1024
+DISTANCE_CACHE_MAX_ENTRIES = 256
+
+# Past this many cells a target that moves is followed with point-to-point searches instead of a new distance field
+POINT_SEARCH_MIN_CELLS = 32 * 32
 
 
 def debug_print(*args):
@@ -23,13 +35,60 @@ class Actions(Enum):
     left = 2
     down = 3
 
+class GridState:
+    """
+    Integer episode state stepped by GridWorldEnv when `fast_step=True`.
+    Plain ints in slots avoid the small NumPy arrays and tuples the default step path creates on every call.
+    """
+    __slots__ = ("agent_x", "agent_y", "target_x", "target_y", "step_count", "wrong_step_count")
+
+    def __init__(self, agent_x, agent_y, target_x, target_y):
+        self.agent_x = agent_x
+        self.agent_y = agent_y
+        self.target_x = target_x
+        self.target_y = target_y
+        self.step_count = 0
+        self.wrong_step_count = 0
+
+
 class GridWorldEnv(gym.Env):
     metadata = {"render_modes": ["human", "rgb_array"], "render_fps": 4}
 
-    def __init__(self, render_mode=None, render_fps=4, size=10, num_obstacles=15, num_patterns=10, target_moving_pattern=0, dense_rewards=True, policy="CnnPolicy"):
+    def __init__(self, render_mode=None, render_fps=4, size=10, num_obstacles=15, num_patterns=10, target_moving_pattern=0, dense_rewards=True, policy="CnnPolicy", channels_first=False, fast_step=False, start_sampling="rejection", min_path_length=None, max_path_length=None, instrument=False, viewer_process=False, local_view_size=7):
         self.size = size  # The size of the square grid
         self.window_size = 512 # The size of the PyGame window
         self.policy = policy
+        self.channels_first = channels_first  # CnnPolicy only: emit (1, size, size) so SB3 needs no VecTransposeImage
+        self.fast_step = fast_step  # step on a GridState and the occupancy grid instead of NumPy positions
+        self.state = None
+        self.occupancy = None
+        self.pattern_bank = None
+        """
+        start_sampling="rejection" draws agent and goal like the original experiments (and interface.py) did, redrawing
+        until a path connects them. "components" draws directly from the connected components of the free cells, with
+        the same distribution but without the retries. Both keep only pairs whose path length is within
+        [min_path_length, max_path_length] when those are given.
+        """
+        assert start_sampling in ("rejection", "components")
+        self.start_sampling = start_sampling
+        self.min_path_length = min_path_length
+        self.max_path_length = max_path_length
+        self._start_samplers = {}  # pattern-bank index -> StartGoalSampler
+        self._bank_index = None  # index of the current layout in the pattern bank, None for random layouts
+        self.grid_attempts = 0  # agent/goal draws the last _gen_grid needed
+        self.astar_expanded = 0  # nodes the last astar() call expanded
+        """
+        Distance fields are kept in an LRU cache keyed by (pattern-bank index, target x, target y), so a moving target
+        that comes back to a cell, or a bank layout seen again, costs a lookup instead of a BFS over the whole grid.
+        Random layouts have a bank index of None and empty the cache whenever a new one is generated.
+        Each entry is [field, rows], rows being the nested lists fast_step reads, built on first use.
+        """
+        self._distance_cache = OrderedDict()
+        self._distance_cache_limit = max(1, min(DISTANCE_CACHE_MAX_ENTRIES, DISTANCE_CACHE_BYTES // (4 * size * size)))
+        self._distance_entry = None
+        self.distance_source = None  # "table", "cache" or "search": where the last distance field came from
+        self._free_flat = None  # occupancy as a flat list of free flags, built for point searches
+        self._point_distances = {}  # flat cell -> path length to the current target, while distance_field is None
         self._agent_location = None
         self._target_location = None
         self.target_moving_pattern = target_moving_pattern
@@ -50,9 +109,35 @@ class GridWorldEnv(gym.Env):
             self.observation_space = spaces.Box(
                 low=0,
                 high=255,
-                shape=(self.size, self.size, 1),
+                shape=(1, self.size, self.size) if self.channels_first else (self.size, self.size, 1),
                 dtype="uint8"
             )
+
+            """
+            The maze observation is kept in a persistent buffer: obstacles are copied in from `self.occupancy` once
+            per episode and `_get_obs` only redraws the cells of the agent and the target.
+            `self._maze` is a 2D view into `self._observation`, whichever the channel layout.
+            """
+            self._observation = np.zeros(self.observation_space.shape, dtype=np.uint8)
+            self._maze = self._observation[0] if self.channels_first else self._observation[..., 0]
+            self._drawn_cells = [0, 0, 0, 0]  # agent x, y and target x, y of the last drawn maze
+        elif self.policy == "LocalPolicy":
+            """
+            An egocentric view for the MlpPolicy whose size does not depend on `size`: the local_view_size x
+            local_view_size cells centered on the agent, row by row (0 free, 1 obstacle or outside the grid, 4 the
+            target), followed by the target position relative to the agent (dx, dy). The window is a slice of
+            `self._padded_occupancy`, the occupancy grid surrounded by local_view_size // 2 rings of obstacles.
+            """
+            assert local_view_size % 2 == 1, "local_view_size must be odd, so that the agent is at the center"
+            self.local_view_size = local_view_size
+            self.observation_space = spaces.Box(
+                low=-(self.size - 1),
+                high=max(self.size - 1, 4),
+                shape=(local_view_size * local_view_size + 2,),
+                dtype=np.int16
+            )
+            self._padded_occupancy = None
+            self._padded_index = None  # bank index of the padded layout, None for a random one (never reused)
         elif self.policy == "MultiInputPolicy":
             self.observation_space = spaces.Dict({
                 "agent_pos": spaces.Box(low=0, high=self.size - 1, shape=(2,), dtype=np.int32),
@@ -105,18 +190,45 @@ class GridWorldEnv(gym.Env):
         """
         self.window = None
         self.clock = None
+        self._renderer = None  # GridRenderer, built on the first frame
 
+        """
+        With `viewer_process=True` the human-mode window belongs to a ViewerProcess: rendering a frame only queues a
+        snapshot for it, so step() is neither slowed down by drawing nor throttled to render_fps, and the window shows
+        the latest state at render_fps.
+        """
+        self.viewer_process = viewer_process
+        self._viewer = None
 
+        """
+        With `instrument=True` the hot-path methods are wrapped to count and time themselves, see get_stats().
+        Without it nothing is wrapped and `self.stats` stays None.
+        """
+        self.stats = None
+        if instrument:
+            self.stats = EnvStats()
+            instrument_env(self)
 
+    def get_stats(self, reset=False):
+        """
+        {"counters": {...}, "times": {phase: seconds}} accumulated since creation or the last reset=True call,
+        or None when the env is not instrumented. Reachable through VecEnv.env_method("get_stats").
+        """
+        if self.stats is None:
+            return None
+        return self.stats.snapshot(reset)
 
     def _get_obs(self):
 
         if self.policy == "CnnPolicy":
-            self.get_maze()
-            view = self.maze
-            view = np.array(view, dtype="uint8")
-            view = np.expand_dims(view, axis=-1)
-            result = view
+            agent_x, agent_y = self._agent_location
+            target_x, target_y = self._target_location
+            self._update_maze(agent_x, agent_y, target_x, target_y)
+            return self._observation.copy()
+        elif self.policy == "LocalPolicy":
+            agent_x, agent_y = self._agent_location
+            target_x, target_y = self._target_location
+            return self._local_observation(int(agent_x), int(agent_y), int(target_x), int(target_y))
         # elif self.policy == "MultiInputPolicy":
         #     result = {
         #         "agent": self._agent_location,
@@ -124,14 +236,51 @@ class GridWorldEnv(gym.Env):
         #         "obstacles": np.array(sorted(self.obstacles)).flatten(),
         #     }
         else:
-            result = np.concatenate([
-                np.array(self._agent_location),        # (x, y)
-                np.array(self._target_location),       # (x, y)
-                np.array(sorted(self.obstacles)).flatten(),    # [x1, y1, x2, y2, ...]
-            ])
-
-        result = result.astype(np.uint8)
-        return result
+            # [agent x, agent y, target x, target y, x1, y1, x2, y2, ...] with the obstacles in sorted() order,
+            # which only changes with the layout, so it is written once per episode by _reset_flat_observation
+            result = self._flat_buffer
+            result[0], result[1] = self._agent_location
+            result[2], result[3] = self._target_location
+            return result.copy()
+
+    def _reset_flat_observation(self):
+        # argwhere over the transposed grid lists the (x, y) of the obstacles ordered by x, then y, like sorted()
+        obstacle_coords = np.argwhere(np.asarray(self.occupancy).T).ravel()
+        self._flat_buffer = np.empty(4 + len(obstacle_coords), dtype=np.uint8)
+        self._flat_buffer[4:] = obstacle_coords
+
+    def _reset_local_observation(self):
+        if self._bank_index is None or self._bank_index != self._padded_index:
+            radius = self.local_view_size // 2
+            self._padded_occupancy = np.ones((self.size + 2 * radius, self.size + 2 * radius), dtype=np.int16)
+            self._padded_occupancy[radius:radius + self.size, radius:radius + self.size] = self.occupancy
+            self._padded_index = self._bank_index
+
+    def _local_observation(self, agent_x, agent_y, target_x, target_y):
+        view, radius = self.local_view_size, self.local_view_size // 2
+        observation = np.empty(view * view + 2, dtype=np.int16)
+        window = observation[:view * view].reshape(view, view)
+        # Cell (x, y) is at (x + radius, y + radius) in the padded grid, so the window centered on it starts at (x, y)
+        window[:] = self._padded_occupancy[agent_y:agent_y + view, agent_x:agent_x + view]
+        dx, dy = target_x - agent_x, target_y - agent_y
+        if abs(dx) <= radius and abs(dy) <= radius:
+            window[dy + radius, dx + radius] = 4
+        observation[-2] = dx
+        observation[-1] = dy
+        return observation
+
+    def _reset_maze(self):
+        self._maze[:] = self.occupancy
+        self._drawn_cells[:] = (0, 0, 0, 0)  # a border cell, so restoring it from the occupancy grid is a no-op
+
+    def _update_maze(self, agent_x, agent_y, target_x, target_y):
+        # Same values as get_maze(), but only the cells that can have changed since the last call are rewritten
+        maze, occupancy_rows, drawn = self._maze, self._occupancy_rows, self._drawn_cells
+        maze[drawn[1], drawn[0]] = occupancy_rows[drawn[1]][drawn[0]]
+        maze[drawn[3], drawn[2]] = occupancy_rows[drawn[3]][drawn[2]]
+        maze[target_y, target_x] = 4
+        maze[agent_y, agent_x] = 3
+        drawn[0], drawn[1], drawn[2], drawn[3] = agent_x, agent_y, target_x, target_y
 
     def get_maze(self):
         self.maze = np.zeros((self.size, self.size), dtype=int)
@@ -147,7 +296,8 @@ class GridWorldEnv(gym.Env):
             "distance": np.linalg.norm(
                 self._agent_location - self._target_location, ord=1
             ),
-            "wrong_steps": self.wrong_step_count
+            "wrong_steps": self.wrong_step_count,
+            "pattern": -1 if self._bank_index is None else self._bank_index
         }
 
 
@@ -158,6 +308,14 @@ class GridWorldEnv(gym.Env):
         self.step_count = 0
         self.wrong_step_count = 0
         self._gen_grid()
+        if self.policy == "CnnPolicy":
+            self._reset_maze()
+        elif self.policy == "LocalPolicy":
+            self._reset_local_observation()
+        else:
+            self._reset_flat_observation()
+        if self.fast_step:
+            self._reset_state()
 
         observation = self._get_obs()
         info = self._get_info()
@@ -168,6 +326,8 @@ class GridWorldEnv(gym.Env):
         return observation, info
 
     def step(self, action):
+        if self.fast_step:
+            return self._step_state(action)
 
         self.step_count += 1
 
@@ -177,8 +337,7 @@ class GridWorldEnv(gym.Env):
         if self.num_obstacles == 0:
             distance = self.manhattan(tuple(self._agent_location), tuple(self._target_location))
         else:
-            path = self.astar(tuple(self._agent_location), tuple(self._target_location))
-            distance = len(path)
+            distance = self.path_distance(self._agent_location)
 
 
         distanceBefore = distance
@@ -191,11 +350,17 @@ class GridWorldEnv(gym.Env):
         if self.num_obstacles == 0:
             distance = self.manhattan(tuple(new_agent_location), tuple(self._target_location))
         else:
-            path = self.astar(tuple(new_agent_location), tuple(self._target_location))
-            distance = len(path)
+            distance = self.path_distance(new_agent_location)
 
         distanceAfter = distance
 
+        # A moving target can step where no path leads; the cells it cannot be reached from then count as
+        # size * size steps away, like the unreachable cells of the vector env's distance fields
+        if distanceBefore is None:
+            distanceBefore = self.size * self.size
+        if distanceAfter is None:
+            distanceAfter = self.size * self.size
+
         if self.dense_rewards:
             if (distanceAfter < distanceBefore):
                 reward = 1 / 100
@@ -219,7 +384,7 @@ class GridWorldEnv(gym.Env):
                 terminated = True
                 reward = 1 - 0.9 * (self.step_count / self.max_steps)
 
-            self._target_location = new_target_location
+            self._move_target(new_target_location)
 
         if self.target_moving_pattern == 2: # moves further away
             distance_before = self.manhattan(tuple(self._agent_location), tuple(self._target_location))
@@ -243,7 +408,7 @@ class GridWorldEnv(gym.Env):
                 terminated = True
                 reward = 1 - 0.9 * (self.step_count / self.max_steps)
 
-            self._target_location = new_target_location
+            self._move_target(new_target_location)
 
 
 
@@ -274,58 +439,251 @@ class GridWorldEnv(gym.Env):
 
         return observation, reward, terminated, truncated, info
 
+    def _reset_state(self):
+        agent_x, agent_y = self._agent_location
+        target_x, target_y = self._target_location
+        self.state = GridState(int(agent_x), int(agent_y), int(target_x), int(target_y))
+
+        # The step loop only indexes Python lists, which returns cached small ints instead of NumPy scalars
+        self._action_deltas = tuple((int(dx), int(dy)) for dx, dy in (self._action_to_direction[a.value] for a in Actions))
+        if self.num_obstacles != 0:
+            self._distance_rows = self._current_distance_rows()
+
+        if self.policy not in ("CnnPolicy", "LocalPolicy"):
+            self._flat_observation = self._get_obs()
+
+    def _step_state(self, action):
+        """
+        step() for `fast_step=True`: the same transition, rewards and RNG calls as the default path, computed on the
+        integer GridState and the occupancy/distance rows. Apart from the returned observation and info the only
+        objects touched are ints, and `_agent_location`/`_target_location` are updated in place.
+        """
+        state = self.state
+        state.step_count += 1
+        last = self.size - 1
+
+        agent_x, agent_y = state.agent_x, state.agent_y
+        target_x, target_y = state.target_x, state.target_y
+        dx, dy = self._action_deltas[action]
+        new_x = min(max(agent_x + dx, 0), last)
+        new_y = min(max(agent_y + dy, 0), last)
+
+        if self.num_obstacles == 0:
+            distanceBefore = abs(agent_x - target_x) + abs(agent_y - target_y)
+            distanceAfter = abs(new_x - target_x) + abs(new_y - target_y)
+        elif self._distance_rows is not None:
+            distanceBefore = self._distance_rows[agent_y][agent_x]
+            distanceAfter = self._distance_rows[new_y][new_x]
+        else:
+            distanceBefore = self._point_distance(agent_x, agent_y)
+            distanceAfter = self._point_distance(new_x, new_y)
+        if distanceBefore is None:  # no path to the target, as in step()
+            distanceBefore = self.size * self.size
+        if distanceAfter is None:
+            distanceAfter = self.size * self.size
+
+        terminated = False
+        reward = 0
+
+        if self.dense_rewards:
+            if distanceAfter < distanceBefore:
+                reward = 1 / 100
+            elif distanceAfter > distanceBefore:
+                reward = -2 / 100
+
+        if distanceAfter > distanceBefore:
+            state.wrong_step_count += 1
+
+        if self.target_moving_pattern in (1, 2):
+            new_target_x, new_target_y = target_x, target_y
+
+            if self.target_moving_pattern == 1: # random
+                if np.random.rand() < 0.8:
+                    target_dx, target_dy = self._action_deltas[self.action_space.sample()]
+                    new_target_x = min(max(target_x + target_dx, 1), last - 1)
+                    new_target_y = min(max(target_y + target_dy, 1), last - 1)
+            else: # moves further away
+                distance_before = abs(agent_x - target_x) + abs(agent_y - target_y)
+                if np.random.rand() < 0.8:
+                    for target_dx, target_dy in self._action_deltas:
+                        new_target_x = min(max(target_x + target_dx, 1), last - 1)
+                        new_target_y = min(max(target_y + target_dy, 1), last - 1)
+                        if abs(agent_x - new_target_x) + abs(agent_y - new_target_y) > distance_before:
+                            break
+
+            if new_x == target_x and new_y == target_y and new_target_x == agent_x and new_target_y == agent_y:
+                terminated = True
+                reward = 1 - 0.9 * (state.step_count / self.max_steps)
+
+            if new_target_x != target_x or new_target_y != target_y:
+                target_x, target_y = new_target_x, new_target_y
+                state.target_x, state.target_y = target_x, target_y
+                self._target_location[0], self._target_location[1] = target_x, target_y
+                if self.num_obstacles != 0:
+                    self._retarget_distances()
+                    self._distance_rows = None if self.distance_field is None else self._current_distance_rows()
+
+        if new_x == target_x and new_y == target_y:
+            terminated = True
+            reward = 1 - 0.9 * (state.step_count / self.max_steps)
+
+        if self._occupancy_rows[new_y][new_x]:
+            terminated = True
+            reward = 0
+            state.wrong_step_count += 1
+
+        state.agent_x, state.agent_y = new_x, new_y
+        self._agent_location[0], self._agent_location[1] = new_x, new_y
+        self.step_count = state.step_count
+        self.wrong_step_count = state.wrong_step_count
+
+        truncated = False
+        if state.step_count >= self.max_steps:
+            truncated = True
+            reward = -1
+
+        if self.render_mode == "human":
+            self._render_frame()
+
+        if self.policy == "CnnPolicy":
+            self._update_maze(new_x, new_y, target_x, target_y)
+            observation = self._observation.copy()
+        elif self.policy == "LocalPolicy":
+            observation = self._local_observation(new_x, new_y, target_x, target_y)
+        else:
+            flat = self._flat_observation
+            flat[0], flat[1], flat[2], flat[3] = new_x, new_y, target_x, target_y
+            observation = flat.copy()
+
+        info = {
+            "distance": float(abs(new_x - target_x) + abs(new_y - target_y)),
+            "wrong_steps": state.wrong_step_count,
+            "pattern": -1 if self._bank_index is None else self._bank_index,
+        }
+
+        return observation, reward, terminated, truncated, info
+
     def _gen_grid(self):
+        self._free_flat = None
 
         if self.num_patterns == 0:
             selected_pattern = self.generate_pattern() # always random pattern, not cycling between 10 patterns
+
+            self.obstacles = set([tuple(coord) for coord in selected_pattern])
+            for i in range(self.size): # we add the borders
+                self.obstacles.add((i, 0))  # Left edge
+                self.obstacles.add((i, self.size - 1))  # Right edge
+                self.obstacles.add((0, i))  # Top edge
+                self.obstacles.add((self.size - 1, i))  # Bottom edge
+
+            self.occupancy = np.zeros((self.size, self.size), dtype=np.uint8)
+            for x, y in self.obstacles:
+                self.occupancy[y, x] = 1
+            self._occupancy_rows = self.occupancy.tolist()
+            self._bank_index = None
+            self._distance_cache.clear()
+        else:
+            # The patterns are compiled once into a bank shared by every env, borders included
+            if self.pattern_bank is None:
+                self._load_pattern_bank()
+
+            self._bank_index = self.obstacle_index
+            self.obstacles = self.pattern_bank.obstacle_set(self.obstacle_index)
+            self.occupancy = self.pattern_bank.occupancy[self.obstacle_index]
+            self._occupancy_rows = self.pattern_bank.occupancy_rows(self.obstacle_index)
+
+        self.grid_attempts = 0
+        if self.start_sampling == "components":
+            self._sample_connected_start()
         else:
-            file_path = 'obstacle_patterns.json'
-            if not os.path.exists(file_path):
-                self.save_patterns()
-            # load the obstacle patterns from the file
-            with open(file_path, 'r') as f:
-                obstacle_patterns = json.load(f)
-
-            selected_pattern = obstacle_patterns[self.obstacle_index]
-
-        self.obstacles = set([tuple(coord) for coord in selected_pattern])
-        for i in range(self.size): # we add the borders
-            self.obstacles.add((i, 0))  # Left edge
-            self.obstacles.add((i, self.size - 1))  # Right edge
-            self.obstacles.add((0, i))  # Top edge
-            self.obstacles.add((self.size - 1, i))  # Bottom edge
-
-        path = None
-        while path == None:
-            # Generate a random position for the agent within the grid bounds
-            # Generate a random position for the agent
-            while True:
-                agent_x = self.np_random.integers(1, self.width - 2)
-                agent_y = self.np_random.integers(1, self.height - 2)
-                if (agent_x, agent_y) not in self.obstacles:
-                    break
-
-            self._agent_location = np.array((agent_x, agent_y))
-
-            # Generate a random position for the goal
-            while True:
-                goal_x = self.np_random.integers(1, self.width - 2)
-                goal_y = self.np_random.integers(1, self.height - 2)
-                if (goal_x, goal_y) not in self.obstacles and (goal_x, goal_y) != tuple(self._agent_location):
-                    break
-
-            self._target_location = np.array((goal_x, goal_y))
+            path = None
+            while path == None:
+                self.grid_attempts += 1
+                # Generate a random position for the agent within the grid bounds
+                # Generate a random position for the agent
+                while True:
+                    agent_x = self.np_random.integers(1, self.width - 2)
+                    agent_y = self.np_random.integers(1, self.height - 2)
+                    if (agent_x, agent_y) not in self.obstacles:
+                        break
 
-            if self.num_obstacles == 0:
-                path = self.manhattan(tuple(self._agent_location), tuple(self._target_location))
-            else:
-                path = self.astar(tuple(self._agent_location), tuple(self._target_location))
+                self._agent_location = np.array((agent_x, agent_y))
+
+                # Generate a random position for the goal
+                while True:
+                    goal_x = self.np_random.integers(1, self.width - 2)
+                    goal_y = self.np_random.integers(1, self.height - 2)
+                    if (goal_x, goal_y) not in self.obstacles and (goal_x, goal_y) != tuple(self._agent_location):
+                        break
+
+                self._target_location = np.array((goal_x, goal_y))
+
+                if self.num_obstacles == 0:
+                    path = self.manhattan(tuple(self._agent_location), tuple(self._target_location))
+                else:
+                    self._compute_distance_field()
+                    path = self.path_distance(self._agent_location)
+
+                if path != None and not self._path_length_allowed(path):
+                    path = None
 
         # Update index to cycle through patterns
         if self.num_patterns != 0:
             self.obstacle_index = (self.obstacle_index + 1) % self.num_patterns
 
 
+    def _load_pattern_bank(self):
+        self.pattern_bank = PatternBank.load(self.size, create_patterns=self.save_patterns)
+
+    def _path_length_allowed(self, path):
+        if self.min_path_length is not None and path < self.min_path_length:
+            return False
+        if self.max_path_length is not None and path > self.max_path_length:
+            return False
+        return True
+
+    def _sample_connected_start(self):
+        sampler = self._start_sampler()
+        while True:
+            self.grid_attempts += 1
+            agent_location, target_location = sampler.sample(self.np_random)
+            self._agent_location = np.array(agent_location)
+            self._target_location = np.array(target_location)
+
+            if self.num_obstacles == 0:
+                path = self.manhattan(agent_location, target_location)
+            else:
+                self._compute_distance_field()
+                path = self.path_distance(agent_location)
+
+            if sampler.exact or self._path_length_allowed(path):
+                return
+
+    def _start_sampler(self):
+        if self._bank_index is not None and self._bank_index in self._start_samplers:
+            return self._start_samplers[self._bank_index]
+
+        # Without internal obstacles the original loop never rejects a pair (it only measures manhattan distance)
+        blocked = self.occupancy.astype(bool)
+        if self.num_obstacles == 0:
+            labels = np.where(blocked, -1, 0)
+        elif self._bank_index is not None:
+            labels = self.pattern_bank.components[self._bank_index]
+        else:
+            labels = connected_components(blocked)
+
+        distances = None
+        if self._bank_index is not None and self.pattern_bank.distances is not None:
+            distances = self.pattern_bank.distances[self._bank_index]
+            if self.num_obstacles == 0:
+                distances = None  # path lengths are manhattan distances then, checked by the caller
+
+        # the same window as np_random.integers(1, self.width - 2) in the rejection loop
+        sampler = StartGoalSampler(labels, 1, self.size - 3, distances, self.min_path_length, self.max_path_length)
+        if self._bank_index is not None:
+            self._start_samplers[self._bank_index] = sampler
+        return sampler
+
     def save_patterns(self):
         # Generate x random obstacle patterns and apply discard rules
         obstacle_patterns = []
@@ -336,8 +694,7 @@ class GridWorldEnv(gym.Env):
         print(f"Generated {obstacle_patterns} patterns.")
 
         try:
-            with open('obstacle_patterns.json', 'w') as f:
-                json.dump(obstacle_patterns, f)
+            write_patterns(obstacle_patterns)
             print("Patterns saved successfully.")
         except Exception as e:
             print(f"Error saving patterns: {e}")
@@ -353,6 +710,149 @@ class GridWorldEnv(gym.Env):
             pattern.add((x, y))
         return list(pattern)
 
+    def _move_target(self, new_target_location):
+        moved = not np.array_equal(new_target_location, self._target_location)
+        self._target_location = new_target_location
+        if moved and self.num_obstacles != 0:
+            self._retarget_distances()
+
+    def _retarget_distances(self):
+        """
+        Follows a target that moved. A target only stays on a cell for a step or two, so on large grids a BFS over
+        the whole grid per move is wasted work: the distance field is dropped and the few cells the next steps ask
+        about are searched for one by one with _point_distance(), which does not depend on the grid area.
+        """
+        if self.size * self.size > POINT_SEARCH_MIN_CELLS:
+            self.distance_field = None
+            self._point_distances = {}
+        else:
+            self._compute_distance_field()
+
+    def _compute_distance_field(self):
+        """
+        Reverse BFS from the target, so that every cell holds the length of the path astar() would return from it
+        (-1 where there is no path). Computed once per episode and again only when the target moves.
+        Pattern-bank layouts read it from the bank's precomputed table instead, and fields computed before for the
+        same layout and target come from the cache.
+        """
+        goal_x, goal_y = int(self._target_location[0]), int(self._target_location[1])
+        key = (self._bank_index, goal_x, goal_y)
+        cache = self._distance_cache
+        entry = cache.get(key)
+        if entry is not None:
+            cache.move_to_end(key)
+            self.distance_source = "cache"
+        else:
+            if self._bank_index is not None and self.pattern_bank.distances is not None:
+                field = self.pattern_bank.distance_field(self._bank_index, (goal_x, goal_y))
+                self.distance_source = "table"
+            else:
+                field = self._search_distance_field(goal_x, goal_y)
+                self.distance_source = "search"
+            entry = [field, None]
+            cache[key] = entry
+            if len(cache) > self._distance_cache_limit:
+                cache.popitem(last=False)
+
+        self._distance_entry = entry
+        self.distance_field = entry[0]
+
+    def _current_distance_rows(self):
+        """self.distance_field as nested lists with None for cells without a path, shared through the cache."""
+        entry = self._distance_entry
+        if entry[1] is None:
+            entry[1] = [[None if d < 0 else d for d in row] for row in entry[0].tolist()]
+        return entry[1]
+
+    def _search_distance_field(self, goal_x, goal_y):
+        size = self.size
+        blocked = self.occupancy.astype(bool)
+
+        field = np.full((size, size), -1, dtype=np.int32)
+        field[goal_y, goal_x] = 0
+
+        # astar() never steps onto an obstacle, so a target inside one can only be reached from itself
+        if not blocked[goal_y, goal_x]:
+            # Flat Python lists are much faster to walk than NumPy element access. The border is always an obstacle,
+            # so a free cell never sits on the edge and its four neighbors are always inside the grid.
+            free = (~blocked).ravel().tolist()
+            distances = [-1] * (size * size)
+            goal = goal_y * size + goal_x
+            distances[goal] = 0
+            queue = deque([goal])
+            while queue:
+                cell = queue.popleft()
+                next_distance = distances[cell] + 1
+                for neighbor in (cell - 1, cell + 1, cell - size, cell + size):
+                    if free[neighbor] and distances[neighbor] == -1:
+                        distances[neighbor] = next_distance
+                        queue.append(neighbor)
+            field[:] = np.array(distances, dtype=np.int32).reshape(size, size)
+
+            # astar() does not check its start cell, so from an obstacle the path continues through the best neighbor
+            unreachable = size * size
+            padded = np.full((size + 2, size + 2), unreachable, dtype=np.int32)
+            padded[1:-1, 1:-1] = np.where(field >= 0, field, unreachable)
+            neighbor_min = np.minimum.reduce([
+                padded[1:-1, :-2], padded[1:-1, 2:], padded[:-2, 1:-1], padded[2:, 1:-1]
+            ])
+            from_obstacle = blocked & (neighbor_min < unreachable)
+            field[from_obstacle] = neighbor_min[from_obstacle] + 1
+            field[goal_y, goal_x] = 0
+
+        return field
+
+    def path_distance(self, pos):
+        """
+        Shortest path length from `pos` to the target, equal to len(self.astar(pos, target)), or None without a path.
+        """
+        if self.distance_field is None:
+            return self._point_distance(int(pos[0]), int(pos[1]))
+        distance = self.distance_field[pos[1], pos[0]]
+        return None if distance < 0 else int(distance)
+
+    def _point_distance(self, x, y):
+        """
+        len(self.astar((x, y), target)) computed with A* over the flat occupancy list, or None without a path.
+        Results are kept until the target moves again.
+        """
+        size = self.size
+        start = y * size + x
+        memo = self._point_distances
+        if start in memo:
+            return memo[start]
+
+        if self._free_flat is None:
+            # `size` blocked cells at the end also catch the neighbors above row 0 (negative indices) and below the
+            # last row; left and right neighbors of a border cell wrap onto the border, which is always blocked
+            self._free_flat = [not cell for row in self._occupancy_rows for cell in row] + [False] * size
+        free = self._free_flat
+
+        goal_x, goal_y = int(self._target_location[0]), int(self._target_location[1])
+        goal = goal_y * size + goal_x
+        distance = None
+        best = {start: 0}
+        # Ties on f go to the deepest node: with the manhattan heuristic every cell of the rectangle between start
+        # and goal has the same f, and expanding the shallow ones first would flood the whole rectangle
+        open_list = [(abs(x - goal_x) + abs(y - goal_y), 0, start)]
+        while open_list:
+            _, negative_g, current = heapq.heappop(open_list)
+            current_g = -negative_g
+            if current == goal:
+                distance = current_g
+                break
+            if current_g > best[current]:
+                continue
+            tentative_g = current_g + 1
+            for neighbor in (current - 1, current + 1, current - size, current + size):
+                if free[neighbor] and tentative_g < best.get(neighbor, tentative_g + 1):
+                    best[neighbor] = tentative_g
+                    neighbor_y, neighbor_x = divmod(neighbor, size)
+                    heapq.heappush(open_list, (tentative_g + abs(neighbor_x - goal_x) + abs(neighbor_y - goal_y), -tentative_g, neighbor))
+
+        memo[start] = distance
+        return distance
+
     def manhattan(self, start, goal):
         return abs(start[0] - goal[0]) + abs(start[1] - goal[1])
 
@@ -386,9 +886,11 @@ class GridWorldEnv(gym.Env):
         came_from = {}
 
         self.obstacle_set = set(self.obstacles)
+        self.astar_expanded = 0
 
         while open_list:
             _, current_g, current = heapq.heappop(open_list)
+            self.astar_expanded += 1
 
             # If we reached the goal, reconstruct the path
             if current == goal:
@@ -416,66 +918,29 @@ class GridWorldEnv(gym.Env):
             return self._render_frame()
 
     def _render_frame(self):
-        if self.window is None and self.render_mode == "human":
-            pygame.init()
-            pygame.display.init()
-            self.window = pygame.display.set_mode((self.window_size, self.window_size))
-        if self.clock is None and self.render_mode == "human":
-            self.clock = pygame.time.Clock()
-
-        canvas = pygame.Surface((self.window_size, self.window_size))
-        canvas.fill((255, 255, 255))
-
-        # Draw obstacles
-        pix_square_size = self.window_size / self.size
-        for obstacle in self.obstacles:
-            pygame.draw.rect(
-                canvas,
-                (128, 128, 128),  # Gray color for obstacles
-                pygame.Rect(
-                    pix_square_size * np.array(obstacle),
-                    (pix_square_size, pix_square_size),
-                    ),
-            )
+        if self.viewer_process and self.render_mode == "human":
+            if self._viewer is None:
+                self._viewer = ViewerProcess(self.size, self.window_size, fps=self.metadata["render_fps"])
+            self._viewer.show(self.obstacles, self._agent_location, self._target_location)
+            return None
 
-        # First we draw the target
-        pygame.draw.rect(
-            canvas,
-            (255, 0, 0),
-            pygame.Rect(
-                pix_square_size * self._target_location,
-                (pix_square_size, pix_square_size),
-            ),
-        )
-        # Now we draw the agent
-        pygame.draw.circle(
-            canvas,
-            (0, 0, 255),
-            (self._agent_location + 0.5) * pix_square_size,
-            pix_square_size / 3,
-        )
-
-        # Finally, add some gridlines
-        line_width = 3
-        for x in range(self.size + 1):
-            pygame.draw.line(
-                canvas,
-                0,
-                (0, pix_square_size * x),
-                (self.window_size, pix_square_size * x),
-                width=line_width,
-            )
-            pygame.draw.line(
-                canvas,
-                0,
-                (pix_square_size * x, 0),
-                (pix_square_size * x, self.window_size),
-                width=line_width,
-            )
+        if self._renderer is None:
+            self._renderer = GridRenderer(self.size, self.window_size)
+        # Obstacles and gridlines come from a background drawn once per layout, only target and agent are drawn here
+        frame = self._renderer.frame(self.obstacles, self._agent_location, self._target_location)
 
         if self.render_mode == "human":
-            # The following line copies our drawings from `canvas` to the visible window
-            self.window.blit(canvas, canvas.get_rect())
+            import pygame  # only the window needs pygame, rgb_array frames are rasterized in NumPy
+
+            if self.window is None:
+                pygame.init()
+                pygame.display.init()
+                self.window = pygame.display.set_mode((self.window_size, self.window_size))
+            if self.clock is None:
+                self.clock = pygame.time.Clock()
+
+            # The following line copies the frame to the visible window
+            pygame.surfarray.blit_array(self.window, frame.swapaxes(0, 1))
             pygame.event.pump()
             pygame.display.update()
 
@@ -484,14 +949,14 @@ class GridWorldEnv(gym.Env):
             # keep the framerate stable.
             self.clock.tick(self.metadata["render_fps"])
 
-
-        rgb_array = np.transpose(
-            np.array(pygame.surfarray.pixels3d(canvas)), axes=(1, 0, 2)
-        )
-        # print("Shape of RGB array:", rgb_array.shape)
-        return rgb_array
+        return frame
 
     def close(self):
+        if self._viewer is not None:
+            self._viewer.close()
+            self._viewer = None
         if self.window is not None:
+            import pygame
+
             pygame.display.quit()
             pygame.quit()
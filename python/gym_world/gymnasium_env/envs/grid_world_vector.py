@@ -0,0 +1,310 @@
+import numpy as np
+from gymnasium.utils import seeding
+from gymnasium.vector import AutoresetMode, VectorEnv
+from gymnasium.vector.utils import batch_space
+
+from gymnasium_env.envs.grid_paths import distance_fields
+from gymnasium_env.envs.grid_world import GridWorldEnv
+from gymnasium_env.envs.pattern_bank import PatternBank, write_patterns
+
+
+# Same order as grid_world.Actions: right, up, left, down
+DIRECTIONS = np.array([[1, 0], [0, -1], [-1, 0], [0, 1]])
+
+
+class GridWorldVectorEnv(VectorEnv):
+    """
+    `num_envs` copies of GridWorldEnv stepped together with array operations.
+
+    Agent and target positions, obstacle grids, step counters and distance fields of every copy live in stacked
+    arrays, so a step costs a handful of NumPy calls no matter how many environments there are. Finished copies
+    are reset in the same step; their last observation and info are returned in info["final_obs"] and
+    info["final_info"], like gymnasium's SyncVectorEnv in SAME_STEP autoreset mode.
+
+    Of GridWorldEnv's options, `fast_step` changes nothing here (every step is already array operations) and both
+    `start_sampling` values give the same agent/goal distribution, which is drawn by batched redraws of the envs
+    without a path; `min_path_length` and `max_path_length` bound the path length like in GridWorldEnv.
+    """
+    metadata = {"autoreset_mode": AutoresetMode.SAME_STEP}
+
+    def __init__(self, num_envs=8, render_mode=None, size=10, num_obstacles=15, num_patterns=10, target_moving_pattern=0, dense_rewards=True, policy="CnnPolicy", channels_first=False, local_view_size=7, fast_step=False, start_sampling="rejection", min_path_length=None, max_path_length=None):
+        assert render_mode is None, "GridWorldVectorEnv does not render, use GridWorldEnv to watch an agent"
+        assert start_sampling in ("rejection", "components")
+
+        self.num_envs = num_envs
+        self.render_mode = render_mode
+        self.size = size
+        self.policy = policy
+        self.channels_first = channels_first
+        self.target_moving_pattern = target_moving_pattern
+        self.dense_rewards = dense_rewards
+        self.num_obstacles = num_obstacles
+        self.num_patterns = num_patterns
+        self.min_path_length = min_path_length
+        self.max_path_length = max_path_length
+        self.max_steps = 100
+
+        # The single env is only used for its spaces, so that both implementations always agree on them
+        single_env = GridWorldEnv(size=size, num_obstacles=num_obstacles, num_patterns=num_patterns, policy=policy, channels_first=channels_first, local_view_size=local_view_size)
+        self.single_observation_space = single_env.observation_space
+        self.single_action_space = single_env.action_space
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+        self.action_space = batch_space(self.single_action_space, num_envs)
+
+        self._env_range = np.arange(num_envs)
+        self._agent_location = np.zeros((num_envs, 2), dtype=np.int64)
+        self._target_location = np.zeros((num_envs, 2), dtype=np.int64)
+        self.step_count = np.zeros(num_envs, dtype=np.int64)
+        self.wrong_step_count = np.zeros(num_envs, dtype=np.int64)
+        self.obstacle_index = np.zeros(num_envs, dtype=np.int64)
+        self.layout_index = np.full(num_envs, -1, dtype=np.int64)  # pattern-bank index of each layout, -1 if random
+        self.blocked = np.zeros((num_envs, size, size), dtype=bool)
+        self.distance_field = np.zeros((num_envs, size, size), dtype=np.int32)
+        if policy == "LocalPolicy":
+            # The obstacle grids surrounded by local_view_size // 2 rings of obstacles, and the window of every cell
+            # of them as a view: the window of the cell (x, y) of an env is _local_windows[env, y, x]
+            self.local_view_size = local_view_size
+            radius = local_view_size // 2
+            self._padded_blocked = np.ones((num_envs, size + 2 * radius, size + 2 * radius), dtype=np.int16)
+            self._local_windows = np.lib.stride_tricks.sliding_window_view(self._padded_blocked, (local_view_size, local_view_size), axis=(1, 2))
+        elif policy != "CnnPolicy":
+            self._obstacle_coords = np.zeros((num_envs, self.single_observation_space.shape[0] - 4), dtype=np.uint8)
+        self.pattern_bank = None
+
+    def reset(self, *, seed=None, options=None):
+        if seed is not None:
+            self._np_random, self._np_random_seed = seeding.np_random(seed)
+            self.obstacle_index[:] = 0
+
+        self._reset_envs(self._env_range)
+
+        return self._get_obs(), self._get_info()
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        self.step_count += 1
+
+        new_agent_location = np.clip(self._agent_location + DIRECTIONS[actions], 0, self.size - 1)
+        distance_before = self._path_distance(self._agent_location)
+        distance_after = self._path_distance(new_agent_location)
+
+        rewards = np.zeros(self.num_envs, dtype=np.float64)
+        if self.dense_rewards:
+            rewards[distance_after < distance_before] = 1 / 100
+            rewards[distance_after > distance_before] = -2 / 100
+        self.wrong_step_count += distance_after > distance_before
+
+        terminated = np.zeros(self.num_envs, dtype=bool)
+        goal_reward = 1 - 0.9 * (self.step_count / self.max_steps)
+
+        if self.target_moving_pattern in (1, 2):
+            new_target_location = self._move_targets()
+            swapped = np.all(new_agent_location == self._target_location, axis=1) \
+                & np.all(new_target_location == self._agent_location, axis=1)
+            terminated |= swapped
+            rewards[swapped] = goal_reward[swapped]
+
+            moved = np.flatnonzero(np.any(new_target_location != self._target_location, axis=1))
+            self._target_location = new_target_location
+            if self.num_obstacles != 0 and moved.size:
+                self.distance_field[moved] = self._distance_fields(moved, self._target_location[moved])
+
+        reached = np.all(new_agent_location == self._target_location, axis=1)
+        terminated |= reached
+        rewards[reached] = goal_reward[reached]
+
+        hit_obstacle = self.blocked[self._env_range, new_agent_location[:, 1], new_agent_location[:, 0]]
+        terminated |= hit_obstacle
+        rewards[hit_obstacle] = 0
+        self.wrong_step_count += hit_obstacle
+
+        self._agent_location = new_agent_location
+
+        truncated = self.step_count >= self.max_steps
+        rewards[truncated] = -1
+
+        observations = self._get_obs()
+        infos = self._get_info()
+
+        done = terminated | truncated
+        if done.any():
+            done_envs = np.flatnonzero(done)
+            final_obs = np.empty(self.num_envs, dtype=object)
+            for i in done_envs:
+                final_obs[i] = observations[i]
+            infos["final_obs"] = final_obs
+            infos["_final_obs"] = done
+            infos["final_info"] = {
+                "distance": infos["distance"],
+                "_distance": done,
+                "wrong_steps": infos["wrong_steps"],
+                "_wrong_steps": done,
+                "pattern": infos["pattern"],
+                "_pattern": done,
+            }
+            infos["_final_info"] = done
+
+            self._reset_envs(done_envs)
+            observations = self._get_obs()
+            infos.update(self._get_info())
+
+        return observations, rewards, terminated, truncated, infos
+
+    def _reset_envs(self, envs):
+        self.step_count[envs] = 0
+        self.wrong_step_count[envs] = 0
+        blocked = self._gen_layouts(envs)
+        self.blocked[envs] = blocked
+        if self.num_patterns != 0:
+            self.layout_index[envs] = self.obstacle_index[envs]
+
+        # Same distribution as GridWorldEnv._gen_grid: agent and goal are resampled until a path connects them,
+        # of a length within [min_path_length, max_path_length] when those are given
+        bounded = self.min_path_length is not None or self.max_path_length is not None
+        pending = np.arange(len(envs))
+        while pending.size:
+            agent_location = self._sample_free_cells(blocked[pending])
+            target_location = self._sample_free_cells(blocked[pending], exclude=agent_location)
+            self._agent_location[envs[pending]] = agent_location
+            self._target_location[envs[pending]] = target_location
+
+            if self.num_obstacles == 0:
+                if not bounded:
+                    break
+                path = np.abs(agent_location - target_location).sum(axis=1)
+            else:
+                fields = self._distance_fields(envs[pending], target_location)
+                self.distance_field[envs[pending]] = fields
+                path = fields[np.arange(len(pending)), agent_location[:, 1], agent_location[:, 0]]
+            accepted = path < self.size * self.size
+            if self.min_path_length is not None:
+                accepted &= path >= self.min_path_length
+            if self.max_path_length is not None:
+                accepted &= path <= self.max_path_length
+            pending = pending[~accepted]
+
+        if self.policy == "LocalPolicy":
+            radius = self.local_view_size // 2
+            self._padded_blocked[envs, radius:radius + self.size, radius:radius + self.size] = blocked
+        elif self.policy != "CnnPolicy":
+            # sorted(self.obstacles) in GridWorldEnv orders by x, then y, which is argwhere over the transposed grid
+            coords = np.argwhere(blocked.transpose(0, 2, 1))[:, 1:]
+            self._obstacle_coords[envs] = coords.reshape(len(envs), -1)
+
+        if self.num_patterns != 0:
+            self.obstacle_index[envs] = (self.obstacle_index[envs] + 1) % self.num_patterns
+
+    def _gen_layouts(self, envs):
+        size = self.size
+        blocked = np.zeros((len(envs), size, size), dtype=bool)
+
+        if self.num_patterns == 0:
+            blocked[:] = self._random_layouts(len(envs))
+        else:
+            if self.pattern_bank is None:
+                self.pattern_bank = PatternBank.load(size, create_patterns=self._save_patterns)
+            blocked[:] = self.pattern_bank.occupancy[self.obstacle_index[envs]]
+            return blocked
+
+        # we add the borders
+        blocked[:, 0, :] = True
+        blocked[:, size - 1, :] = True
+        blocked[:, :, 0] = True
+        blocked[:, :, size - 1] = True
+        return blocked
+
+    def _random_layouts(self, count):
+        # Uniform over all `num_obstacles`-subsets of the inner area, which is what GridWorldEnv.generate_pattern draws
+        modifier = 2
+        low, high = modifier, self.size - modifier - 1
+        span = high - low
+        layouts = np.zeros((count, self.size, self.size), dtype=bool)
+        if self.num_obstacles == 0:
+            return layouts
+
+        cells = np.argsort(self.np_random.random((count, span * span)), axis=1)[:, :self.num_obstacles]
+        rows = np.repeat(np.arange(count), self.num_obstacles)
+        layouts[rows, (cells // span).ravel() + low, (cells % span).ravel() + low] = True
+        return layouts
+
+    def _save_patterns(self):
+        grids = self._random_layouts(self.num_patterns)
+        obstacle_patterns = [[[int(x), int(y)] for y, x in np.argwhere(grid)] for grid in grids]
+        write_patterns(obstacle_patterns)
+
+    def _sample_free_cells(self, blocked, exclude=None):
+        locations = np.zeros((len(blocked), 2), dtype=np.int64)
+        pending = np.arange(len(blocked))
+        while pending.size:
+            candidates = self.np_random.integers(1, self.size - 2, size=(len(pending), 2))
+            free = ~blocked[pending, candidates[:, 1], candidates[:, 0]]
+            if exclude is not None:
+                free &= np.any(candidates != exclude[pending], axis=1)
+            locations[pending[free]] = candidates[free]
+            pending = pending[~free]
+        return locations
+
+    def _distance_fields(self, envs, goals):
+        """
+        Distance fields towards `goals` for the layouts of `envs`: read from the pattern bank's table when it has one,
+        otherwise computed with a batched BFS. Cells without a path hold size * size so they compare as further away.
+        """
+        bank = self.pattern_bank
+        if self.num_patterns != 0 and bank.distances is not None:
+            fields = bank.distances[self.layout_index[envs], goals[:, 1] * self.size + goals[:, 0]]
+            fields = fields.reshape(len(envs), self.size, self.size).astype(np.int32)
+            fields[fields < 0] = self.size * self.size
+            return fields
+        return distance_fields(self.blocked[envs], goals)
+
+    def _path_distance(self, locations):
+        if self.num_obstacles == 0:
+            return np.abs(locations - self._target_location).sum(axis=1)
+        return self.distance_field[self._env_range, locations[:, 1], locations[:, 0]]
+
+    def _move_targets(self):
+        moves = self.np_random.random(self.num_envs) < 0.8
+
+        if self.target_moving_pattern == 1:  # random
+            target_actions = self.np_random.integers(0, 4, size=self.num_envs)
+            candidates = np.clip(self._target_location + DIRECTIONS[target_actions], 1, self.size - 2)
+        else:  # moves further away, trying the actions in order and keeping the last one if none helps
+            distance_before = np.abs(self._agent_location - self._target_location).sum(axis=1)
+            options = np.clip(self._target_location[None] + DIRECTIONS[:, None], 1, self.size - 2)
+            further = np.abs(options - self._agent_location[None]).sum(axis=2) > distance_before
+            chosen = np.where(further.any(axis=0), further.argmax(axis=0), len(DIRECTIONS) - 1)
+            candidates = options[chosen, self._env_range]
+
+        return np.where(moves[:, None], candidates, self._target_location)
+
+    def _get_obs(self):
+        if self.policy == "CnnPolicy":
+            maze = self.blocked.astype(np.uint8)
+            maze[self._env_range, self._target_location[:, 1], self._target_location[:, 0]] = 4
+            maze[self._env_range, self._agent_location[:, 1], self._agent_location[:, 0]] = 3
+            return maze[:, None] if self.channels_first else maze[..., None]
+
+        if self.policy == "LocalPolicy":
+            radius = self.local_view_size // 2
+            windows = self._local_windows[self._env_range, self._agent_location[:, 1], self._agent_location[:, 0]]
+            relative = self._target_location - self._agent_location
+            visible = np.flatnonzero(np.all(np.abs(relative) <= radius, axis=1))
+            windows[visible, relative[visible, 1] + radius, relative[visible, 0] + radius] = 4
+            return np.concatenate([windows.reshape(self.num_envs, -1), relative.astype(np.int16)], axis=1)
+
+        return np.concatenate([
+            self._agent_location.astype(np.uint8),
+            self._target_location.astype(np.uint8),
+            self._obstacle_coords,
+        ], axis=1)
+
+    def _get_info(self):
+        every_env = np.ones(self.num_envs, dtype=bool)
+        return {
+            "distance": np.abs(self._agent_location - self._target_location).sum(axis=1).astype(np.float64),
+            "_distance": every_env,
+            "wrong_steps": self.wrong_step_count.copy(),
+            "_wrong_steps": every_env,
+            "pattern": self.layout_index.copy(),
+            "_pattern": every_env,
+        }
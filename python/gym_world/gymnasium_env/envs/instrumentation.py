@@ -0,0 +1,99 @@
+import time
+from collections import Counter
+
+
+PHASES = ("reward", "pathfinding", "observation", "rendering", "grid_generation", "reset")
+
+
+class EnvStats:
+    """
+    Counters and per-phase wall time of one GridWorldEnv created with `instrument=True`.
+
+    Phase times are exclusive: the time of a phase nested in another one (a distance field computed during a step)
+    is only counted once, under the inner phase. "reward" is what is left of step() once pathfinding, observation
+    building and rendering are taken out; with `fast_step=True` the observation is built inline and lands there too.
+    """
+
+    def __init__(self):
+        self.counters = Counter()
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self._nested_time = 0.0
+
+    def snapshot(self, reset=False):
+        stats = {"counters": dict(self.counters), "times": dict(self.times)}
+        if reset:
+            self.counters.clear()
+            self.times = dict.fromkeys(PHASES, 0.0)
+        return stats
+
+
+def instrument_env(env):
+    """
+    Replaces the hot-path methods of `env` by timed and counted versions on the instance itself, so an env that is
+    never instrumented runs exactly the same code as before.
+    """
+    stats = env.stats
+
+    def wrap(name, phase, after=None):
+        method = getattr(env, name)
+
+        def timed(*args, **kwargs):
+            outer_nested_time = stats._nested_time
+            stats._nested_time = 0.0
+            start = time.perf_counter()
+            try:
+                result = method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                stats.times[phase] += elapsed - stats._nested_time
+                stats._nested_time = outer_nested_time + elapsed
+            if after is not None:
+                after(result, args)
+            return result
+
+        setattr(env, name, timed)
+
+    def after_step(result, args):
+        stats.counters["steps"] += 1
+
+    def after_reset(result, args):
+        stats.counters["resets"] += 1
+
+    def after_distance_field(result, args):
+        if env.distance_source == "search":
+            stats.counters["searches"] += 1
+            stats.counters["nodes_expanded"] += int((env.distance_field >= 0).sum())
+        elif env.distance_source == "table":
+            stats.counters["distance_table_lookups"] += 1
+        else:
+            stats.counters["distance_cache_hits"] += 1
+
+    def after_astar(result, args):
+        stats.counters["astar_calls"] += 1
+        stats.counters["astar_nodes_expanded"] += env.astar_expanded
+
+    def after_point_distance(result, args):
+        stats.counters["point_queries"] += 1
+
+    def after_gen_grid(result, args):
+        stats.counters["reset_retries"] += env.grid_attempts - 1
+
+    def after_render(result, args):
+        stats.counters["renders"] += 1
+
+    load_pattern_bank = env._load_pattern_bank
+
+    def counted_load_pattern_bank():
+        stats.counters["pattern_loads"] += 1
+        return load_pattern_bank()
+
+    env._load_pattern_bank = counted_load_pattern_bank
+
+    wrap("step", "reward", after_step)
+    wrap("reset", "reset", after_reset)
+    wrap("_gen_grid", "grid_generation", after_gen_grid)
+    wrap("_compute_distance_field", "pathfinding", after_distance_field)
+    wrap("astar", "pathfinding", after_astar)
+    wrap("_point_distance", "pathfinding", after_point_distance)
+    wrap("_get_obs", "observation")
+    wrap("_render_frame", "rendering", after_render)
@@ -0,0 +1,206 @@
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+
+from gymnasium_env.envs.grid_paths import connected_components, distance_fields
+
+
+# The all-pairs table holds size**4 int16 entries per pattern, 2 MB per pattern at size 32
+DISTANCE_TABLE_MAX_SIZE = 32
+
+_open_banks = {}
+
+
+class PatternBank:
+    """
+    obstacle_patterns.json compiled for one grid size into a binary file that every env of every process maps
+    read-only, so resetting an env becomes an index lookup instead of re-reading the JSON.
+
+    Per pattern p the bank holds:
+      occupancy[p]          (size, size) uint8, 1 for obstacles including the border
+      free_cells            flat indices (y * size + x) of the free cells, free_cells[free_offsets[p]:free_offsets[p + 1]]
+      components[p]         (size, size) int32 connected-component label of every free cell, -1 for obstacles
+      distances[p, goal]    (size * size,) int16 path lengths from every cell to `goal`, -1 without a path, equal to
+                            len(GridWorldEnv.astar(cell, goal)); only present up to DISTANCE_TABLE_MAX_SIZE
+    """
+
+    def __init__(self, path, arrays):
+        self.path = path
+        self.size = int(arrays["occupancy"].shape[1])
+        self.occupancy = arrays["occupancy"]
+        self.free_cells = arrays["free_cells"]
+        self.free_offsets = arrays["free_offsets"]
+        self.components = arrays["components"]
+        self.distances = arrays.get("distances")
+        self._obstacle_sets = {}
+        self._occupancy_rows = {}
+
+    def __len__(self):
+        return len(self.occupancy)
+
+    @classmethod
+    def load(cls, size, json_path='obstacle_patterns.json', create_patterns=None):
+        """
+        Returns the bank for `json_path` at `size`, compiling it first if it is missing or was built from a different JSON.
+        If the JSON itself is missing, `create_patterns()` is called to write it. Both happen under a lock file,
+        so when many envs start at once exactly one of them builds and the others wait and map the result.
+        """
+        bank_path = cls.bank_path(json_path, size)
+        if bank_path in _open_banks:
+            return _open_banks[bank_path]
+
+        if not cls._is_current(bank_path, json_path):
+            with _exclusive(bank_path + ".lock"):
+                if not os.path.exists(json_path):
+                    create_patterns()
+                if not cls._is_current(bank_path, json_path):
+                    cls.compile(json_path, size, bank_path)
+
+        bank = cls(bank_path, _map_npz(bank_path))
+        _open_banks[bank_path] = bank
+        return bank
+
+    @staticmethod
+    def bank_path(json_path, size):
+        root, _ = os.path.splitext(json_path)
+        return f"{root}_{size}.npz"
+
+    @staticmethod
+    def _is_current(bank_path, json_path):
+        if not os.path.exists(bank_path) or not os.path.exists(json_path):
+            return False
+        with zipfile.ZipFile(bank_path) as archive, archive.open("source_digest.npy") as f:
+            stored_digest = np.lib.format.read_array(f).tobytes()
+        return stored_digest == _file_digest(json_path)
+
+    @staticmethod
+    def compile(json_path, size, bank_path):
+        with open(json_path, 'rb') as f:
+            source = f.read()
+        obstacle_patterns = json.loads(source)
+
+        # One JSON serves every size, but only if it was generated for a grid at most this large
+        largest = max((max(x, y) for pattern in obstacle_patterns for x, y in pattern), default=-1)
+        if largest >= size:
+            raise ValueError(f"{json_path} has obstacles up to coordinate {largest}, so it was generated for a grid of "
+                             f"size {largest + 1} or more and does not fit size {size}; move it away to generate "
+                             f"patterns for size {size}")
+
+        count = len(obstacle_patterns)
+        occupancy = np.zeros((count, size, size), dtype=np.uint8)
+        occupancy[:, 0, :] = 1
+        occupancy[:, size - 1, :] = 1
+        occupancy[:, :, 0] = 1
+        occupancy[:, :, size - 1] = 1
+        for p, pattern in enumerate(obstacle_patterns):
+            for x, y in pattern:
+                occupancy[p, y, x] = 1
+
+        blocked = occupancy.astype(bool)
+        free_cells = [np.flatnonzero(~grid) for grid in blocked]
+        arrays = {
+            "source_digest": np.frombuffer(hashlib.sha1(source).digest(), dtype=np.uint8),
+            "occupancy": occupancy,
+            "free_cells": np.concatenate(free_cells).astype(np.int32),
+            "free_offsets": np.cumsum([0] + [len(cells) for cells in free_cells]).astype(np.int64),
+            "components": np.stack([connected_components(grid) for grid in blocked]),
+        }
+
+        if size <= DISTANCE_TABLE_MAX_SIZE:
+            cells = size * size
+            goals = np.stack([np.arange(cells) % size, np.arange(cells) // size], axis=1)
+            distances = np.empty((count, cells, cells), dtype=np.int16)
+            for p in range(count):
+                fields = distance_fields(np.repeat(blocked[p][None], cells, axis=0), goals).reshape(cells, cells)
+                distances[p] = np.where(fields >= cells, -1, fields)
+            arrays["distances"] = distances
+
+        # Written next to the target and renamed over it, so readers see either the old bank or the complete new one
+        directory = os.path.dirname(os.path.abspath(bank_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".npz.tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, bank_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def obstacle_set(self, index):
+        """The obstacles of pattern `index` (border included) as the set of (x, y) tuples GridWorldEnv uses."""
+        if index not in self._obstacle_sets:
+            ys, xs = np.nonzero(self.occupancy[index])
+            self._obstacle_sets[index] = set(zip(xs.tolist(), ys.tolist()))
+        return self._obstacle_sets[index]
+
+    def occupancy_rows(self, index):
+        if index not in self._occupancy_rows:
+            self._occupancy_rows[index] = self.occupancy[index].tolist()
+        return self._occupancy_rows[index]
+
+    def free(self, index):
+        return self.free_cells[self.free_offsets[index]:self.free_offsets[index + 1]]
+
+    def distance_field(self, index, goal):
+        """(size, size) read-only view of the path lengths to `goal` = (x, y), -1 without a path."""
+        return self.distances[index, goal[1] * self.size + goal[0]].reshape(self.size, self.size)
+
+
+def write_patterns(obstacle_patterns, json_path='obstacle_patterns.json'):
+    """Writes the obstacle patterns JSON, renamed into place so that other envs never read a half-written file."""
+    with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(json_path) or '.', suffix='.json.tmp', delete=False) as f:
+        json.dump(obstacle_patterns, f)
+    os.chmod(f.name, 0o644)
+    os.replace(f.name, json_path)
+
+
+def _file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).digest()
+
+
+def _map_npz(path):
+    """
+    Memory-maps every member of an uncompressed .npz read-only: np.load(mmap_mode='r') only does that for .npy.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive:
+        members = archive.infolist()
+    with open(path, 'rb') as f:
+        for member in members:
+            # Local file header: 30 fixed bytes, then the file name and the extra field
+            f.seek(member.header_offset + 26)
+            name_length, extra_length = np.frombuffer(f.read(4), dtype="<u2")
+            f.seek(member.header_offset + 30 + int(name_length) + int(extra_length))
+            if np.lib.format.read_magic(f) == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            order = 'F' if fortran_order else 'C'
+            arrays[member.filename[:-len(".npy")]] = np.memmap(path, dtype=dtype, mode='r', offset=f.tell(), shape=shape, order=order)
+    return arrays
+
+
+@contextlib.contextmanager
+def _exclusive(lock_path, stale_after=120):
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            with contextlib.suppress(FileNotFoundError):
+                if time.time() - os.path.getmtime(lock_path) > stale_after:  # the builder died without cleaning up
+                    os.remove(lock_path)
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        os.remove(lock_path)
@@ -2,9 +2,11 @@ import sys
 from enum import Enum
 import gymnasium as gym
 from gymnasium import spaces
-import pygame
 import numpy as np
 
+from gymnasium_env.envs.rendering import GridRenderer
+from gymnasium_env.envs.viewer import ViewerProcess
+
 def debug_print(*args):
     """Prints debug information to stderr."""
     print(" | ".join(map(str, args)), file=sys.stderr)
@@ -20,7 +22,7 @@ class Actions(Enum):
 class RealWorldEnv(gym.Env):
     metadata = {"render_modes": ["human", "rgb_array"], "render_fps": 60}
 
-    def __init__(self, render_mode=None, size=10):
+    def __init__(self, render_mode=None, size=10, viewer_process=False):
         self.size = size  # The size of the square grid
         self.window_size = 512  # The size of the PyGame window
         self._agent_location = None
@@ -69,6 +71,15 @@ class RealWorldEnv(gym.Env):
         """
         self.window = None
         self.clock = None
+        self._renderer = None  # GridRenderer, built on the first frame
+
+        """
+        With `viewer_process=True` the human-mode window belongs to a ViewerProcess: rendering a frame only queues a
+        snapshot for it, so step() is neither slowed down by drawing nor throttled to render_fps, and the window shows
+        the latest state at render_fps.
+        """
+        self.viewer_process = viewer_process
+        self._viewer = None
 
     def _get_obs(self):
         result = np.concatenate([np.array(self._agent_location), np.array(self._target_location), np.array(sorted(self.obstacles)).flatten(),])
@@ -131,66 +142,29 @@ class RealWorldEnv(gym.Env):
             return self._render_frame()
 
     def _render_frame(self):
+        if self.viewer_process and self.render_mode == "human":
+            if self._viewer is None:
+                self._viewer = ViewerProcess(self.size, self.window_size, fps=self.metadata["render_fps"])
+            self._viewer.show(self.obstacles, self._agent_location, self._target_location)
+            return None
 
-        if self.window is None and self.render_mode == "human":
-            pygame.init()
-            pygame.display.init()
-            self.window = pygame.display.set_mode((self.window_size, self.window_size))
-        if self.clock is None and self.render_mode == "human":
-            self.clock = pygame.time.Clock()
-
-        canvas = pygame.Surface((self.window_size, self.window_size))
-        canvas.fill((255, 255, 255))
-
-        # Draw obstacles
-        pix_square_size = self.window_size / self.size
-        for obstacle in self.obstacles:
-            pygame.draw.rect(
-                canvas,
-                (128, 128, 128),  # Gray color for obstacles
-                pygame.Rect(
-                    pix_square_size * np.array(obstacle),
-                    (pix_square_size, pix_square_size),
-                    ),
-            )
+        if self._renderer is None:
+            self._renderer = GridRenderer(self.size, self.window_size)
+        # Obstacles and gridlines come from a background drawn once per layout, only target and agent are drawn here
+        frame = self._renderer.frame(self.obstacles, self._agent_location, self._target_location)
 
-        # First we draw the target
-        pygame.draw.rect(
-            canvas,
-            (255, 0, 0),
-            pygame.Rect(
-                pix_square_size * self._target_location,
-                (pix_square_size, pix_square_size),
-                ),
-        )
-        # Now we draw the agent
-        pygame.draw.circle(
-            canvas,
-            (0, 0, 255),
-            (self._agent_location + 0.5) * pix_square_size,
-            pix_square_size / 3,
-            )
+        if self.render_mode == "human":
+            import pygame  # only the window needs pygame, rgb_array frames are rasterized in NumPy
 
-        # Finally, add some gridlines
-        for x in range(self.size + 1):
-            pygame.draw.line(
-                canvas,
-                0,
-                (0, pix_square_size * x),
-                (self.window_size, pix_square_size * x),
-                width=3,
-            )
-            pygame.draw.line(
-                canvas,
-                0,
-                (pix_square_size * x, 0),
-                (pix_square_size * x, self.window_size),
-                width=3,
-            )
+            if self.window is None:
+                pygame.init()
+                pygame.display.init()
+                self.window = pygame.display.set_mode((self.window_size, self.window_size))
+            if self.clock is None:
+                self.clock = pygame.time.Clock()
 
-        if self.render_mode == "human":
-            # The following line copies our drawings from `canvas` to the visible window
-            self.window.blit(canvas, canvas.get_rect())
+            # The following line copies the frame to the visible window
+            pygame.surfarray.blit_array(self.window, frame.swapaxes(0, 1))
             pygame.event.pump()
             pygame.display.update()
 
@@ -199,11 +173,14 @@ class RealWorldEnv(gym.Env):
             # keep the framerate stable.
             # self.clock.tick(self.metadata["render_fps"])
         else:  # rgb_array
-            return np.transpose(
-                np.array(pygame.surfarray.pixels3d(canvas)), axes=(1, 0, 2)
-            )
+            return frame
 
     def close(self):
+        if self._viewer is not None:
+            self._viewer.close()
+            self._viewer = None
         if self.window is not None:
+            import pygame
+
             pygame.display.quit()
             pygame.quit()
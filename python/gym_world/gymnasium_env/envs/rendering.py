@@ -0,0 +1,108 @@
+"""
+NumPy rasterizer of the GridWorldEnv and RealWorldEnv frames, pixel for pixel what their pygame drawing code gave:
+gray obstacles, the red target square and the blue agent disc on white, under black gridlines. Obstacles and
+gridlines are drawn once per layout into a background; a frame is a copy of it with the target and the agent
+stamped on, so no pygame is needed for rgb_array and a frame costs little more than the copy.
+"""
+
+import numpy as np
+
+
+WHITE = np.array((255, 255, 255), dtype=np.uint8)
+GRAY = np.array((128, 128, 128), dtype=np.uint8)
+RED = np.array((255, 0, 0), dtype=np.uint8)
+BLUE = np.array((0, 0, 255), dtype=np.uint8)
+BLACK = np.array((0, 0, 0), dtype=np.uint8)
+
+
+def _disc_mask(radius):
+    """
+    The pixels pygame.draw.circle() fills around an integer center for an integer radius (its midpoint algorithm,
+    which is not symmetric around the center), as a (2 * radius + 1)-square mask whose pixel [radius, radius] is the
+    center.
+    """
+    mask = np.zeros((2 * radius + 1, 2 * radius + 1), dtype=bool)
+
+    def span(x_start, y, x_end):
+        mask[y + radius, x_start + radius:x_end + radius + 1] = True
+
+    f = 1 - radius
+    ddf_x = 0
+    ddf_y = -2 * radius
+    x = 0
+    y = radius
+    while x < y:
+        if f >= 0:
+            y -= 1
+            ddf_y += 2
+            f += ddf_y
+        x += 1
+        ddf_x += 2
+        f += ddf_x + 1
+        if f >= 0:
+            span(-x, y - 1, x - 1)
+            span(-x, -y, x - 1)
+        span(-y, x - 1, y - 1)
+        span(-y, -x, y - 1)
+    return mask
+
+
+class GridRenderer:
+    """
+    Frames of a `size` x `size` grid on a `window_size` pixels square canvas, as (window_size, window_size, 3) uint8
+    arrays, rows first like the rgb_array of the envs. Pixel edges are truncated like pygame.Rect does.
+    """
+
+    def __init__(self, size, window_size=512, line_width=3):
+        self.size = size
+        self.window_size = window_size
+        self.pix_square_size = window_size / size
+        self._cell = int(self.pix_square_size)
+        # Top-left and center pixel of every cell along an axis, from the float products the pygame code computed
+        self._edges = [int(self.pix_square_size * k) for k in range(size + 1)]
+        self._centers = [int((k + 0.5) * self.pix_square_size) for k in range(size)]
+
+        self._grid = np.zeros((window_size, window_size), dtype=bool)
+        for edge in self._edges:
+            lines = slice(max(edge - line_width // 2, 0), edge - line_width // 2 + line_width)
+            self._grid[lines, :] = True
+            self._grid[:, lines] = True
+        self._between_lines = ~self._grid
+
+        self._square = np.ones((self._cell, self._cell), dtype=bool)
+        self._disc = _disc_mask(int(self.pix_square_size / 3))
+        self._obstacles = None
+        self._background = None
+
+    def background(self, obstacles):
+        """The static layer of the layout `obstacles`, redrawn only when a different set object is passed."""
+        if obstacles is not self._obstacles:
+            background = np.empty((self.window_size, self.window_size, 3), dtype=np.uint8)
+            background[:] = WHITE
+            for x, y in obstacles:
+                background[self._edges[y]:self._edges[y] + self._cell, self._edges[x]:self._edges[x] + self._cell] = GRAY
+            background[self._grid] = BLACK
+            self._obstacles = obstacles
+            self._background = background
+        return self._background
+
+    def _stamp(self, frame, top, left, mask, color):
+        """Paints `mask` with its top-left pixel at (top, left), clipped to the canvas and kept under the gridlines."""
+        bottom, right = top + mask.shape[0], left + mask.shape[1]
+        clipped_top, clipped_left = max(top, 0), max(left, 0)
+        clipped_bottom, clipped_right = min(bottom, self.window_size), min(right, self.window_size)
+        if clipped_top >= clipped_bottom or clipped_left >= clipped_right:
+            return
+        rows, cols = slice(clipped_top, clipped_bottom), slice(clipped_left, clipped_right)
+        mask = mask[clipped_top - top:clipped_bottom - top, clipped_left - left:clipped_right - left] & self._between_lines[rows, cols]
+        np.copyto(frame[rows, cols], color, where=mask[..., None])
+
+    def frame(self, obstacles, agent_location, target_location):
+        """A new frame: the background of `obstacles` with the target square and the agent disc on it."""
+        frame = self.background(obstacles).copy()
+        target_x, target_y = target_location
+        self._stamp(frame, self._edges[target_y], self._edges[target_x], self._square, RED)
+        agent_x, agent_y = agent_location
+        radius = len(self._disc) // 2
+        self._stamp(frame, self._centers[agent_y] - radius, self._centers[agent_x] - radius, self._disc, BLUE)
+        return frame
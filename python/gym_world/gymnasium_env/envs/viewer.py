@@ -0,0 +1,109 @@
+"""
+Human-mode window of GridWorldEnv and RealWorldEnv drawn by a separate process, so that watching a policy does not
+slow down the loop stepping the env. The env side only queues (layout id, agent cell, target cell) snapshots; the
+viewer draws the newest one at its own frame rate and the snapshots it did not get to are dropped.
+"""
+
+import multiprocessing as mp
+import queue
+
+FRAME_QUEUE_SIZE = 2
+CLOSE_TIMEOUT = 5  # seconds the viewer gets to shut down before it is terminated
+
+
+def _run_viewer(frames, layouts, size, window_size, fps):
+    import pygame
+
+    from gymnasium_env.envs.rendering import GridRenderer
+
+    renderer = GridRenderer(size, window_size)
+    pygame.init()
+    pygame.display.init()
+    window = pygame.display.set_mode((window_size, window_size))
+    clock = pygame.time.Clock()
+    obstacles = {}  # layout id -> obstacle set, kept as long as snapshots refer to it
+    snapshot = None
+
+    while True:
+        try:
+            newest = frames.get(timeout=0.1)
+            while True:  # drain the queue, only the newest snapshot is drawn
+                if newest is None:
+                    pygame.quit()
+                    return
+                snapshot = newest
+                newest = frames.get_nowait()
+        except queue.Empty:
+            pass
+
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                return
+
+        if snapshot is not None:
+            layout_id, agent_x, agent_y, target_x, target_y = snapshot
+            while layout_id not in obstacles:
+                new_id, cells = layouts.get()
+                obstacles[new_id] = set(cells)
+            for old_id in [key for key in obstacles if key < layout_id]:
+                del obstacles[old_id]
+
+            frame = renderer.frame(obstacles[layout_id], (agent_x, agent_y), (target_x, target_y))
+            pygame.surfarray.blit_array(window, frame.swapaxes(0, 1))
+            pygame.display.update()
+            snapshot = None
+        clock.tick(fps)
+
+
+class ViewerProcess:
+    """
+    Starts the viewer process for a `size` x `size` grid. show() never blocks on drawing: when the viewer is behind,
+    the oldest queued snapshot is replaced by the new one and counted in `dropped`. Layouts travel on a queue of
+    their own, once each, so dropping snapshots never loses one.
+    """
+
+    def __init__(self, size, window_size=512, fps=4):
+        # spawn: the parent may hold threads or an initialized pygame that a forked child must not inherit
+        ctx = mp.get_context("spawn")
+        self._frames = ctx.Queue(maxsize=FRAME_QUEUE_SIZE)
+        self._layouts = ctx.Queue()
+        self._process = ctx.Process(target=_run_viewer, args=(self._frames, self._layouts, size, window_size, fps),
+                                    name="gridworld-viewer", daemon=True)
+        self._process.start()
+        self._obstacles = None
+        self._layout_id = 0
+        self.shown = 0
+        self.dropped = 0
+
+    def show(self, obstacles, agent_location, target_location):
+        if obstacles is not self._obstacles:
+            self._layout_id += 1
+            self._layouts.put((self._layout_id, [tuple(map(int, cell)) for cell in obstacles]))
+            self._obstacles = obstacles
+        snapshot = (self._layout_id, int(agent_location[0]), int(agent_location[1]), int(target_location[0]), int(target_location[1]))
+
+        self.shown += 1
+        try:
+            self._frames.put_nowait(snapshot)
+        except queue.Full:
+            self.dropped += 1
+            try:
+                self._frames.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self._frames.put_nowait(snapshot)
+            except queue.Full:
+                pass  # the oldest snapshot was already being taken by the viewer, this one is the dropped one then
+
+    def close(self):
+        if self._process.is_alive():
+            try:
+                self._frames.put(None, timeout=CLOSE_TIMEOUT)
+            except queue.Full:
+                pass
+            self._process.join(CLOSE_TIMEOUT)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
@@ -5,30 +5,32 @@ import warnings
 
 import numpy as np
 
-import gymnasium as gym
-import gymnasium_env
 import time
 
-from stable_baselines3 import PPO
 import os
 
+# Only what the bridge needs before its first reply: gymnasium, the env package and pygame are imported by
+# make_viewer() once that reply is out, torch and stable_baselines3 not at all
 import utils
-from gymnasium.utils import seeding
+import bridge
+import bridge_protocol
+import numpy_policy
 
 
 cell = None
 path_grid_dimensions = None
-agents = None
-targets = None
 env = None
 model = None
-obs = None
-info = None
+batch = None
 np_random = None
 np_random_seed = None
 DELAY_INTERVAL = 0
+STATS_INTERVAL = 10  # seconds between two bridge statistics lines on stderr, 0 for none
 last_execution_time = time.monotonic()  # Track the initial execution time
 
+# Same order as the Actions of RealWorldEnv: right, up, left, down
+DIRECTIONS = np.array([[1, 0], [0, -1], [-1, 0], [0, 1]])
+
 _real_stdout = sys.stdout
 sys.stdout = open(os.devnull, "w")
 # sys.stderr = open(os.devnull, "w")
@@ -40,17 +42,15 @@ def debug_print(*args):
     """Prints debug information to stderr."""
     print(" | ".join(map(str, args)), file=sys.stderr)
 
-def json_print(data):
-    """Always print JSON to the real stdout, even if stdout is redirected/suppressed."""
-    print(json.dumps(data), flush=True, file=_real_stdout)
-
 
 
-def reset_positions(agent, target, seed=None):
+def reset_positions(seed=None):
+    """Draws a new agent cell and a different target cell inside the border and returns the centers of both in pixels."""
     global np_random, np_random_seed
 
     if seed is not None:
-        np_random, np_random_seed = seeding.np_random(seed)
+        # The generator gymnasium.utils.seeding.np_random(seed) would give
+        np_random, np_random_seed = np.random.default_rng(seed), seed
 
     size = path_grid_dimensions['cols']
     obstacles = get_obstacles(size)
@@ -75,11 +75,17 @@ def reset_positions(agent, target, seed=None):
 
     target_location = np.array((goal_x, goal_y))
 
-    agent['topLeftX'] = agent_location[0] * cell['width'] + cell['width']/2 - agent['width']/2
-    agent['topLeftY'] = agent_location[1] * cell['height'] + cell['height']/2 - agent['height']/2
+    cell_size = np.array([cell['width'], cell['height']])
+    return agent_location * cell_size + cell_size / 2, target_location * cell_size + cell_size / 2
+
 
-    target['topLeftX'] = target_location[0] * cell['width'] + cell['width']/2 - target['width']/2
-    target['topLeftY'] = target_location[1] * cell['height'] + cell['height']/2 - target['height']/2
+def make_viewer(size):
+    """The pygame window showing the first agent, a human-mode RealWorldEnv."""
+    import gymnasium as gym
+    import gymnasium_env  # noqa: F401
+
+    with open(os.devnull, "w") as f, contextlib.redirect_stdout(f):
+        return gym.make('gymnasium_env/RealWorld-v0', render_mode="human", size=size)
 
 
 def get_obstacles(size):
@@ -96,16 +102,124 @@ def get_obstacles(size):
 
     return obstacles
 
-def update_drawable_cell(drawable, cell):
+
+class AgentBatch:
     """
-    Updates the agent's cellX and cellY based on its topLeftX, topLeftY, width, and height.
+    State of every AI agent on the server, one row per agent in NumPy arrays, so that a tick is one stacked
+    observation, one batched forward pass and one vectorized move whatever the number of agents.
+
+    Observations have the layout RealWorldEnv._get_obs() gives the models: agent cell, target cell, then the
+    sorted border cells, which never change and are written once. Moves are accumulated in `deltas` and
+    `player_deltas`, which is all the server gets back.
     """
-    startCell = {
-        "x": np.floor((drawable['topLeftX'] + drawable['width'] / 2) / cell['width']),
-        "y": np.floor((drawable['topLeftY'] + drawable['height'] / 2) / cell['height'])
-    }
-    drawable['cellX'] = startCell['x']
-    drawable['cellY'] = startCell['y']
+
+    def __init__(self, size, cell):
+        self.size = size
+        self.cell_size = np.array([cell['width'], cell['height']])
+
+        border = set()
+        for i in range(size):
+            border.update({(i, 0), (i, size - 1), (0, i), (size - 1, i)})
+        self._border_obs = np.array(sorted(border), dtype=np.uint8).ravel()
+
+        self.ids = np.zeros(0, dtype=np.int32)
+        self.centers = np.zeros((0, 2))
+        self.speed = np.zeros(0)
+        self.cells = np.zeros((0, 2), dtype=np.int64)
+        self.deltas = np.zeros((0, 2))
+        self.player_ids = np.zeros(0, dtype=np.int32)
+        self.player_centers = np.zeros((0, 2))
+        self.player_cells = np.zeros((0, 2), dtype=np.int64)
+        self.player_deltas = np.zeros((0, 2))
+        self.target_cells = np.zeros((0, 2), dtype=np.int64)
+        self.observations = np.zeros((0, 4 + len(self._border_obs)), dtype=np.uint8)
+
+    def sync(self, agents, players):
+        """
+        Reads the DRAWABLE_RECORD arrays of this tick; rows follow the order of `agents`. Returns the rows of the
+        agents that were not there on the previous tick.
+        """
+        new_rows = np.flatnonzero(~np.isin(agents['id'], self.ids))
+        self.ids = agents['id'].copy()
+        self.centers = np.stack([agents['x'], agents['y']], axis=1)
+        self.speed = agents['speed'].astype(np.float64)
+        self.cells = self._cells_of(self.centers)
+        self.deltas = np.zeros_like(self.centers)
+
+        self.player_ids = players['id'].copy()
+        self.player_centers = np.stack([players['x'], players['y']], axis=1)
+        self.player_cells = self._cells_of(self.player_centers)
+        self.player_deltas = np.zeros_like(self.player_centers)
+        self._assign_targets()
+
+        if len(self.observations) != len(agents):
+            self.observations = np.empty((len(agents), 4 + len(self._border_obs)), dtype=np.uint8)
+            self.observations[:, 4:] = self._border_obs
+        return new_rows
+
+    def _cells_of(self, centers):
+        return np.floor(centers / self.cell_size).astype(np.int64)
+
+    def _assign_targets(self):
+        if len(self.player_cells) and len(self.cells):
+            # Every agent chases the player closest to it; with one player that is the first one, like before
+            distances = np.abs(self.cells[:, None, :] - self.player_cells[None, :, :]).sum(axis=2)
+            self.target_cells = self.player_cells[distances.argmin(axis=1)]
+        else:
+            self.target_cells = self.cells.copy()
+
+    def teleport(self, row, center):
+        """Puts agent `row` on `center`, the jump being part of its delta."""
+        self.deltas[row] += center - self.centers[row]
+        self.centers[row] = center
+        self.cells[row] = self._cells_of(center)
+        self._assign_targets()
+
+    def teleport_player(self, row, center):
+        self.player_deltas[row] += center - self.player_centers[row]
+        self.player_centers[row] = center
+        self.player_cells[row] = self._cells_of(center)
+        self._assign_targets()
+
+    def get_obs(self):
+        self.observations[:, 0:2] = self.cells
+        self.observations[:, 2:4] = self.target_cells
+        return self.observations
+
+    def terminated(self):
+        # RealWorldEnv.step(): the episode is over once the agent stands on its target's cell
+        return np.all(self.cells == self.target_cells, axis=1)
+
+    def move(self, actions, moving):
+        """
+        Moves the agents of the `moving` mask towards the center of the neighbor cell their action points to,
+        `speed * 5` pixels along the L1-normalized direction.
+        """
+        next_nodes = np.clip(self.cells + DIRECTIONS[actions], 0, self.size - 1)
+        delta = next_nodes * self.cell_size + self.cell_size / 2 - self.centers
+        distance = np.abs(delta).sum(axis=1, keepdims=True)
+        step = np.divide(delta, distance, out=np.zeros_like(delta), where=distance != 0)
+        step = np.where(moving[:, None], step * self.speed[:, None] * 5, 0)
+        self.centers += step
+        self.deltas += step
+
+    def encode_deltas(self, tick):
+        """The reply to the server: the deltas of the agents and players that moved this tick."""
+        moved = self.deltas.any(axis=1)
+        moved_players = self.player_deltas.any(axis=1)
+        return bridge_protocol.encode_deltas(
+            tick,
+            np.concatenate([self.ids[moved], self.player_ids[moved_players]]),
+            np.concatenate([self.deltas[moved], self.player_deltas[moved_players]]),
+        )
+
+    def drawable(self, row):
+        """Agent `row` as the cellX / cellY dict RealWorldEnv.updateDrawables() takes."""
+        return {'cellX': self.cells[row, 0], 'cellY': self.cells[row, 1]}
+
+    def player_drawable(self, row):
+        return {'cellX': self.player_cells[row, 0], 'cellY': self.player_cells[row, 1]}
+
 
 env_created = False
 rejoinedPlayer = False
@@ -113,102 +227,99 @@ eval_mode = False
 visited_cells = []
 i = 0
 episodes_desired_num = 100
-for line in sys.stdin:
-    try:
-        data = json.loads(line)
-        if data.get('type') == 'oneTimeData':
-            game_bounds_dimensions, path_grid_dimensions, unwalkable_cells, eval_mode = data.get('data').values()
-            cell = {
-                'width': game_bounds_dimensions['width'] / path_grid_dimensions['cols'],
-                'height': game_bounds_dimensions['height'] / path_grid_dimensions['rows']
-            }
-        elif data.get('type') == 'drawables':
-            drawables = data.get('data')
-            agents = [drawable for drawable in drawables if drawable['type'] == 'agent']
-            for agent in agents:
-                update_drawable_cell(agent, cell)
-
-            targets = [drawable for drawable in drawables if drawable['type'] == 'player']
-            for target in targets:
-                update_drawable_cell(target, cell)
-
-            if agents and not env_created:
-                env_created = True  # Set the flag to False after calling
-
-                folder = 'experiment2'
-                model_dir = os.path.join("models", folder)
-                latest_model_path = utils.get_latest_model_path(model_dir)
-
-                with open(os.devnull, "w") as f, contextlib.redirect_stdout(f):
-                    env = gym.make('gymnasium_env/RealWorld-v0', render_mode="human")
-
-                # Load model
-                model = PPO.load(f'{latest_model_path}', env=env)
-
-                reset_positions(agent=agents[0], target=agents[0], seed=42)
-                env.unwrapped.updateDrawables(agent=agents[0], target=agents[0])
+# Reader and writer threads around the inference stage below; the writer always writes to the real stdout, even if
+# stdout is redirected/suppressed
+stats = bridge.BridgeStats()
+reader = bridge.SnapshotReader(sys.stdin.buffer, stats)
+writer = bridge.ReplyWriter(_real_stdout.buffer, stats)
+reader.start()
+writer.start()
+last_stats_time = time.monotonic()
+while not reader.closed:
+    if STATS_INTERVAL and time.monotonic() - last_stats_time >= STATS_INTERVAL:
+        debug_print(stats.summary())
+        last_stats_time = time.monotonic()
+
+    message = reader.next(timeout=STATS_INTERVAL or None)
+    if message is None:
+        continue
+    message_type, payload, received_at = message
+    if message_type == bridge_protocol.MESSAGE_ONE_TIME_DATA:
+        data = json.loads(payload[1:])
+        game_bounds_dimensions, path_grid_dimensions, unwalkable_cells, eval_mode = data.values()
+        cell = {
+            'width': game_bounds_dimensions['width'] / path_grid_dimensions['cols'],
+            'height': game_bounds_dimensions['height'] / path_grid_dimensions['rows']
+        }
+    elif message_type == bridge_protocol.MESSAGE_DRAWABLES:
+        tick, agents, targets = bridge_protocol.decode_drawables(payload)
+        view = None  # the first agent and its target as drawn by the viewer, once this tick's reply is out
+
+        if len(agents) and not env_created:
+            env_created = True  # Set the flag to False after calling
+
+            folder = 'experiment2'
+            model_dir = os.path.join("models", folder)
+
+            # Load model: the NumPy forward pass of the latest checkpoint, neither torch nor stable_baselines3 is needed
+            model = numpy_policy.load(model_dir)
+            batch = AgentBatch(path_grid_dimensions['cols'], cell)
+
+        if batch is None:
+            writer.put(bridge_protocol.encode_deltas(tick, [], np.zeros((0, 2))), received_at)
+            continue
+
+        new_rows = batch.sync(agents, targets)
+        # Every agent starts on a random cell, the first one ever with the fixed seed
+        for row in new_rows:
+            _, center = reset_positions(seed=42 if np_random is None else None)
+            batch.teleport(row, center)
+
+        if len(agents) and len(targets):
+            obs = batch.get_obs()
+            actions, _ = model.predict(observation=obs, deterministic=True) # Turn on deterministic, so predict always returns the same behavior
+            current_time = time.monotonic()
+            if current_time - last_execution_time >= DELAY_INTERVAL:
+                terminated = batch.terminated()
+                current_pos = (batch.cells[0, 0], batch.cells[0, 1])
+
+                view = (batch.drawable(0), batch.player_drawable(0))
+
+                if not rejoinedPlayer:
+                    batch.move(actions, ~terminated)
+
+                if eval_mode and (terminated[0] or rejoinedPlayer):
+                    agent_center, target_center = reset_positions(seed=42 if rejoinedPlayer else None)
+                    batch.teleport(0, agent_center)
+                    batch.teleport_player(0, target_center)
+                    if rejoinedPlayer:
+                        rejoinedPlayer = False
+                        current_pos = (batch.cells[0, 0], batch.cells[0, 1])  # the new start is recorded right away
+
+                last_execution_time = current_time
+
+                if i <= episodes_desired_num - 1:
+                    utils.collect_agent_positions(current_pos, visited_cells, i)
+
+                    if i == episodes_desired_num - 1:
+                        utils.save_agent_positions(visited_cells, "live_experiment", path_grid_dimensions['cols'])
+
+                if terminated[0]:
+                    i += 1
+        elif eval_mode:
+            rejoinedPlayer = True
+
+        writer.put(batch.encode_deltas(tick), received_at)
+
+        if view is not None:
+            # The env is only the pygame view of the first agent, the agents themselves live in `batch`
+            if env is None:
+                env = make_viewer(path_grid_dimensions['cols'])
+                env.unwrapped.updateDrawables(agent=view[0], target=view[0])
                 _, _ = env.reset()
+            env.unwrapped.updateDrawables(agent=view[0], target=view[1])
+            env.unwrapped._render_frame()
+    else:
+        print(f"Error: Unknown message type {message_type} received.", file=sys.stderr)
 
-            if agents and targets:
-                env.unwrapped.updateDrawables(agent=agents[0], target=targets[0])
-                obs = env.unwrapped._get_obs()
-                action, _ = model.predict(observation=obs, deterministic=True) # Turn on deterministic, so predict always returns the same behavior
-                current_time = time.monotonic()
-                agent = agents[0]
-                if current_time - last_execution_time >= DELAY_INTERVAL:
-                    obs, _, terminated, _, _ = env.step(action.item())
-
-                    if (not terminated and not rejoinedPlayer):
-                        agent_direction = env.unwrapped.get_action_direction(action.item())
-                        size = path_grid_dimensions['cols']
-                        agent_location = obs[:2]
-                        next_node = np.clip(
-                            agent_location + agent_direction, 0, size - 1
-                        )
-
-                        target_x = next_node[0] * cell['width'] + cell['width']/2
-                        target_y = next_node[1] * cell['height'] + cell['height']/2
-                        # Calculate the direction vector from the agent's current position to the target cell's position
-                        delta_x = target_x - (agent['topLeftX'] + agent['width'] / 2)
-                        delta_y = target_y - (agent['topLeftY'] + agent['height'] / 2)
-
-                        # Calculate the distance to the target
-                        distance = abs(delta_x) + abs(delta_y)
-
-                        # Normalize the direction vector and apply speed
-                        normalized_step_x = delta_x / distance if distance != 0 else 0
-                        normalized_step_y = delta_y / distance if distance != 0 else 0
-                        agent['topLeftX'] += normalized_step_x * agent['speed'] * 5
-                        agent['topLeftY'] += normalized_step_y * agent['speed'] * 5
-                    elif eval_mode:
-                        if rejoinedPlayer:
-                            rejoinedPlayer = False
-                            reset_positions(agent=agents[0], target=targets[0], seed=42)
-                            update_drawable_cell(agents[0], cell)
-                            update_drawable_cell(targets[0], cell)
-                        else:
-                            reset_positions(agent=agents[0], target=targets[0])
-
-                    last_execution_time = current_time
-
-                    if i <= episodes_desired_num - 1:
-                        current_pos = (agent['cellX'], agent['cellY'])
-                        utils.collect_agent_positions(current_pos, visited_cells, i)
-
-                        if i == episodes_desired_num - 1:
-                            utils.save_agent_positions(visited_cells, "live_experiment", path_grid_dimensions['cols'])
-
-                    if terminated:
-                        i += 1
-            elif eval_mode:
-                rejoinedPlayer = True
-
-            json_print(agents)
-            json_print(targets)
-
-
-
-    except json.JSONDecodeError:
-        print("Error: Invalid JSON data received.", file=sys.stderr)
-
-
+writer.close()
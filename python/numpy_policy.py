@@ -0,0 +1,270 @@
+"""
+Forward pass of the PPO policies of this project in NumPy alone, read straight from the SB3 zip: neither torch nor
+stable_baselines3 is imported, which is what lets interface.py run without them.
+
+Supported are the MlpPolicy (FlattenExtractor) and the CnnPolicy with CustomCNNFeatureExtractor of python/agent.py,
+with any activation of the actor MLP listed in ACTIVATIONS. Only the actor path is computed; the action is the
+argmax of the logits, so predictions are always deterministic.
+"""
+
+import ast
+import collections
+import io
+import json
+import pickle
+import re
+import zipfile
+
+import numpy as np
+
+import utils
+
+
+ACTIVATIONS = {
+    "Tanh": lambda x: np.tanh(x, out=x),
+    "ReLU": lambda x: np.maximum(x, 0, out=x),
+}
+
+_STORAGE_DTYPES = {
+    "FloatStorage": np.float32,
+    "DoubleStorage": np.float64,
+    "HalfStorage": np.float16,
+    "LongStorage": np.int64,
+    "IntStorage": np.int32,
+    "ByteStorage": np.uint8,
+    "BoolStorage": np.bool_,
+}
+
+
+def _literal(value):
+    """A field of the SB3 "data" JSON, which holds repr() strings or plain values depending on the SB3 version."""
+    return ast.literal_eval(value) if isinstance(value, str) else value
+
+
+def _rebuild_tensor(storage, storage_offset, size, stride, requires_grad=False, backward_hooks=None, metadata=None):
+    if not size:
+        return storage[storage_offset:storage_offset + 1].reshape(()).copy()
+    strides = [s * storage.itemsize for s in stride]
+    return np.lib.stride_tricks.as_strided(storage[storage_offset:], shape=size, strides=strides).copy()
+
+
+def _rebuild_parameter(data, requires_grad=False, backward_hooks=None):
+    return data
+
+
+class _StateDictUnpickler(pickle.Unpickler):
+    """
+    Reads the data.pkl of a torch.save() zip into a dict of NumPy arrays. Only the handful of globals a state dict
+    of tensors refers to are resolved, anything else is refused, so loading runs no code from the file.
+    """
+
+    def __init__(self, file, archive, prefix):
+        super().__init__(file)
+        self.archive = archive
+        self.prefix = prefix
+        self._storages = {}
+
+    def find_class(self, module, name):
+        if (module, name) == ("collections", "OrderedDict"):
+            return collections.OrderedDict
+        if (module, name) == ("torch._utils", "_rebuild_tensor_v2"):
+            return _rebuild_tensor
+        if (module, name) == ("torch._utils", "_rebuild_parameter"):
+            return _rebuild_parameter
+        if module == "torch" and name in _STORAGE_DTYPES:
+            return _STORAGE_DTYPES[name]
+        raise pickle.UnpicklingError(f"unsupported global {module}.{name} in a policy state dict")
+
+    def persistent_load(self, pid):
+        _, dtype, key, _location, _numel = pid
+        if key not in self._storages:
+            data = self.archive.read(f"{self.prefix}data/{key}")
+            self._storages[key] = np.frombuffer(data, dtype=np.dtype(dtype).newbyteorder("<"))
+        return self._storages[key]
+
+
+def load_state_dict(file):
+    """The tensors of a torch.save()d state dict (the policy.pth of an SB3 zip), as NumPy arrays."""
+    with zipfile.ZipFile(file) as archive:
+        pickle_name = next(name for name in archive.namelist() if name.endswith("data.pkl"))
+        prefix = pickle_name[:-len("data.pkl")]
+        byteorder = f"{prefix}byteorder"
+        if byteorder in archive.namelist() and archive.read(byteorder) != b"little":
+            raise ValueError("only little-endian state dicts are supported")
+        return _StateDictUnpickler(io.BytesIO(archive.read(pickle_name)), archive, prefix).load()
+
+
+class NumpyPolicy:
+    """
+    predict() has the signature of PPO.predict() and takes the same observations, single or batched. Internally
+    images are kept channel-last, so env observations go in as they are and the first linear layer of the CNN
+    extractor is permuted once at load time to match. Work buffers are allocated once per batch size.
+    """
+
+    def __init__(self, state_dict, data):
+        self.observation_shape = tuple(_literal(data["observation_space"]["_shape"]))
+        self.observation_dtype = np.dtype(data["observation_space"]["dtype"])
+        self.n_actions = int(_literal(data["action_space"]["n"]))
+        policy_kwargs = data.get("policy_kwargs", {})
+        activation = re.search(r"\.(\w+)'>", policy_kwargs.get("activation_fn", "<class 'torch.nn.modules.activation.Tanh'>")).group(1)
+        if activation not in ACTIVATIONS:
+            raise ValueError(f"unsupported activation {activation}, expected one of {list(ACTIVATIONS)}")
+        self._activation = ACTIVATIONS[activation]
+
+        extractor = "pi_features_extractor." if any(k.startswith("pi_features_extractor.") for k in state_dict) else "features_extractor."
+        self._convs = []
+        self._extractor_linear = None
+        if any(k.startswith(extractor + "image_conv.") for k in state_dict):
+            # CustomCNNFeatureExtractor: Conv-ReLU-MaxPool(2), Conv-ReLU, Conv-ReLU, [AdaptiveMaxPool], Flatten, Linear-ReLU
+            layers = sorted({int(k.split(".")[2]) for k in state_dict if k.startswith(extractor + "image_conv.")})
+            *conv_layers, linear_layer = layers
+            for index in conv_layers:
+                weight = state_dict[f"{extractor}image_conv.{index}.weight"]
+                out_channels, in_channels, kh, kw = weight.shape
+                # im2col weights: one row per (kh, kw, in) element of a window, in the order _features() copies them
+                self._convs.append((np.ascontiguousarray(weight.transpose(2, 3, 1, 0).reshape(-1, out_channels)),
+                                    state_dict[f"{extractor}image_conv.{index}.bias"], kh, kw))
+            self._pool_after_first = True
+            weight = state_dict[f"{extractor}image_conv.{linear_layer}.weight"]
+            height, width = self._conv_output_size()
+            channels = self._convs[-1][0].shape[1]
+            self._adaptive_pool = None
+            if channels * height * width != weight.shape[1]:
+                pooled = int(round(np.sqrt(weight.shape[1] / channels)))
+                self._adaptive_pool = pooled
+                height = width = pooled
+            # torch flattens (C, H, W), the buffers here are (H, W, C)
+            weight = weight.reshape(-1, channels, height, width).transpose(0, 2, 3, 1).reshape(weight.shape[0], -1)
+            self._extractor_linear = (np.ascontiguousarray(weight.T), state_dict[f"{extractor}image_conv.{linear_layer}.bias"])
+
+        self._mlp = []
+        index = 0
+        while f"mlp_extractor.policy_net.{index}.weight" in state_dict:
+            self._mlp.append((np.ascontiguousarray(state_dict[f"mlp_extractor.policy_net.{index}.weight"].T),
+                              state_dict[f"mlp_extractor.policy_net.{index}.bias"]))
+            index += 2  # Linear, activation, Linear, ...
+        self._action_net = (np.ascontiguousarray(state_dict["action_net.weight"].T), state_dict["action_net.bias"])
+        self._buffers = {}
+
+    @classmethod
+    def load(cls, path):
+        with zipfile.ZipFile(path) as archive:
+            data = json.loads(archive.read("data"))
+            with archive.open("policy.pth") as f:
+                state_dict = load_state_dict(io.BytesIO(f.read()))
+        return cls(state_dict, data)
+
+    def __repr__(self):
+        kind = "cnn" if self._convs else "mlp"
+        return f"NumpyPolicy({kind}, observation_shape={self.observation_shape}, actions={self.n_actions})"
+
+    @property
+    def is_image(self):
+        return len(self.observation_shape) == 3
+
+    def _conv_output_size(self):
+        _, height, width = self.observation_shape
+        for k, (_, _, kh, kw) in enumerate(self._convs):
+            height, width = height - kh + 1, width - kw + 1
+            if k == 0 and self._pool_after_first:
+                height, width = height // 2, width // 2
+        return height, width
+
+    def _get_buffers(self, batch_size):
+        if batch_size not in self._buffers:
+            buffers = {}
+            if self._convs:
+                channels, height, width = self.observation_shape
+                buffers["input"] = np.empty((batch_size, height, width, channels), dtype=np.float32)
+                for k, (weight, _, kh, kw) in enumerate(self._convs):
+                    height, width = height - kh + 1, width - kw + 1
+                    buffers[f"columns{k}"] = np.empty((batch_size, height, width, weight.shape[0]), dtype=np.float32)
+                    buffers[f"conv{k}"] = np.empty((batch_size, height, width, weight.shape[1]), dtype=np.float32)
+                    if k == 0 and self._pool_after_first:
+                        height, width = height // 2, width // 2
+                        buffers["pool0"] = np.empty((batch_size, height, width, weight.shape[1]), dtype=np.float32)
+                if self._adaptive_pool:
+                    buffers["adaptive_pool"] = np.empty((batch_size, self._adaptive_pool, self._adaptive_pool, self._convs[-1][0].shape[1]), dtype=np.float32)
+                buffers["features"] = np.empty((batch_size, self._extractor_linear[0].shape[1]), dtype=np.float32)
+            else:
+                buffers["input"] = np.empty((batch_size, int(np.prod(self.observation_shape))), dtype=np.float32)
+            for k, (weight, _) in enumerate(self._mlp):
+                buffers[f"mlp{k}"] = np.empty((batch_size, weight.shape[1]), dtype=np.float32)
+            buffers["logits"] = np.empty((batch_size, self.n_actions), dtype=np.float32)
+            self._buffers[batch_size] = buffers
+        return self._buffers[batch_size]
+
+    def _features(self, observations, buffers):
+        x = buffers["input"]
+        if not self._convs:
+            np.copyto(x, observations.reshape(len(observations), -1), casting="unsafe")
+            return x
+
+        np.copyto(x, observations, casting="unsafe")
+        x *= np.float32(1 / 255.0)
+        for k, (weight, bias, kh, kw) in enumerate(self._convs):
+            columns, out = buffers[f"columns{k}"], buffers[f"conv{k}"]
+            windows = np.lib.stride_tricks.sliding_window_view(x, (kh, kw), axis=(1, 2))  # (n, h, w, c, kh, kw)
+            np.copyto(columns.reshape(windows.shape[:3] + (kh, kw, windows.shape[3])), windows.transpose(0, 1, 2, 4, 5, 3))
+            np.matmul(columns, weight, out=out)
+            out += bias
+            np.maximum(out, 0, out=out)
+            x = out
+            if k == 0 and self._pool_after_first:
+                pooled = buffers["pool0"]
+                n, height, width, channels = pooled.shape
+                np.max(x[:, :height * 2, :width * 2].reshape(n, height, 2, width, 2, channels), axis=(2, 4), out=pooled)
+                x = pooled
+
+        if self._adaptive_pool:
+            pooled = buffers["adaptive_pool"]
+            size = self._adaptive_pool
+            height, width = x.shape[1:3]
+            for i in range(size):
+                rows = slice(i * height // size, -(-(i + 1) * height // size))
+                for j in range(size):
+                    np.max(x[:, rows, j * width // size:-(-(j + 1) * width // size)], axis=(1, 2), out=pooled[:, i, j])
+            x = pooled
+
+        weight, bias = self._extractor_linear
+        features = buffers["features"]
+        np.matmul(x.reshape(len(x), -1), weight, out=features)
+        features += bias
+        np.maximum(features, 0, out=features)
+        return features
+
+    def predict(self, observation, state=None, episode_start=None, deterministic=True):
+        observations = np.asarray(observation)
+        shape = self.observation_shape
+        if self.is_image:
+            channels, height, width = shape
+            if observations.shape[-3:] == shape and shape != (height, width, channels):
+                observations = np.moveaxis(observations, -3, -1)  # channel-first in, channel-last inside
+            vectorized = observations.ndim > 3
+            observations = observations.reshape((-1, height, width, channels))
+        else:
+            vectorized = observations.ndim > len(shape)
+            observations = observations.reshape((-1,) + shape)
+
+        buffers = self._get_buffers(len(observations))
+        x = self._features(observations, buffers)
+        for k, (weight, bias) in enumerate(self._mlp):
+            out = buffers[f"mlp{k}"]
+            np.matmul(x, weight, out=out)
+            out += bias
+            self._activation(out)
+            x = out
+        weight, bias = self._action_net
+        logits = buffers["logits"]
+        np.matmul(x, weight, out=logits)
+        logits += bias
+
+        actions = logits.argmax(axis=1)
+        if not vectorized:
+            actions = actions.squeeze(axis=0)
+        return actions, state
+
+
+def load(model_dir):
+    """The NumpyPolicy of the latest checkpoint of `model_dir`."""
+    return NumpyPolicy.load(utils.get_latest_model_path(model_dir))
@@ -0,0 +1,174 @@
+"""
+Exports the deterministic policy of a PPO checkpoint as a TorchScript or ONNX file and runs it with Predictor.
+Imports are deferred so that running an export only loads what its format needs: torch for TorchScript,
+onnxruntime for ONNX; Stable-Baselines3 is only imported to export or to load a checkpoint.
+"""
+
+import copy
+import json
+import os
+
+import numpy as np
+
+import utils
+
+
+EXPORT_FORMATS = ("torchscript", "onnx")
+EXPORT_PRECISIONS = ("float32", "float16", "int8")
+_EXTENSIONS = {"torchscript": ".pt", "onnx": ".onnx"}
+
+
+def _greedy_policy(policy, dtype):
+    """
+    The deterministic action path of an SB3 ActorCriticPolicy as an nn.Module, preprocessing included: raw
+    observations in, argmax action out. The value head and the action distribution are left behind.
+    """
+    from torch import nn
+    from stable_baselines3.common.preprocessing import is_image_space
+
+    class _GreedyPolicy(nn.Module):
+        def __init__(self):
+            super().__init__()
+            # Copies, so that converting or quantizing the export leaves the loaded model untouched
+            self.features_extractor = copy.deepcopy(policy.pi_features_extractor)
+            self.mlp_extractor = copy.deepcopy(policy.mlp_extractor)
+            self.action_net = copy.deepcopy(policy.action_net)
+            self.normalize_images = bool(policy.normalize_images and is_image_space(policy.observation_space))
+            self.dtype = dtype
+
+        def forward(self, observations):
+            observations = observations.to(self.dtype)
+            if self.normalize_images:
+                observations = observations / 255.0
+            latent_pi = self.mlp_extractor.forward_actor(self.features_extractor(observations))
+            return self.action_net(latent_pi).argmax(dim=1)
+
+    return _GreedyPolicy()
+
+
+def export_path(model_dir, export_format="torchscript", precision="float32"):
+    return os.path.join(model_dir, "exported", f"policy_{precision}{_EXTENSIONS[export_format]}")
+
+
+def _metadata_path(path):
+    return path + ".json"
+
+
+def export_policy(model, path, export_format="torchscript", precision="float32", source=None):
+    """
+    Writes the deterministic policy of the PPO `model` to `path` as a self-contained TorchScript or ONNX file,
+    plus `<path>.json` with what Predictor needs to feed it. float16 runs the whole network in half precision;
+    int8 quantizes the weights of the linear layers (dynamic quantization), the convolutions stay float32.
+    The ONNX export and its int8 variant need the optional onnx / onnxscript / onnxruntime packages.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"export_format must be one of {EXPORT_FORMATS}, got {export_format!r}")
+    if precision not in EXPORT_PRECISIONS:
+        raise ValueError(f"precision must be one of {EXPORT_PRECISIONS}, got {precision!r}")
+
+    import torch
+    from torch import nn
+
+    policy = model.policy.to("cpu").eval()
+    observation_space = policy.observation_space
+    module = _greedy_policy(policy, dtype=torch.float16 if precision == "float16" else torch.float32).eval()
+    if precision == "float16":
+        module = module.half()
+    example = torch.as_tensor(np.stack([observation_space.sample()] * 2))
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with torch.no_grad():
+        if export_format == "torchscript":
+            if precision == "int8":
+                module = torch.ao.quantization.quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8)
+            torch.jit.save(torch.jit.trace(module, example), path)
+        else:
+            torch.onnx.export(module, (example,), path, input_names=["observations"], output_names=["actions"],
+                              dynamic_axes={"observations": {0: "batch"}, "actions": {0: "batch"}}, dynamo=False)
+            if precision == "int8":
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+                float_path = path + ".float32"
+                os.replace(path, float_path)
+                try:
+                    quantize_dynamic(float_path, path, weight_type=QuantType.QInt8)
+                finally:
+                    os.remove(float_path)
+
+    with open(_metadata_path(path), "w") as f:
+        json.dump({
+            "format": export_format,
+            "precision": precision,
+            "observation_shape": list(observation_space.shape),
+            "observation_dtype": str(observation_space.dtype),
+            "n_actions": int(model.action_space.n),
+            "source": source,
+        }, f, indent=2)
+    return path
+
+
+class Predictor:
+    """
+    Runs a policy written by export_policy(). predict() has the signature of PPO.predict() and takes the same
+    observations (single or batched, channel-last images are transposed like SB3 does), but is always deterministic.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(_metadata_path(path)) as f:
+            self.metadata = json.load(f)
+        self.observation_shape = tuple(self.metadata["observation_shape"])
+        self.observation_dtype = np.dtype(self.metadata["observation_dtype"])
+
+        if self.metadata["format"] == "torchscript":
+            import torch
+            module = torch.jit.load(path, map_location="cpu").eval()
+
+            def run(observations):
+                with torch.inference_mode():
+                    return module(torch.from_numpy(observations)).numpy()
+        else:
+            import onnxruntime
+            session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+
+            def run(observations):
+                return session.run(None, {"observations": observations})[0]
+        self._run = run
+
+    def __repr__(self):
+        return f"Predictor({self.path!r}, format={self.metadata['format']}, precision={self.metadata['precision']})"
+
+    def predict(self, observation, state=None, episode_start=None, deterministic=True):
+        observations = np.asarray(observation, dtype=self.observation_dtype)
+        shape = self.observation_shape
+        if len(shape) == 3 and observations.shape[-3:] != shape and observations.shape[-3:] == (shape[1], shape[2], shape[0]):
+            observations = np.moveaxis(observations, -1, -3)
+        vectorized = observations.ndim > len(shape)
+        observations = np.ascontiguousarray(observations.reshape((-1,) + shape))
+
+        actions = self._run(observations)
+        if not vectorized:
+            actions = actions.squeeze(axis=0)
+        return actions, state
+
+
+def load_policy(model_dir, env=None, use_export=False):
+    """
+    The latest checkpoint of `model_dir` through PPO.load(), or with `use_export` a Predictor for the newest export in
+    `model_dir`/exported, whatever its format and precision. Both answer predict(); the artifact used is printed.
+    """
+    if use_export:
+        export_dir = os.path.join(model_dir, "exported")
+        exports = []
+        if os.path.isdir(export_dir):
+            exports = [os.path.join(export_dir, f) for f in os.listdir(export_dir)
+                       if f.endswith(tuple(_EXTENSIONS.values())) and os.path.exists(_metadata_path(os.path.join(export_dir, f)))]
+        if not exports:
+            raise FileNotFoundError(f"No export in {export_dir}, run agent.py --export first")
+        predictor = Predictor(max(exports, key=os.path.getmtime))
+        print(f"Loaded export {predictor}")
+        return predictor
+    from stable_baselines3 import PPO
+
+    latest_model_path = utils.get_latest_model_path(model_dir)
+    print(f"Loaded checkpoint {latest_model_path}")
+    return PPO.load(latest_model_path, env=env)
@@ -0,0 +1,112 @@
+"""
+Visited cells of many episodes in one .npz: `cells` holds every episode's cells back to back as uint16 indices
+y * grid_width + x, episode i being cells[offsets[i]:offsets[i + 1]], and `grid_width` the width they were computed
+with. The visited_cells.txt files written before (one comma-separated line of the same indices per episode) are
+still read.
+"""
+
+import os
+
+import numpy as np
+
+
+CELL_DTYPE = np.uint16
+CHUNK_EPISODES = 65536  # episodes compared per vectorized step
+
+
+class Trajectories:
+    def __init__(self, cells, offsets, grid_width=None):
+        self.cells = cells
+        self.offsets = offsets
+        self.grid_width = grid_width
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def episode(self, i):
+        return self.cells[self.offsets[i]:self.offsets[i + 1]]
+
+    def heatmap(self, grid_size=None):
+        """(grid_size, grid_size) visit counts, rows being y."""
+        grid_size = grid_size or self.grid_width
+        return np.bincount(self.cells, minlength=grid_size * grid_size)[:grid_size * grid_size].reshape(grid_size, grid_size)
+
+
+def encode(positions, grid_width):
+    """Trajectories of `positions`, one list of (x, y) cells per episode."""
+    if grid_width * grid_width > np.iinfo(CELL_DTYPE).max + 1:
+        raise ValueError(f"a {grid_width} x {grid_width} grid does not fit {np.dtype(CELL_DTYPE).name} cell indices")
+    offsets = np.zeros(len(positions) + 1, dtype=np.int64)
+    np.cumsum([len(episode) for episode in positions], out=offsets[1:])
+    xy = np.array([cell for episode in positions for cell in episode], dtype=np.int64).reshape(-1, 2)
+    return Trajectories((xy[:, 1] * grid_width + xy[:, 0]).astype(CELL_DTYPE), offsets, grid_width)
+
+
+def save(path, positions, grid_width, append=False):
+    """
+    Writes the episodes of `positions` to `path`, after the episodes already in it with `append`. The file is
+    replaced atomically, so a reader never sees it half written.
+    """
+    trajectories = encode(positions, grid_width)
+    if append and os.path.exists(path):
+        existing = load(path)
+        if existing.grid_width != grid_width:
+            raise ValueError(f"{path} holds cells of a grid of width {existing.grid_width}, not {grid_width}")
+        trajectories = Trajectories(np.concatenate([existing.cells, trajectories.cells]),
+                                    np.concatenate([existing.offsets, trajectories.offsets[1:] + existing.offsets[-1]]),
+                                    grid_width)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temporary_path = path + ".tmp.npz"
+    np.savez(temporary_path, cells=trajectories.cells, offsets=trajectories.offsets, grid_width=np.int64(grid_width))
+    os.replace(temporary_path, path)
+
+
+def _load_text(path):
+    cells, lengths = [], []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            episode = np.array(line.split(","), dtype=np.int64) if line else np.zeros(0, dtype=np.int64)
+            cells.append(episode)
+            lengths.append(len(episode))
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return Trajectories(np.concatenate(cells).astype(CELL_DTYPE) if cells else np.zeros(0, dtype=CELL_DTYPE), offsets)
+
+
+def load(path):
+    """The Trajectories of a file written by save(), or of a legacy visited_cells.txt (whose grid width is unknown)."""
+    if path.endswith(".txt"):
+        return _load_text(path)
+    with np.load(path) as data:
+        return Trajectories(data["cells"], data["offsets"], int(data["grid_width"]))
+
+
+def first_divergences(a, b):
+    """
+    For every episode index present in both `a` and `b`, the first step at which their cells differ, or -1 if the
+    episodes are identical. An episode that is a prefix of the other diverges where it ends.
+    """
+    n = min(len(a), len(b))
+    divergences = np.empty(n, dtype=np.int64)
+    for start in range(0, n, CHUNK_EPISODES):
+        stop = min(start + CHUNK_EPISODES, n)
+        lengths_a, lengths_b = a.lengths[start:stop], b.lengths[start:stop]
+        common = np.minimum(lengths_a, lengths_b)
+        # Every (episode, step) pair of the common prefixes of this chunk, compared in one operation
+        episode = np.repeat(np.arange(start, stop), common)
+        step = np.arange(common.sum()) - np.repeat(np.cumsum(common) - common, common)
+        mismatch = np.flatnonzero(a.cells[a.offsets[episode] + step] != b.cells[b.offsets[episode] + step])
+
+        first = np.full(stop - start, -1, dtype=np.int64)
+        episodes, first_mismatch = np.unique(episode[mismatch], return_index=True)
+        first[episodes - start] = step[mismatch[first_mismatch]]
+        truncated = (first < 0) & (lengths_a != lengths_b)
+        first[truncated] = common[truncated]
+        divergences[start:stop] = first
+    return divergences
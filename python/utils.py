@@ -3,9 +3,9 @@ import os
 import random
 import textwrap
 
-import gymnasium as gym
 import numpy
-import torch
+
+import trajectory_store
 
 
 def get_latest_model_path(model_dir):
@@ -33,7 +33,7 @@ def get_eval_path(eval_dir):
     Always return the full path to the evaluation file.
     Creates a new path even if the file doesn't exist yet.
     """
-    return os.path.join(eval_dir, "visited_cells.txt")
+    return os.path.join(eval_dir, "visited_cells.npz")
 
 
 def save_model_config(policy_name, hyperparams, save_dir):
@@ -63,7 +63,27 @@ def save_model_config(policy_name, hyperparams, save_dir):
         f.write(f'policy_name = "{policy_name}"\n\n')
         f.write("hyperparams = " + convert(hyperparams) + "\n")
 
-def save_env_config(params, use_frame_stacking, save_dir):
+DEFAULT_VEC_ENV = {
+    "backend": "dummy",
+    "n_envs": 8,
+    "n_workers": None,
+    "pin_cpus": False,
+    "torch_threads": None,
+}
+
+
+def get_vec_env_config(config=None, overrides=None):
+    """
+    Training vec-env settings: DEFAULT_VEC_ENV, updated with the `vec_env` dict of env_config.py if it has one,
+    then with the non-None `overrides` (the CLI flags).
+    """
+    vec_env = dict(DEFAULT_VEC_ENV)
+    vec_env.update(getattr(config, "vec_env", {}))
+    vec_env.update({key: value for key, value in (overrides or {}).items() if value is not None})
+    return vec_env
+
+
+def save_env_config(params, use_frame_stacking, save_dir, vec_env=None):
     os.makedirs(save_dir, exist_ok=True)
     file_path = os.path.join(save_dir, "env_config.py")
 
@@ -78,6 +98,15 @@ def save_env_config(params, use_frame_stacking, save_dir):
 
         f.write(f"use_frame_stacking = {use_frame_stacking}\n")
 
+        if vec_env is not None:
+            f.write("vec_env = {\n")
+            for key, value in vec_env.items():
+                if isinstance(value, str):
+                    f.write(f'    "{key}": "{value}",\n')
+                else:
+                    f.write(f'    "{key}": {value},\n')
+            f.write("}\n")
+
 
 def load_config_from_py(path):
     module_name = os.path.splitext(os.path.basename(path))[0]  # e.g., "model_config"
@@ -89,13 +118,21 @@ def load_config_from_py(path):
 
 def make_env(render_mode=None, **env_kwargs):
     def _make_env():
+        # _make_env is pickled by value into subprocess workers, where nothing has registered GridWorld-v0 yet
+        import gymnasium as gym
+        import gymnasium_env  # noqa: F401
         env = gym.make("gymnasium_env/GridWorld-v0", render_mode=render_mode, **env_kwargs)
         return env
     return _make_env  # Return the function
 
 
+def get_channels_order(env_kwargs):
+    return "first" if env_kwargs.get("channels_first", False) else "last"
+
 
 def seed(seed):
+    import torch  # imported here so that interface.py can use this module without torch installed
+
     random.seed(seed)
     numpy.random.seed(seed)
     torch.manual_seed(seed)
@@ -103,6 +140,8 @@ def seed(seed):
         torch.cuda.manual_seed_all(seed)
 
 def get_device(policy):
+    import torch
+
     if torch.backends.mps.is_available() and policy == 'CnnPolicy':
         return 'mps'
     elif torch.cuda.is_available() and policy == 'CnnPolicy':
@@ -124,19 +163,11 @@ def collect_agent_positions(current_pos, positions, i):
     if not positions[i] or positions[i][-1] != current_pos:
         positions[i].append(current_pos)
 
-def save_agent_positions(positions, folder, grid_width):
+def save_agent_positions(positions, folder, grid_width, append=False):
     """
-    Saves agent positions (positions[i]) into a text file as CSV.
-    - Each positions[i] is written in a single line
-    - Values are comma-separated
-    - Newline when episode (i) changes
+    Saves agent positions (positions[i]) into evaluations/<folder>/visited_cells.npz (see trajectory_store).
+    - Each cell is stored as y * grid_width + x
+    - Overwrites the file, or adds the episodes after the ones already in it with append
     """
     eval_dir = os.path.join("evaluations", folder)
-    os.makedirs(eval_dir, exist_ok=True)
-    eval_path = get_eval_path(eval_dir)
-
-    with open(eval_path, "w") as f:  # overwrite each time to keep it clean
-        for episode_positions in positions:
-            linear_values = [str(int(y * grid_width + x)) for x, y in episode_positions]
-            line = ",".join(linear_values)
-            f.write(line + "\n")
\ No newline at end of file
+    trajectory_store.save(get_eval_path(eval_dir), positions, grid_width, append=append)
\ No newline at end of file
@@ -0,0 +1,383 @@
+import inspect
+import multiprocessing as mp
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from stable_baselines3.common.env_util import is_wrapped, make_vec_env
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv, VecEnv, VecMonitor
+from stable_baselines3.common.vec_env.base_vec_env import CloudpickleWrapper
+from stable_baselines3.common.vec_env.patch_gym import _patch_env
+
+import utils
+from gymnasium_env.envs import GridWorldEnv, GridWorldVectorEnv
+
+
+VEC_ENV_BACKENDS = ("dummy", "subproc", "shm", "thread", "batched")
+
+
+class GridWorldBatchVecEnv(VecEnv):
+    """
+    Stable-Baselines3 view of GridWorldVectorEnv: all environments are stepped by one batched call instead of one
+    Python GridWorldEnv per environment, so hundreds or thousands of environments fit on a single core.
+    """
+
+    def __init__(self, num_envs, **env_kwargs):
+        self.venv = GridWorldVectorEnv(num_envs=num_envs, **env_kwargs)
+        super().__init__(num_envs, self.venv.single_observation_space, self.venv.single_action_space)
+        self.actions = None
+
+    def reset(self):
+        obs, info = self.venv.reset(seed=self._seeds[0])
+        self.reset_infos = self._split_infos(info)
+        self._reset_seeds()
+        self._reset_options()
+        return obs
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self):
+        obs, rewards, terminated, truncated, info = self.venv.step(self.actions)
+        dones = terminated | truncated
+        infos = self._split_infos(info)
+
+        # Like DummyVecEnv, a finished environment reports the info of its last step, not of the reset
+        for i in np.flatnonzero(dones):
+            infos[i] = {
+                "distance": info["final_info"]["distance"][i],
+                "wrong_steps": info["final_info"]["wrong_steps"][i],
+                "pattern": info["final_info"]["pattern"][i],
+                "terminal_observation": info["final_obs"][i],
+                "TimeLimit.truncated": bool(truncated[i] and not terminated[i]),
+            }
+            self.reset_infos[i] = infos[i]
+
+        return obs, rewards.astype(np.float32), dones, infos
+
+    def _split_infos(self, info):
+        return [
+            {"distance": distance, "wrong_steps": wrong_steps, "pattern": pattern}
+            for distance, wrong_steps, pattern in zip(info["distance"].tolist(), info["wrong_steps"].tolist(), info["pattern"].tolist())
+        ]
+
+    def close(self):
+        self.venv.close()
+
+    def get_attr(self, attr_name, indices=None):
+        value = getattr(self.venv, attr_name)
+        return [value for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self.venv, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        result = getattr(self.venv, method_name)(*method_args, **method_kwargs)
+        return [result for _ in self._get_indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
+
+
+def make_batched_vec_env(n_envs, seed=None, **env_kwargs):
+    """
+    Drop-in replacement for make_vec_env(utils.make_env(**env_kwargs), n_envs, seed) backed by GridWorldVectorEnv.
+    VecMonitor adds the "episode" info that Monitor adds to every env in make_vec_env. GridWorldEnv options that
+    GridWorldVectorEnv cannot honor (e.g. `instrument`) are rejected unless they keep their default value.
+    """
+    supported = inspect.signature(GridWorldVectorEnv.__init__).parameters
+    defaults = inspect.signature(GridWorldEnv.__init__).parameters
+    for name, value in env_kwargs.items():
+        if name not in supported and (name not in defaults or value != defaults[name].default):
+            other_backends = ", ".join(backend for backend in VEC_ENV_BACKENDS if backend != "batched")
+            raise ValueError(f"the batched vec env backend does not support the GridWorldEnv option {name}={value!r}, "
+                             f"use one of the {other_backends} backends")
+    env = GridWorldBatchVecEnv(n_envs, **{name: value for name, value in env_kwargs.items() if name in supported})
+    env.seed(seed)
+    return VecMonitor(env)
+
+
+class ThreadVecEnv(DummyVecEnv):
+    """
+    DummyVecEnv whose step is split across `n_workers` threads, each stepping a contiguous group of environments.
+    Threads only run in parallel while the environments release the GIL (NumPy-heavy envs, free-threaded builds);
+    for pure Python envs prefer the "shm" or "subproc" backends.
+    """
+
+    def __init__(self, env_fns, n_workers=None, worker_cpus=None):
+        super().__init__(env_fns)
+        n_workers = min(n_workers or os.cpu_count(), self.num_envs)
+        self._groups = np.array_split(np.arange(self.num_envs), n_workers)
+        self._worker_cpus = iter(worker_cpus or [])
+        self._executor = ThreadPoolExecutor(max_workers=n_workers, initializer=self._pin_thread if worker_cpus else None)
+
+    def _pin_thread(self):
+        # On Linux sched_setaffinity(0) applies to the calling thread only
+        os.sched_setaffinity(0, next(self._worker_cpus))
+
+    def step_wait(self):
+        list(self._executor.map(self._step_group, self._groups))
+        return self._obs_from_buf(), np.copy(self.buf_rews), np.copy(self.buf_dones), [dict(info) for info in self.buf_infos]
+
+    def _step_group(self, group):
+        for env_idx in group:
+            obs, self.buf_rews[env_idx], terminated, truncated, self.buf_infos[env_idx] = self.envs[env_idx].step(self.actions[env_idx])
+            self.buf_dones[env_idx] = terminated or truncated
+            self.buf_infos[env_idx]["TimeLimit.truncated"] = truncated and not terminated
+            if self.buf_dones[env_idx]:
+                self.buf_infos[env_idx]["terminal_observation"] = obs
+                obs, self.reset_infos[env_idx] = self.envs[env_idx].reset()
+            self._save_obs(env_idx, obs)
+
+    def close(self):
+        self._executor.shutdown()
+        super().close()
+
+
+def _shm_worker(remote, parent_remote, env_fn_wrappers, obs_buffer, obs_shape, obs_dtype, env_indices, cpus):
+    parent_remote.close()
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+        torch.set_num_threads(1)
+    envs = [_patch_env(env_fn_wrapper.var()) for env_fn_wrapper in env_fn_wrappers]
+    # This worker's rows of the observation buffer shared with the main process
+    observations = np.frombuffer(obs_buffer, dtype=obs_dtype).reshape(-1, *obs_shape)[env_indices[0]:env_indices[-1] + 1]
+    reset_infos = [{} for _ in envs]
+
+    while True:
+        try:
+            cmd, data = remote.recv()
+            if cmd == "step":
+                results = []
+                for i, (env, action) in enumerate(zip(envs, data)):
+                    observation, reward, terminated, truncated, info = env.step(action)
+                    done = terminated or truncated
+                    info["TimeLimit.truncated"] = truncated and not terminated
+                    if done:
+                        # Only final observations travel through the pipe, every other one is written in place
+                        info["terminal_observation"] = observation
+                        observation, reset_infos[i] = env.reset()
+                    observations[i] = observation
+                    results.append((reward, done, info, reset_infos[i]))
+                remote.send(results)
+            elif cmd == "reset":
+                for i, (env, (seed, options)) in enumerate(zip(envs, data)):
+                    maybe_options = {"options": options} if options else {}
+                    observations[i], reset_infos[i] = env.reset(seed=seed, **maybe_options)
+                remote.send(reset_infos)
+            elif cmd == "env_method":
+                local_indices, name, args, kwargs = data
+                remote.send([envs[i].get_wrapper_attr(name)(*args, **kwargs) for i in local_indices])
+            elif cmd == "get_attr":
+                local_indices, name = data
+                remote.send([envs[i].get_wrapper_attr(name) for i in local_indices])
+            elif cmd == "set_attr":
+                local_indices, name, value = data
+                for i in local_indices:
+                    setattr(envs[i], name, value)
+                remote.send(None)
+            elif cmd == "is_wrapped":
+                local_indices, wrapper_class = data
+                remote.send([is_wrapped(envs[i], wrapper_class) for i in local_indices])
+            elif cmd == "close":
+                for env in envs:
+                    env.close()
+                remote.close()
+                break
+            else:
+                raise NotImplementedError(f"`{cmd}` is not implemented in the worker")
+        except (EOFError, KeyboardInterrupt):
+            break
+
+
+class SharedMemoryVecEnv(VecEnv):
+    """
+    SubprocVecEnv variant for many cores: each of `n_workers` processes steps a group of environments and writes
+    their observations straight into one buffer shared with the main process, so only actions, rewards, dones and
+    infos are pickled. Observations must be a single Box (both GridWorldEnv policies are).
+    """
+
+    def __init__(self, env_fns, n_workers=None, start_method=None, worker_cpus=None):
+        n_envs = len(env_fns)
+        n_workers = min(n_workers or os.cpu_count(), n_envs)
+
+        # The spaces are needed to size the buffer before any worker exists
+        probe = env_fns[0]()
+        observation_space, action_space = probe.observation_space, probe.action_space
+        metadata = probe.metadata
+        probe.close()
+
+        if start_method is None:
+            start_method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+        if start_method == "forkserver":
+            _preload_forkserver()
+        ctx = mp.get_context(start_method)
+
+        obs_dtype = np.dtype(observation_space.dtype)
+        obs_buffer = ctx.RawArray('B', n_envs * int(np.prod(observation_space.shape)) * obs_dtype.itemsize)
+        self._observations = np.frombuffer(obs_buffer, dtype=obs_dtype).reshape(n_envs, *observation_space.shape)
+
+        self._groups = np.array_split(np.arange(n_envs), n_workers)
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(n_workers)])
+        self.processes = []
+        for w, (work_remote, remote, group) in enumerate(zip(self.work_remotes, self.remotes, self._groups)):
+            cpus = worker_cpus[w] if worker_cpus else None
+            wrappers = [CloudpickleWrapper(env_fns[i]) for i in group]
+            args = (work_remote, remote, wrappers, obs_buffer, observation_space.shape, obs_dtype, group, cpus)
+            process = ctx.Process(target=_shm_worker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        self.waiting = False
+        self.closed = False
+        # Last, because VecEnv.__init__ already asks the workers for render_mode
+        self.num_envs = n_envs
+        super().__init__(n_envs, observation_space, action_space)
+        self.metadata = metadata
+
+    def step_async(self, actions):
+        for remote, group in zip(self.remotes, self._groups):
+            remote.send(("step", actions[group[0]:group[-1] + 1]))
+        self.waiting = True
+
+    def step_wait(self):
+        results = [result for remote in self.remotes for result in remote.recv()]
+        self.waiting = False
+        rewards, dones, infos, self.reset_infos = zip(*results)
+        return self._observations.copy(), np.array(rewards, dtype=np.float32), np.array(dones, dtype=bool), list(infos)
+
+    def reset(self):
+        for remote, group in zip(self.remotes, self._groups):
+            remote.send(("reset", [(self._seeds[i], self._options[i]) for i in group]))
+        self.reset_infos = [info for remote in self.remotes for info in remote.recv()]
+        self._reset_seeds()
+        self._reset_options()
+        return self._observations.copy()
+
+    def close(self):
+        if self.closed:
+            return
+        if self.waiting:
+            for remote in self.remotes:
+                remote.recv()
+        for remote in self.remotes:
+            remote.send(("close", None))
+        for process in self.processes:
+            process.join()
+        self.closed = True
+
+    def get_images(self):
+        if self.render_mode != "rgb_array":
+            warnings.warn(f"The render mode is {self.render_mode}, but this method assumes it is `rgb_array` to obtain images.")
+            return [None for _ in range(self.num_envs)]
+        return self.env_method("render")
+
+    def _call_workers(self, cmd, indices, *data):
+        """Sends `cmd` to the workers owning `indices` and returns the per-environment results in order."""
+        indices = self._get_indices(indices)
+        requests = []
+        for remote, group in zip(self.remotes, self._groups):
+            local_indices = [i - group[0] for i in indices if group[0] <= i <= group[-1]]
+            if local_indices:
+                remote.send((cmd, (local_indices, *data)))
+                requests.append(remote)
+        results = [remote.recv() for remote in requests]
+        return [value for result in results if result is not None for value in result]
+
+    def get_attr(self, attr_name, indices=None):
+        return self._call_workers("get_attr", indices, attr_name)
+
+    def set_attr(self, attr_name, value, indices=None):
+        self._call_workers("set_attr", indices, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return self._call_workers("env_method", indices, method_name, method_args, method_kwargs)
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return self._call_workers("is_wrapped", indices, wrapper_class)
+
+
+def plan_cpu_affinity(n_workers, torch_threads=None):
+    """
+    Splits the cores this process may run on between torch and the env workers: the main process keeps the first
+    `torch_threads` cores (by default whatever the workers leave, at least one), and worker w gets one of the
+    remaining cores. Returns (torch_cpus, worker_cpus), or None where affinity cannot be set.
+    """
+    if not hasattr(os, "sched_setaffinity"):
+        warnings.warn("CPU pinning needs os.sched_setaffinity, which this platform does not have")
+        return None
+
+    cpus = sorted(os.sched_getaffinity(0))
+    torch_threads = torch_threads or max(1, len(cpus) - n_workers)
+    torch_cpus = cpus[:torch_threads]
+    free_cpus = cpus[torch_threads:] or cpus
+    worker_cpus = [{free_cpus[w % len(free_cpus)]} for w in range(n_workers)]
+    return torch_cpus, worker_cpus
+
+
+def _pinned(env_fn, cpus):
+    # Runs inside the SubprocVecEnv worker, so it pins the process that owns the env
+    def _make_env():
+        os.sched_setaffinity(0, cpus)
+        torch.set_num_threads(1)
+        return env_fn()
+    return _make_env
+
+
+def make_training_vec_env(env_kwargs, backend="dummy", n_envs=8, n_workers=None, pin_cpus=False, torch_threads=None, seed=None):
+    """
+    Builds the training VecEnv with one of VEC_ENV_BACKENDS:
+      dummy    all envs stepped one after the other in this process (DummyVecEnv)
+      subproc  one process per env (SubprocVecEnv)
+      shm      `n_workers` processes, each stepping a group of envs into shared observation buffers
+      thread   `n_workers` threads of this process, each stepping a group of envs
+      batched  one GridWorldVectorEnv stepping every env with array operations
+    With `pin_cpus` torch threads and env workers are kept on separate cores, see plan_cpu_affinity.
+    """
+    if backend not in VEC_ENV_BACKENDS:
+        raise ValueError(f"unknown vec env backend {backend!r}, expected one of {VEC_ENV_BACKENDS}")
+    if backend == "batched":
+        return make_batched_vec_env(n_envs, seed=seed, **env_kwargs)
+
+    n_workers = min(n_workers or os.cpu_count(), n_envs)
+    if backend == "subproc":
+        n_workers = n_envs
+    plan = plan_cpu_affinity(n_workers, torch_threads) if pin_cpus and backend != "dummy" else None
+    if plan is not None:
+        torch_cpus, worker_cpus = plan
+        os.sched_setaffinity(0, torch_cpus)
+        torch.set_num_threads(len(torch_cpus))
+    else:
+        worker_cpus = None
+
+    env_fn = utils.make_env(**env_kwargs)
+    if backend == "dummy":
+        return make_vec_env(env_fn, n_envs=n_envs, seed=seed, vec_env_cls=DummyVecEnv)
+    if backend == "subproc":
+        vec_env_kwargs = dict(worker_cpus=worker_cpus) if worker_cpus else {}
+        return make_vec_env(env_fn, n_envs=n_envs, seed=seed, vec_env_cls=_subproc_vec_env, vec_env_kwargs=vec_env_kwargs)
+
+    vec_env_cls = SharedMemoryVecEnv if backend == "shm" else ThreadVecEnv
+    return make_vec_env(env_fn, n_envs=n_envs, seed=seed, vec_env_cls=vec_env_cls,
+                        vec_env_kwargs=dict(n_workers=n_workers, worker_cpus=worker_cpus))
+
+
+def _preload_forkserver():
+    """
+    Has the forkserver import this module, and with it torch, stable_baselines3 and the env package, once before it
+    forks the first worker, so that workers start as copies of it instead of each importing them again (seconds
+    per worker). Only takes effect if the forkserver of this process is not running yet.
+    """
+    mp.set_forkserver_preload(["__main__", __name__])
+
+
+def _subproc_vec_env(env_fns, worker_cpus=None):
+    # SubprocVecEnv uses forkserver wherever it is available
+    if "forkserver" in mp.get_all_start_methods():
+        _preload_forkserver()
+    if worker_cpus:
+        env_fns = [_pinned(env_fn, cpus) for env_fn, cpus in zip(env_fns, worker_cpus)]
+    return SubprocVecEnv(env_fns)
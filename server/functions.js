@@ -777,21 +777,89 @@ const generateRandomWalls = (numWalls) => {
     return walls;
 };
 
+// Binary bridge to python/interface.py, see python/bridge_protocol.py for the layout of the messages
+const MESSAGE_ONE_TIME_DATA = 0;
+const MESSAGE_DRAWABLES = 1;
+const MESSAGE_DELTAS = 2;
+const DRAWABLE_RECORD_BYTES = 24;   // int32 clientId, float32 speed, float64 center x, float64 center y
+const DELTA_RECORD_BYTES = 20;      // int32 clientId, float64 dx, float64 dy
+const MAX_TICKS_IN_FLIGHT = 2;      // drawables sent that Python has not answered yet
+let lastSentTick = 0;
+let lastAnsweredTick = 0;
+
 function sendDrawablesToPython(drawables, pythonProcess) {
-    pythonProcess.stdin.write(JSON.stringify({
-        type: 'drawables',
-        data: drawables
-    }) + '\n');  // Send data via stdin
+    // Backpressure: while Python is still busy with earlier ticks this one is skipped instead of piling up in the pipe,
+    // the next tick carries newer positions anyway
+    if (lastSentTick - lastAnsweredTick >= MAX_TICKS_IN_FLIGHT) {
+        return;
+    }
+    lastSentTick++;
+
+    // Only agents and players are of use to the Python side, food and projectiles are left out
+    const agents = drawables.filter(drawable => drawable.type == 'agent');
+    const players = drawables.filter(drawable => drawable.type == 'player');
+    const payloadLength = 9 + (agents.length + players.length) * DRAWABLE_RECORD_BYTES;
+    const buffer = Buffer.allocUnsafe(4 + payloadLength);
+    buffer.writeUInt32LE(payloadLength, 0);
+    buffer.writeUInt8(MESSAGE_DRAWABLES, 4);
+    buffer.writeUInt32LE(lastSentTick, 5);
+    buffer.writeUInt16LE(agents.length, 9);
+    buffer.writeUInt16LE(players.length, 11);
+
+    let offset = 13;
+    for (const drawable of agents.concat(players)) {
+        buffer.writeInt32LE(drawable.clientId, offset);
+        buffer.writeFloatLE(drawable.speed, offset + 4);
+        buffer.writeDoubleLE(drawable.topLeftX + drawable.width / 2, offset + 8);
+        buffer.writeDoubleLE(drawable.topLeftY + drawable.height / 2, offset + 16);
+        offset += DRAWABLE_RECORD_BYTES;
+    }
+    pythonProcess.stdin.write(buffer);  // Send data via stdin
 }
 
 function sendOneTimeDataToPython(gameBoundsDimensions, pathGridDimensions, unwalkableCellsExpanded, evalMode, pythonProcess) {
     // Convert the data to JSON and send it to Python
-    pythonProcess.stdin.write(JSON.stringify({
-        type: 'oneTimeData',
-        data: {gameBoundsDimensions,pathGridDimensions, unwalkableCellsExpanded, evalMode}
-    }) + '\n'); // Sending one-time data
+    const json = Buffer.from(JSON.stringify({gameBoundsDimensions,pathGridDimensions, unwalkableCellsExpanded, evalMode}));
+    const buffer = Buffer.allocUnsafe(5 + json.length);
+    buffer.writeUInt32LE(1 + json.length, 0);
+    buffer.writeUInt8(MESSAGE_ONE_TIME_DATA, 4);
+    json.copy(buffer, 5);
+    pythonProcess.stdin.write(buffer); // Sending one-time data
+}
+
+function readMessagesFromPython(pythonProcess, onMessage) {
+    // Cuts the stdout stream of Python back into length-prefixed messages and passes each payload to onMessage
+    let pending = Buffer.alloc(0);
+    pythonProcess.stdout.on('data', (chunk) => {
+        pending = pending.length ? Buffer.concat([pending, chunk]) : chunk;
+        while (pending.length >= 4 && pending.length >= 4 + pending.readUInt32LE(0)) {
+            const payloadLength = pending.readUInt32LE(0);
+            onMessage(pending.subarray(4, 4 + payloadLength));
+            pending = pending.subarray(4 + payloadLength);
+        }
+    });
+}
+
+function applyPositionDeltas(payload, drawables) {
+    if (payload.readUInt8(0) != MESSAGE_DELTAS) {
+        console.log(`Unknown message type ${payload.readUInt8(0)} from Python`);
+        return;
+    }
+    // Replies come in order, but Python only answers the newest of the ticks it received while busy
+    lastAnsweredTick = payload.readUInt32LE(1);
+    const count = payload.readUInt16LE(5);
+    let offset = 7;
+    for (let i = 0; i < count; i++) {
+        const clientId = payload.readInt32LE(offset);
+        const existingDrawable = drawables.find(d => d.clientId === clientId);
+        if (existingDrawable) {
+            existingDrawable.topLeftX += payload.readDoubleLE(offset + 4);
+            existingDrawable.topLeftY += payload.readDoubleLE(offset + 12);
+        }
+        offset += DELTA_RECORD_BYTES;
+    }
 }
 
 
 
-export { disconnect, sendPlayerCount, findHighestScore, addListeners, respawnPlayer, turnLevelToExperience, updateLevel, checkForDeath, createFood, checkForRespawn, createProjectile, sendServerInfo, checkCollision, knockbackWithDmg, clamp, range, isInUnwalkableCell, createAgent, generateRandomWalls, getRandomInt, sendDrawablesToPython, sendOneTimeDataToPython, getRandomPosition }
\ No newline at end of file
+export { disconnect, sendPlayerCount, findHighestScore, addListeners, respawnPlayer, turnLevelToExperience, updateLevel, checkForDeath, createFood, checkForRespawn, createProjectile, sendServerInfo, checkCollision, knockbackWithDmg, clamp, range, isInUnwalkableCell, createAgent, generateRandomWalls, getRandomInt, sendDrawablesToPython, sendOneTimeDataToPython, readMessagesFromPython, applyPositionDeltas, getRandomPosition }
\ No newline at end of file
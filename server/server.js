@@ -14,7 +14,7 @@ import {
 	checkCollision,
 	clamp,
 	isInUnwalkableCell,
-	createAgent, range, generateRandomWalls, sendDrawablesToPython, sendOneTimeDataToPython
+	createAgent, range, generateRandomWalls, sendDrawablesToPython, sendOneTimeDataToPython, readMessagesFromPython, applyPositionDeltas
 } from './functions.js';
 import { router } from './routes.js'
 import { spawn } from 'child_process';
@@ -73,24 +73,9 @@ expressWs(app)
 app.use(limiter);
 app.use(router);
 
-import readline from 'readline';
-
-const rl = readline.createInterface({
-	input: pythonProcess.stdout,
-	crlfDelay: Infinity
-});
-
-rl.on('line', (line) => {
+readMessagesFromPython(pythonProcess, (payload) => {
 	try {
-		const parsedData = JSON.parse(line);
-
-		parsedData.forEach(newDrawable => {
-			const existingDrawable = drawables.find(d => d.clientId === newDrawable.clientId);
-			if (existingDrawable) {
-				existingDrawable.topLeftX = newDrawable.topLeftX;
-				existingDrawable.topLeftY = newDrawable.topLeftY;
-			}
-		});
+		applyPositionDeltas(payload, drawables);
 	} catch (e) {
 		console.log(e);
 	}